@@ -2,12 +2,18 @@ from __future__ import annotations
 
 from fastapi import FastAPI
 
+from app.api.webhooks import klingai as klingai_webhooks
 from app.api.webhooks import payments as payments_webhooks
+from app.api.webhooks import telegram as telegram_webhooks
 
 app = FastAPI(title="Live Photo API")
 
 # Вебхук от YooKassa
 app.include_router(payments_webhooks.router)
+# Callback KlingAI о готовности видео
+app.include_router(klingai_webhooks.router)
+# Апдейты Telegram в режиме вебхука (раскладываются по шардам бота)
+app.include_router(telegram_webhooks.router)
 
 @app.get("/healthz")
 async def healthz():
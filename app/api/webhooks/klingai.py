@@ -0,0 +1,53 @@
+from __future__ import annotations
+
+import hmac
+import logging
+
+from fastapi import APIRouter, Depends, Request, Response, status
+
+from app.application.services.message_bus import publish
+from app.infrastructure.db.base import get_session
+from app.infrastructure.providers.kling_poller import KLING_TASK_CHANNEL
+from app.settings import settings
+
+router = APIRouter(prefix="/webhook/klingai", tags=["klingai"])
+log = logging.getLogger("webhooks.klingai")
+
+
+def _token_ok(request: Request) -> bool:
+    # без секрета callback не включается (см. callback_url) — значит, запрос пришёл не от KlingAI
+    secret = settings.KLINGAI_CALLBACK_SECRET
+    if not secret:
+        return False
+    token = request.query_params.get("token", "")
+    return hmac.compare_digest(token, secret)
+
+
+@router.post("")
+async def klingai_callback(request: Request, session=Depends(get_session)):
+    """
+    Callback KlingAI о смене статуса задачи.
+    URL передаётся в create_video: KLINGAI_CALLBACK_URL={BASE_PUBLIC_URL}/webhook/klingai
+    В шину (Postgres NOTIFY) уходит только task_id: бот сразу запрашивает статус задачи у KlingAI.
+    Статусу и ссылке на видео из тела не доверяем — ссылку потом скачивает бот.
+    """
+    if not _token_ok(request):
+        log.warning("Reject klingai callback: bad token from %s", request.client.host if request.client else "")
+        return Response(status_code=status.HTTP_403_FORBIDDEN)
+
+    try:
+        payload = await request.json()
+    except ValueError:
+        return Response(status_code=status.HTTP_400_BAD_REQUEST)
+    if not isinstance(payload, dict):
+        return Response(status_code=status.HTTP_400_BAD_REQUEST)
+
+    # KlingAI шлёт блок задачи либо как есть, либо обёрнутым в data
+    block = payload.get("data") if isinstance(payload.get("data"), dict) else payload
+    task_id = str(block.get("task_id") or "")
+    if not task_id:
+        return Response(status_code=status.HTTP_400_BAD_REQUEST)
+
+    log.info("klingai callback task_id=%s status=%s", task_id, block.get("task_status"))
+    await publish(session, KLING_TASK_CHANNEL, {"task_id": task_id})
+    return Response(status_code=status.HTTP_200_OK)
@@ -0,0 +1,44 @@
+from __future__ import annotations
+
+import hmac
+import logging
+
+from fastapi import APIRouter, Depends, Request, Response, status
+
+from app.infrastructure.db.base import get_session
+from app.infrastructure.telegram.updates import ingest_update
+from app.settings import settings
+
+router = APIRouter(prefix="/webhook/telegram", tags=["telegram"])
+log = logging.getLogger("webhooks.telegram")
+
+
+def _secret_ok(request: Request) -> bool:
+    # без секрета любой POST выдал бы себя за Telegram (в том числе за админа) — такие запросы не принимаем
+    secret = settings.TELEGRAM_WEBHOOK_SECRET
+    if not secret:
+        return False
+    token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+    return hmac.compare_digest(token, secret)
+
+
+@router.post("")
+async def telegram_webhook(request: Request, session=Depends(get_session)):
+    """
+    Апдейты Telegram в режиме вебхука (BOT_MODE=webhook).
+    Бот-воркер шарда 0 сам регистрирует URL: TELEGRAM_WEBHOOK_URL={BASE_PUBLIC_URL}/webhook/telegram
+    Апдейт только сохраняется в очередь своего шарда — ответ Telegram уходит сразу.
+    """
+    if not _secret_ok(request):
+        log.warning("Reject telegram update: bad secret from %s", request.client.host if request.client else "")
+        return Response(status_code=status.HTTP_403_FORBIDDEN)
+
+    try:
+        update = await request.json()
+    except ValueError:
+        return Response(status_code=status.HTTP_400_BAD_REQUEST)
+    if not isinstance(update, dict) or "update_id" not in update:
+        return Response(status_code=status.HTTP_400_BAD_REQUEST)
+
+    await ingest_update(session, update, shards=settings.BOT_SHARDS)
+    return Response(status_code=status.HTTP_200_OK)
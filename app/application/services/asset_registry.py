@@ -0,0 +1,110 @@
+"""
+Реестр статичных медиа бота (промо-видео из pfoto/ и т.п.).
+
+Файл загружается в Telegram один раз; полученный file_id сохраняется в telegram_assets
+по ключу (sha256 содержимого, хэш токена бота, тип отправки) и дальше отправляется по file_id
+без повторной загрузки. При замене файла меняется хэш — новая версия загрузится автоматически.
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import logging
+import os
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from aiogram.types import FSInputFile
+
+from app.infrastructure.db.base import async_session
+from app.infrastructure.db.repositories.asset_repo import AssetRepo
+from app.settings import settings
+
+log = logging.getLogger("asset_registry")
+
+
+def _hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class AssetRegistry:
+    def __init__(self, bot_token: str) -> None:
+        self._bot_key = hashlib.sha256((bot_token or "").encode("utf-8")).hexdigest()[:16]
+        # path -> (mtime_ns, size, sha256): не перечитываем файл на каждый рендер
+        self._hashes: Dict[str, Tuple[int, int, str]] = {}
+        # (sha256, kind) -> file_id
+        self._file_ids: Dict[Tuple[str, str], str] = {}
+        self.uploads = 0
+        self.reuses = 0
+
+    async def _content_hash(self, path: str) -> str:
+        st = os.stat(path)
+        cached = self._hashes.get(path)
+        if cached and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+            return cached[2]
+        content_hash = await asyncio.to_thread(_hash_file, path)
+        self._hashes[path] = (st.st_mtime_ns, st.st_size, content_hash)
+        return content_hash
+
+    async def file_id(self, path: str, kind: str) -> Optional[str]:
+        content_hash = await self._content_hash(path)
+        key = (content_hash, kind)
+        if key in self._file_ids:
+            return self._file_ids[key]
+        try:
+            async with async_session() as s:
+                file_id = await AssetRepo(s).get(content_hash=content_hash, bot_key=self._bot_key, kind=kind)
+        except Exception as exc:  # noqa: BLE001
+            log.warning("asset lookup failed for %s: %s", path, exc)
+            return None
+        if file_id:
+            self._file_ids[key] = file_id
+        return file_id
+
+    async def input_file(self, path: str, kind: str) -> Tuple[str | FSInputFile, bool]:
+        """
+        Что передать в send_video/send_document: file_id, если файл уже загружен, иначе сам файл.
+        Второй элемент — True, если отдали сохранённый file_id.
+        """
+        file_id = await self.file_id(path, kind)
+        if file_id:
+            self.reuses += 1
+            return file_id, True
+        self.uploads += 1
+        return FSInputFile(path, filename=Path(path).name), False
+
+    async def remember(self, path: str, kind: str, file_id: str) -> None:
+        if not file_id:
+            return
+        content_hash = await self._content_hash(path)
+        self._file_ids[(content_hash, kind)] = file_id
+        try:
+            async with async_session() as s:
+                await AssetRepo(s).put(content_hash=content_hash, bot_key=self._bot_key, kind=kind, file_id=file_id)
+                await s.commit()
+        except Exception as exc:  # noqa: BLE001
+            log.warning("asset store failed for %s: %s", path, exc)
+
+    async def forget(self, path: str, kind: str) -> None:
+        content_hash = await self._content_hash(path)
+        self._file_ids.pop((content_hash, kind), None)
+        try:
+            async with async_session() as s:
+                await AssetRepo(s).delete(content_hash=content_hash, bot_key=self._bot_key, kind=kind)
+                await s.commit()
+        except Exception as exc:  # noqa: BLE001
+            log.warning("asset delete failed for %s: %s", path, exc)
+
+
+_registry: AssetRegistry | None = None
+
+
+def get_asset_registry() -> AssetRegistry:
+    global _registry
+    if _registry is None:
+        _registry = AssetRegistry(os.getenv("BOT_TOKEN") or settings.BOT_TOKEN)
+    return _registry
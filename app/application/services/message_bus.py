@@ -0,0 +1,179 @@
+"""
+Лёгкая шина событий между процессами поверх Postgres LISTEN/NOTIFY.
+
+    publish(session, channel, payload)  — отправить событие (в текущей транзакции)
+    publish_on_commit(session, ...)     — отправить, только когда транзакция зафиксирована
+    subscribe(channel, handler)         — подписаться в этом процессе
+    PgListener(channels).start()        — слушать NOTIFY от других процессов (API <-> бот)
+
+Подписчики своего процесса вызываются сразу; NOTIFY несёт идентификатор процесса-отправителя,
+чтобы слушатель не доставлял своё же событие второй раз. На не-Postgres базах (sqlite в dev/тестах)
+событие доставляется только локально.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List
+
+from sqlalchemy import event, text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, AsyncSession
+from sqlalchemy.orm import Session
+
+log = logging.getLogger("message_bus")
+
+Handler = Callable[[Dict[str, Any]], Awaitable[None] | None]
+
+_ORIGIN = f"{os.getpid()}:{uuid.uuid4().hex[:8]}"
+_handlers: Dict[str, List[Handler]] = {}
+# события сессии, ждущие commit: ключ — сериализованное событие (одинаковые схлопываются)
+_ON_COMMIT = "message_bus.on_commit"
+
+
+def subscribe(channel: str, handler: Handler) -> None:
+    _handlers.setdefault(channel, []).append(handler)
+
+
+def unsubscribe(channel: str, handler: Handler) -> None:
+    handlers = _handlers.get(channel) or []
+    if handler in handlers:
+        handlers.remove(handler)
+
+
+async def dispatch(channel: str, payload: Dict[str, Any]) -> None:
+    for handler in list(_handlers.get(channel) or []):
+        try:
+            result = handler(payload)
+            if asyncio.iscoroutine(result):
+                await result
+        except Exception as exc:  # noqa: BLE001
+            log.warning("handler for %s failed: %s", channel, exc)
+
+
+def _message(payload: Dict[str, Any]) -> str:
+    return json.dumps({"origin": _ORIGIN, "payload": payload}, ensure_ascii=False, default=str)
+
+
+async def publish(session: AsyncSession, channel: str, payload: Dict[str, Any]) -> None:
+    await dispatch(channel, payload)
+    bind = session.get_bind()
+    if bind.dialect.name != "postgresql":
+        return
+    await session.execute(
+        text("SELECT pg_notify(:channel, :message)"), {"channel": channel, "message": _message(payload)}
+    )
+
+
+def publish_on_commit(session: AsyncSession, channel: str, payload: Dict[str, Any]) -> None:
+    """
+    Событие о записи, которое имеет смысл только после commit (например, сброс кэшей):
+    NOTIFY уходит одним запросом на всю транзакцию внутри commit, локальные подписчики
+    вызываются сразу после него и поэтому не перечитают данные до фиксации. При rollback событие пропадает.
+    """
+    pending = session.info.get(_ON_COMMIT)
+    if pending is None:
+        pending = session.info[_ON_COMMIT] = {}
+        sync = session.sync_session
+        event.listen(sync, "before_commit", _notify_pending)
+        event.listen(sync, "after_commit", _dispatch_pending)
+        event.listen(sync, "after_rollback", _drop_pending)
+    key = json.dumps([channel, payload], sort_keys=True, default=str)
+    pending[key] = (channel, payload)
+
+
+def _notify_pending(session: Session) -> None:
+    pending = session.info.get(_ON_COMMIT)
+    if not pending or session.get_bind().dialect.name != "postgresql":
+        return
+    channels = [channel for channel, _ in pending.values()]
+    messages = [_message(payload) for _, payload in pending.values()]
+    session.execute(
+        text("SELECT pg_notify(c, m) FROM unnest(CAST(:channels AS text[]), CAST(:messages AS text[])) AS t(c, m)"),
+        {"channels": channels, "messages": messages},
+    )
+
+
+def _dispatch_pending(session: Session) -> None:
+    pending = session.info.get(_ON_COMMIT)
+    if not pending:
+        return
+    events = list(pending.values())
+    pending.clear()
+    for channel, payload in events:
+        for handler in list(_handlers.get(channel) or []):
+            try:
+                result = handler(payload)
+                if asyncio.iscoroutine(result):
+                    asyncio.ensure_future(result)
+            except Exception as exc:  # noqa: BLE001
+                log.warning("handler for %s failed: %s", channel, exc)
+
+
+def _drop_pending(session: Session) -> None:
+    pending = session.info.get(_ON_COMMIT)
+    if pending:
+        pending.clear()
+
+
+class PgListener:
+    """
+    Держит отдельное соединение с LISTEN на нужные каналы и раздаёт события локальным подписчикам.
+    При обрыве соединения переподключается.
+    """
+
+    def __init__(self, engine: AsyncEngine, channels: List[str], *, reconnect_delay: float = 5.0) -> None:
+        self._engine = engine
+        self._channels = list(channels)
+        self._reconnect_delay = reconnect_delay
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        if self._engine.dialect.name != "postgresql":
+            return
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._task = None
+
+    def _on_notify(self, _conn, _pid, channel: str, message: str) -> None:
+        try:
+            data = json.loads(message)
+        except ValueError:
+            return
+        if data.get("origin") == _ORIGIN:
+            return
+        asyncio.get_running_loop().create_task(dispatch(channel, data.get("payload") or {}))
+
+    async def _run(self) -> None:
+        while True:
+            conn: AsyncConnection | None = None
+            try:
+                conn = await self._engine.connect()
+                raw = await conn.get_raw_connection()
+                driver = raw.driver_connection
+                for channel in self._channels:
+                    await driver.add_listener(channel, self._on_notify)
+                closed = asyncio.Event()
+                driver.add_termination_listener(lambda _c: closed.set())
+                await closed.wait()
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:  # noqa: BLE001
+                log.warning("LISTEN %s failed: %s", self._channels, exc)
+            finally:
+                if conn is not None:
+                    try:
+                        await conn.close()
+                    except Exception:
+                        pass
+            await asyncio.sleep(self._reconnect_delay)
@@ -0,0 +1,266 @@
+"""
+Общий «тикер» сообщений прогресса генераций.
+
+Вместо корутины на каждую генерацию, которая раз в 1.2с редактирует своё сообщение,
+один цикл владеет всеми живыми сообщениями прогресса и тратит общий бюджет правок
+(`edits_per_second`, token bucket):
+
+    - смена этапа и разовые тексты (место в очереди) идут первыми;
+    - анимация точек — на остаток бюджета; интервал между правками одного сообщения растёт
+      с числом сообщений (n / бюджет), но не выходит из [min_interval, max_interval];
+    - несколько обновлений одного сообщения схлопываются в одну правку с последним текстом;
+    - на 429 от Telegram (retry_after) все правки ставятся на паузу.
+
+Сами правки идут через общий исходящий лимитер с низким приоритетом.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Dict, Hashable, List, Optional, Sequence
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+
+from app.infrastructure.telegram.outbound import PRIORITY_LOW, outbound_priority
+
+log = logging.getLogger("progress_ticker")
+
+
+def with_dots(base: str, dots: int) -> str:
+    if "..." in base:
+        return base.replace("...", "." * dots)
+    return f"{base.rstrip('. ')}{'.' * dots}"
+
+
+@dataclass
+class _Live:
+    chat_id: int
+    message_id: int
+    stages: List[str] = field(default_factory=list)
+    delays: List[float] = field(default_factory=list)
+    started: float = 0.0
+    shown_stage: int = -1
+    dots: int = 3
+    last_edit: float = 0.0
+    last_text: Optional[str] = None
+    pending_text: Optional[str] = None
+    busy: bool = False
+
+    def stage_at(self, now: float) -> int:
+        elapsed = now - self.started
+        idx = 0
+        for delay in self.delays:
+            if elapsed < delay or idx >= len(self.stages) - 1:
+                break
+            elapsed -= delay
+            idx += 1
+        return idx
+
+
+@dataclass
+class TickerStats:
+    live: int
+    edits: int
+    skipped: int
+    retry_after: int
+    interval: float
+
+
+class ProgressTicker:
+    def __init__(
+        self,
+        bot: Bot,
+        *,
+        edits_per_second: float = 10.0,
+        min_interval: float = 1.2,
+        max_interval: float = 10.0,
+        tick: float = 0.2,
+    ) -> None:
+        self._bot = bot
+        self._rate = max(0.1, float(edits_per_second))
+        self._burst = max(1.0, self._rate)
+        self._tokens = self._burst
+        self._min_interval = float(min_interval)
+        self._max_interval = float(max_interval)
+        self._tick = float(tick)
+        self._live: Dict[Hashable, _Live] = {}
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._inflight: set[asyncio.Task] = set()
+        self._paused_until = 0.0
+        self._last_refill = 0.0
+        self.edits = 0
+        self.skipped = 0
+        self.retry_after = 0
+
+    # ---------- публичный API ----------
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._task = None
+        for task in list(self._inflight):
+            task.cancel()
+        self._live.clear()
+
+    def track(
+        self,
+        key: Hashable,
+        *,
+        chat_id: int,
+        message_id: int,
+        stages: Sequence[str],
+        delays: Sequence[float],
+        first_stage_shown: bool = True,
+    ) -> None:
+        """
+        Берёт сообщение под управление: этапы сменяются через delays секунд, между ними анимируются точки.
+        first_stage_shown=False — в сообщении сейчас другой текст, первый этап нужно показать сразу.
+        """
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        self._live[key] = _Live(
+            chat_id=chat_id,
+            message_id=message_id,
+            stages=list(stages),
+            delays=list(delays),
+            started=now,
+            shown_stage=0 if first_stage_shown else -1,
+            last_edit=now,
+            last_text=with_dots(stages[0], 3) if first_stage_shown and stages else None,
+        )
+        self.start()
+        self._wakeup.set()
+
+    def push(self, key: Hashable, *, chat_id: int, message_id: int, text: str) -> None:
+        """
+        Разовая правка вне расписания этапов (например, место в очереди); идёт в приоритете.
+        """
+        live = self._live.get(key)
+        if live is None:
+            live = _Live(chat_id=chat_id, message_id=message_id)
+            self._live[key] = live
+        live.pending_text = text
+        self.start()
+        self._wakeup.set()
+
+    def release(self, key: Hashable) -> None:
+        self._live.pop(key, None)
+
+    def stats(self) -> TickerStats:
+        return TickerStats(
+            live=len(self._live),
+            edits=self.edits,
+            skipped=self.skipped,
+            retry_after=self.retry_after,
+            interval=self._interval(),
+        )
+
+    # ---------- планирование ----------
+
+    def _interval(self) -> float:
+        animated = sum(1 for live in self._live.values() if live.stages)
+        return max(self._min_interval, min(self._max_interval, animated / self._rate))
+
+    def _refill(self, now: float) -> None:
+        if self._last_refill:
+            self._tokens = min(self._burst, self._tokens + (now - self._last_refill) * self._rate)
+        self._last_refill = now
+
+    def _due(self, now: float) -> List[tuple[Hashable, _Live, str]]:
+        urgent: List[tuple[float, Hashable, _Live, str]] = []
+        regular: List[tuple[float, Hashable, _Live, str]] = []
+        interval = self._interval()
+        for key, live in self._live.items():
+            if live.busy:
+                continue
+            if live.pending_text is not None:
+                urgent.append((live.last_edit, key, live, live.pending_text))
+                continue
+            if not live.stages:
+                continue
+            stage = live.stage_at(now)
+            if stage != live.shown_stage:
+                urgent.append((live.last_edit, key, live, with_dots(live.stages[stage], 3)))
+            elif now - live.last_edit >= interval:
+                dots = (live.dots % 3) + 1
+                regular.append((live.last_edit, key, live, with_dots(live.stages[stage], dots)))
+        urgent.sort(key=lambda item: item[0])
+        regular.sort(key=lambda item: item[0])
+        return [(key, live, text) for _, key, live, text in urgent + regular]
+
+    async def _edit(self, key: Hashable, live: _Live, text: str, stage: int | None, dots: int | None) -> None:
+        try:
+            # анимация прогресса уступает готовым видео и ответам пользователям
+            with outbound_priority(PRIORITY_LOW):
+                await self._bot.edit_message_text(
+                    text,
+                    chat_id=live.chat_id,
+                    message_id=live.message_id,
+                    parse_mode="HTML",
+                )
+            self.edits += 1
+        except TelegramRetryAfter as exc:
+            self.retry_after += 1
+            loop = asyncio.get_running_loop()
+            self._paused_until = max(self._paused_until, loop.time() + float(exc.retry_after))
+            log.warning("progress edits paused for %ss (429)", exc.retry_after)
+            return
+        except Exception:
+            # «message is not modified», удалённое сообщение и т.п. — не повторяем
+            pass
+        finally:
+            live.busy = False
+        live.last_text = text
+        if live.pending_text == text:
+            live.pending_text = None
+        if stage is not None:
+            live.shown_stage = stage
+        if dots is not None:
+            live.dots = dots
+
+    def _dispatch(self, now: float) -> None:
+        for key, live, text in self._due(now):
+            if self._tokens < 1:
+                break
+            if text == live.last_text:
+                # схлопнули: текст не изменился — правка не нужна
+                self.skipped += 1
+                live.last_edit = now
+                if live.pending_text == text:
+                    live.pending_text = None
+                continue
+            stage = dots = None
+            if live.pending_text is None and live.stages:
+                stage = live.stage_at(now)
+                dots = 3 if stage != live.shown_stage else (live.dots % 3) + 1
+            self._tokens -= 1
+            live.busy = True
+            live.last_edit = now
+            task = asyncio.create_task(self._edit(key, live, text, stage, dots))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            self._wakeup.clear()
+            now = loop.time()
+            self._refill(now)
+            if now >= self._paused_until and self._live:
+                self._dispatch(now)
+            timeout = self._tick if self._live else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
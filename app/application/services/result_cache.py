@@ -0,0 +1,132 @@
+"""
+Кэш готовых результатов «оживления фото».
+
+Повторный запуск тем же пользователем с тем же фото (file_unique_id), промптом, форматом
+и моделью отдаёт уже загруженное в Telegram видео по file_id — без нового запроса в KlingAI.
+Кэш личный: file_unique_id у пересланного фото тот же, и без user_id в ключе чужое оплаченное
+видео получил бы любой. Попадание оплачивается так же, как генерация (см. AnimatePhoto).
+Записи живут RESULT_CACHE_TTL секунд; сверх RESULT_CACHE_MAX_ENTRIES вытесняются давно не использованные.
+Чистка идёт не на каждой записи, а раз в RESULT_CACHE_EVICT_EVERY сохранений.
+"""
+from __future__ import annotations
+
+import hashlib
+import logging
+from dataclasses import dataclass
+from threading import Lock
+from typing import Optional
+
+from app.infrastructure.db.base import async_session
+from app.infrastructure.db.repositories.result_cache_repo import ResultCacheRepo
+from app.settings import settings
+
+log = logging.getLogger("result_cache")
+
+
+@dataclass(frozen=True)
+class CachedResult:
+    file_id: str
+    media_type: str  # video | document
+
+
+@dataclass(frozen=True)
+class ResultCacheStats:
+    hits: int
+    misses: int
+    stores: int
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+_LOCK = Lock()
+_hits = 0
+_misses = 0
+_stores = 0
+
+
+def normalize_prompt(prompt: str) -> str:
+    return " ".join((prompt or "").lower().split())
+
+
+def cache_key(*, user_id: int, photo_unique_id: str, prompt: str, aspect: str, model: str) -> str:
+    raw = "|".join([str(int(user_id)), photo_unique_id, normalize_prompt(prompt), aspect or "9:16", model])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _enabled() -> bool:
+    return settings.RESULT_CACHE_TTL > 0
+
+
+def _count(hit: bool) -> None:
+    global _hits, _misses
+    with _LOCK:
+        if hit:
+            _hits += 1
+        else:
+            _misses += 1
+
+
+async def lookup(
+    *,
+    user_id: int,
+    photo_unique_id: str | None,
+    prompt: str,
+    aspect: str,
+    model: str,
+) -> Optional[CachedResult]:
+    if not _enabled() or not photo_unique_id:
+        return None
+    key = cache_key(user_id=user_id, photo_unique_id=photo_unique_id, prompt=prompt, aspect=aspect, model=model)
+    try:
+        async with async_session() as s:
+            row = await ResultCacheRepo(s).hit(key=key, ttl_seconds=settings.RESULT_CACHE_TTL)
+            await s.commit()
+    except Exception as exc:  # noqa: BLE001
+        log.warning("result cache lookup failed: %s", exc)
+        return None
+    _count(row is not None)
+    if row is None:
+        return None
+    return CachedResult(file_id=row[0], media_type=row[1])
+
+
+async def remember(
+    *,
+    user_id: int,
+    photo_unique_id: str | None,
+    prompt: str,
+    aspect: str,
+    model: str,
+    file_id: str,
+    media_type: str = "video",
+) -> None:
+    global _stores
+    if not _enabled() or not photo_unique_id or not file_id:
+        return
+    key = cache_key(user_id=user_id, photo_unique_id=photo_unique_id, prompt=prompt, aspect=aspect, model=model)
+    with _LOCK:
+        evict = (_stores + 1) % max(1, settings.RESULT_CACHE_EVICT_EVERY) == 0
+    try:
+        async with async_session() as s:
+            repo = ResultCacheRepo(s)
+            await repo.put(key=key, user_id=user_id, file_id=file_id, media_type=media_type)
+            if evict:
+                await repo.evict(ttl_seconds=settings.RESULT_CACHE_TTL, max_entries=settings.RESULT_CACHE_MAX_ENTRIES)
+            await s.commit()
+    except Exception as exc:  # noqa: BLE001
+        log.warning("result cache store failed: %s", exc)
+        return
+    with _LOCK:
+        _stores += 1
+
+
+def get_stats() -> ResultCacheStats:
+    """
+    Счётчики только этого процесса (для логов и тестов); сводка по всем процессам —
+    в админ-дашборде, из generation_history.
+    """
+    with _LOCK:
+        return ResultCacheStats(hits=_hits, misses=_misses, stores=_stores)
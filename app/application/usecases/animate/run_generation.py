@@ -0,0 +1,357 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import re
+from datetime import datetime, timezone
+from typing import Awaitable, Callable
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import FSInputFile, InlineKeyboardButton, InlineKeyboardMarkup
+
+from app.application.services import result_cache
+from app.application.services.progress_ticker import ProgressTicker
+from app.bot.admin.live_metrics import finish_generation, start_generation
+from app.bot.i18n import DEFAULT_LANG, translate
+from app.domain.models.generation_job import GenerationJob, QueuedJob
+from app.infrastructure.db.base import async_session
+from app.infrastructure.db.repositories.job_repo import JobRepo
+from app.infrastructure.db.repositories.user_repo import UserRepo
+from app.infrastructure.media.processor import get_media_processor, media_workspace
+from app.infrastructure.providers.kling_poller import get_status_poller
+from app.infrastructure.queue.job_runner import CHARGE_BUCKET, STATUS_REQUEUE
+from app.infrastructure.telegram.outbound import PRIORITY_HIGH, outbound_priority
+from app.infrastructure.providers.klingai import DEFAULT_MODEL, KlingClient, KlingError, KlingRateLimited
+from app.settings import settings
+
+log = logging.getLogger("animate.generation")
+
+OnDelivered = Callable[[int, str, str | None, str | None], Awaitable[None] | None]
+
+
+def _sanitize_prompt(text: str) -> str:
+    # вырезаем IPv4, чтобы не ловить блокировку "prompt not allowed because it contains IP"
+    ipv4 = re.compile(r"\b(?:\d{1,3}\.){3}\d{1,3}\b")
+    return ipv4.sub("[ip]", text)
+
+
+class RunAnimateGeneration:
+    """
+    Выполняет одну задачу «оживления фото» из очереди generation_jobs:
+    KlingAI create -> poll -> download -> ffmpeg -> отправка результата пользователю.
+
+    Промежуточный task_id сохраняется в задаче, поэтому после рестарта
+    генерация продолжает опрос уже созданной задачи KlingAI, а не оплачивает новую.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        *,
+        on_delivered: OnDelivered | None = None,
+        ticker: ProgressTicker | None = None,
+    ) -> None:
+        self.bot = bot
+        self.on_delivered = on_delivered
+        self.ticker = ticker or ProgressTicker(
+            bot,
+            edits_per_second=settings.PROGRESS_EDITS_PER_SECOND,
+            min_interval=settings.PROGRESS_MIN_INTERVAL,
+            max_interval=settings.PROGRESS_MAX_INTERVAL,
+        )
+        # задачи, которым показывали место в очереди вместо первого этапа прогресса
+        self._queue_shown: set[int] = set()
+
+    def _t(self, job: GenerationJob, key: str, **kwargs) -> str:
+        lang = job.payload.get("lang") or DEFAULT_LANG
+        return translate(lang, key, **kwargs)
+
+    def _actions(self, job: GenerationJob):
+        return InlineKeyboardMarkup(
+            inline_keyboard=[[InlineKeyboardButton(text=self._t(job, "buttons.change_format"), callback_data="nav:format.select")]]
+        )
+
+    def _final_actions(self, job: GenerationJob):
+        buttons = [
+            InlineKeyboardButton(text=self._t(job, "buttons.try_more"), callback_data="nav:flow.animate"),
+        ]
+        return InlineKeyboardMarkup(inline_keyboard=[buttons])
+
+    async def _attach(self, job: GenerationJob, **fields) -> None:
+        try:
+            async with async_session() as s:
+                await JobRepo(s).attach(job_id=job.id, **fields)
+                await s.commit()
+        except Exception as exc:  # noqa: BLE001
+            log.warning("Failed to update job id=%s: %s", job.id, exc)
+
+    async def show_queue_position(self, job: QueuedJob, position: int) -> None:
+        """
+        Обновляет сообщение прогресса ожидающей задачи: «вы в очереди: N».
+        """
+        if not job.progress_message_id or not job.chat_id:
+            return
+        text = translate(job.lang or DEFAULT_LANG, "animate.queue_position", position=position)
+        self.ticker.push(job.id, chat_id=job.chat_id, message_id=job.progress_message_id, text=text)
+        self._queue_shown.add(job.id)
+
+    def forget_queue_position(self, job_id: int) -> None:
+        """
+        Задача ушла из очереди (выполнена, снята, упала до старта) — место в очереди больше не ведём.
+        """
+        self.ticker.release(job_id)
+        self._queue_shown.discard(job_id)
+
+    async def _reply_error(self, job: GenerationJob, text: str) -> None:
+        try:
+            await self.bot.send_message(
+                chat_id=job.chat_id,
+                text=text,
+                parse_mode="HTML",
+                reply_markup=self._actions(job),
+            )
+        except Exception:
+            pass
+
+    async def __call__(self, job: GenerationJob) -> str:
+        try:
+            async with media_workspace() as workdir:
+                return await self._run(job, workdir)
+        finally:
+            # в том числе если задача упала до _run; отложенную задачу место в очереди покажет заново
+            self.forget_queue_position(job.id)
+
+    async def _run(self, job: GenerationJob, workdir: str) -> str:
+        bot = self.bot
+        chat_id = job.chat_id
+        progress_message_id = job.progress_message_id
+        stage_texts = [
+            self._t(job, "animate.preparing_stage1"),
+            self._t(job, "animate.preparing_stage2"),
+            self._t(job, "animate.preparing_stage3"),
+        ]
+
+        # Сообщение прогресса ведёт общий тикер: этапы через 40с, точки — в пределах бюджета правок
+        first_stage_shown = job.id not in self._queue_shown
+        self._queue_shown.discard(job.id)
+        if progress_message_id is None:
+            try:
+                sent = await bot.send_message(chat_id=chat_id, text=stage_texts[0], parse_mode="HTML")
+                progress_message_id = sent.message_id
+                first_stage_shown = True
+                await self._attach(job, progress_message_id=progress_message_id)
+            except Exception:
+                progress_message_id = None
+        if progress_message_id:
+            self.ticker.track(
+                job.id,
+                chat_id=chat_id,
+                message_id=progress_message_id,
+                stages=stage_texts,
+                delays=[40, 40],
+                first_stage_shown=first_stage_shown,
+            )
+
+        async def _stop_progress(keep_message: bool = False):
+            self.ticker.release(job.id)
+            if progress_message_id and not keep_message:
+                try:
+                    await bot.delete_message(chat_id=chat_id, message_id=progress_message_id)
+                except Exception:
+                    pass
+
+        payload = job.payload
+        try:
+            file = await bot.get_file(payload["photo_file_id"])
+            if not settings.BOT_TOKEN:
+                raise RuntimeError("BOT_TOKEN не задан")
+            photo_url = f"https://api.telegram.org/file/bot{settings.BOT_TOKEN}/{file.file_path}"
+        except Exception:
+            await _stop_progress()
+            await self._reply_error(job, "Не удалось получить фото, попробуйте снова.")
+            return "failed"
+
+        prompt = _sanitize_prompt((payload.get("prompt") or "")[:500])
+        aspect = payload.get("aspect") or "9:16"
+        log_id = job.history_id
+        if log_id is None:
+            request_info = f"prompt={prompt[:120]} | aspect={aspect}"
+            try:
+                async with async_session() as s:
+                    log_id = await UserRepo(s).start_generation(
+                        telegram_id=job.user_id,
+                        model="klingai",
+                        request=request_info,
+                        cost=None,
+                        generation_type="animate_photo",
+                    )
+                    await s.commit()
+                await self._attach(job, history_id=log_id)
+            except Exception:
+                log_id = None
+
+        try:
+            await bot.send_chat_action(chat_id, "upload_video")
+        except Exception:
+            pass
+
+        gen_token = None
+        gen_status = "failed"
+        delay_notice_task = None
+        delay_notice_event = asyncio.Event()
+
+        async def _delay_notice() -> None:
+            try:
+                await asyncio.wait_for(delay_notice_event.wait(), timeout=600)
+            except asyncio.TimeoutError:
+                try:
+                    await bot.send_message(chat_id=chat_id, text=self._t(job, "animate.delay_notice"))
+                except Exception:
+                    pass
+
+        try:
+            client = KlingClient()
+            gen_token = start_generation(job.user_id, "animate_photo", "klingai")
+            task_id = job.task_id
+            elapsed = 0.0
+            if task_id:
+                # задача KlingAI уже создана до рестарта — продолжаем ждать её, а не создаём новую
+                elapsed = max(0.0, (datetime.now(timezone.utc) - job.created_at).total_seconds())
+            else:
+                gen = await client.create_video(
+                    prompt=prompt,
+                    image_url=photo_url,
+                    model_name=payload.get("model") or DEFAULT_MODEL,
+                    duration="5",
+                )
+                task_id = gen.id
+                await self._attach(job, task_id=task_id)
+            delay_notice_task = asyncio.create_task(_delay_notice())
+            status = await get_status_poller().wait(task_id, elapsed=elapsed)
+            if not status.video_url:
+                raise KlingError("KlingAI не вернул ссылку на видео")
+            raw_path = os.path.join(workdir, "kling.mp4")
+            await client.download_to(status.video_url, raw_path)
+            # без списания видео не отдаём: ошибка здесь завершает задачу как failed
+            await self._charge(job)
+            gen_status = "succeeded"
+        except KlingRateLimited as exc:
+            # KlingAI перегружен нашими запросами — задача вернётся в очередь, пользователь ждёт дальше
+            log.info("job id=%s: KlingAI rate limit, requeue: %s", job.id, exc)
+            gen_status = STATUS_REQUEUE
+            return STATUS_REQUEUE
+        except KlingError as exc:
+            log.warning("job id=%s: KlingAI error: %s", job.id, exc)
+            await self._reply_error(job, self._t(job, "animate.error_unavailable"))
+            return "failed"
+        except Exception as exc:  # noqa: BLE001
+            log.warning("job id=%s: generation failed: %s", job.id, exc)
+            await self._reply_error(job, "Не удалось собрать видео, попробуйте ещё раз.")
+            return "failed"
+        finally:
+            delay_notice_event.set()
+            if delay_notice_task:
+                try:
+                    await delay_notice_task
+                except Exception:
+                    pass
+            if gen_token:
+                finish_generation(gen_token)
+            if log_id is not None and gen_status != STATUS_REQUEUE:
+                try:
+                    async with async_session() as s:
+                        await UserRepo(s).finish_generation(
+                            generation_id=log_id,
+                            status=gen_status,
+                            cost=1 if gen_status == "succeeded" else 0,
+                        )
+                        await s.commit()
+                except Exception:
+                    pass
+            await _stop_progress(keep_message=gen_status == STATUS_REQUEUE)
+
+        video_path = await get_media_processor().fit_for_telegram(raw_path, aspect, os.path.join(workdir, "result.mp4"))
+        # готовый результат обгоняет в исходящей очереди анимацию прогресса и прочие сообщения
+        with outbound_priority(PRIORITY_HIGH):
+            await self._deliver(job, video_path)
+        return "succeeded"
+
+    async def _charge(self, job: GenerationJob) -> None:
+        """
+        Обычно генерация списана ещё при постановке в очередь (enqueue_generation) — тогда здесь
+        ничего не делается. Задачи без отметки (поставленные до резервирования) списываются здесь
+        ровно один раз: charged_at ставится в той же транзакции, что и условное списание,
+        поэтому повторный прогон после рестарта баланс не трогает, а пустой баланс не уходит в минус.
+        """
+        if job.charged_at is not None:
+            return
+        try:
+            async with async_session() as s:
+                if await JobRepo(s).mark_charged(job.id):
+                    left = await UserRepo(s).debit_balance(telegram_id=job.user_id, bucket=CHARGE_BUCKET)
+                    if left is None:
+                        raise RuntimeError("not enough animate balance")
+                await s.commit()
+        except Exception:
+            log.exception("job id=%s: failed to charge user %s", job.id, job.user_id)
+            raise
+
+    async def _deliver(self, job: GenerationJob, video_path: str) -> None:
+        caption = self._t(job, "animate.ready_final")
+        parse_mode = "HTML"
+        resp = None
+        for as_document in (False, True):
+            file = FSInputFile(video_path, filename="result.mp4")
+            try:
+                if as_document:
+                    resp = await self.bot.send_document(
+                        job.chat_id,
+                        file,
+                        caption=caption,
+                        parse_mode=parse_mode,
+                        reply_markup=self._final_actions(job),
+                    )
+                else:
+                    resp = await self.bot.send_video(
+                        job.chat_id,
+                        file,
+                        caption=caption,
+                        parse_mode=parse_mode,
+                        reply_markup=self._final_actions(job),
+                    )
+                break
+            except TelegramBadRequest as exc:
+                log.warning("Failed to send video for user %s: %s", job.user_id, exc)
+            except Exception as exc:  # noqa: BLE001
+                log.warning("Failed to send video for user %s: %s", job.user_id, exc)
+                break
+
+        if resp is None:
+            try:
+                await self.bot.send_message(job.chat_id, "Не удалось отправить видео. Попробуйте ещё раз чуть позже.")
+            except Exception:
+                pass
+            return
+
+        delivered = getattr(resp, "video", None) or getattr(resp, "document", None)
+        payload = job.payload
+        if delivered is not None:
+            await result_cache.remember(
+                user_id=job.user_id,
+                photo_unique_id=payload.get("photo_unique_id"),
+                prompt=payload.get("prompt") or "",
+                aspect=payload.get("aspect") or "9:16",
+                model=payload.get("model") or DEFAULT_MODEL,
+                file_id=delivered.file_id,
+                media_type="video" if getattr(resp, "video", None) else "document",
+            )
+
+        if self.on_delivered and getattr(resp, "video", None):
+            try:
+                result = self.on_delivered(job.user_id, resp.video.file_id, caption, parse_mode)
+                if asyncio.iscoroutine(result):
+                    await result
+            except Exception:
+                pass
@@ -6,6 +6,7 @@ from decimal import Decimal
 
 from app.infrastructure.db.repositories.payment_repo import PaymentRepo
 from app.infrastructure.db.repositories.user_repo import UserRepo
+from app.infrastructure.telegram.outbound import PRIORITY_HIGH, RetryAfter, get_outbound_limiter
 from app.bot.i18n import DEFAULT_LANG, translate
 from app.bot.ui import ikb_rows
 from app.settings import settings
@@ -174,15 +175,15 @@ class ApplyWebhook:
         if not settings.BOT_TOKEN:
             self.log.warning("Skip notify: BOT_TOKEN not configured")
             return
-        url = f"https://api.telegram.org/bot{settings.BOT_TOKEN}/sendMessage"
         # Позволяем работать с самоподписанными сертификатами/корневым CA,
         # чтобы уведомления не падали из-за MITM/корпоративного прокси.
         verify_target = settings.TELEGRAM_CA_BUNDLE or settings.TELEGRAM_VERIFY_SSL
         try:
             async with httpx.AsyncClient(timeout=10, verify=verify_target) as cli:
-                resp = await cli.post(
-                    url,
-                    json={
+                resp = await self._post(
+                    cli,
+                    "sendMessage",
+                    {
                         "chat_id": tg_id,
                         "text": text,
                         "parse_mode": parse_mode,
@@ -209,7 +210,6 @@ class ApplyWebhook:
         try:
             async with httpx.AsyncClient(timeout=10, verify=verify_target) as cli:
                 if photo_id:
-                    url = f"https://api.telegram.org/bot{settings.BOT_TOKEN}/sendPhoto"
                     payload = {
                         "chat_id": tg_id,
                         "photo": photo_id,
@@ -218,10 +218,9 @@ class ApplyWebhook:
                     }
                     if reply_markup:
                         payload["reply_markup"] = reply_markup
-                    resp = await cli.post(url, json=payload)
+                    resp = await self._post(cli, "sendPhoto", payload)
                     if resp.status_code == 200:
                         return
-                url = f"https://api.telegram.org/bot{settings.BOT_TOKEN}/sendMessage"
                 payload = {
                     "chat_id": tg_id,
                     "text": text,
@@ -229,12 +228,31 @@ class ApplyWebhook:
                 }
                 if reply_markup:
                     payload["reply_markup"] = reply_markup
-                resp = await cli.post(url, json=payload)
+                resp = await self._post(cli, "sendMessage", payload)
                 if resp.status_code == 403:
                     await self._mark_banned(tg_id)
         except Exception as e:
             self.log.warning("Failed to send notify tg_id=%s err=%s", tg_id, e)
 
+    async def _post(self, cli: httpx.AsyncClient, method: str, payload: dict) -> httpx.Response:
+        """
+        Запрос к Bot API через общий исходящий лимитер: платёжные уведомления идут в приоритете,
+        на 429 лимитер выжидает retry_after и повторяет запрос.
+        """
+        url = f"https://api.telegram.org/bot{settings.BOT_TOKEN}/{method}"
+
+        async def send() -> httpx.Response:
+            resp = await cli.post(url, json=payload)
+            if resp.status_code == 429:
+                try:
+                    retry_after = float((resp.json().get("parameters") or {}).get("retry_after") or 1)
+                except Exception:
+                    retry_after = 1.0
+                raise RetryAfter(retry_after)
+            return resp
+
+        return await get_outbound_limiter().call(payload.get("chat_id"), send, priority=PRIORITY_HIGH)
+
     def _format_amount(self, amount: dict | None) -> str | None:
         if not amount or not isinstance(amount, dict):
             return None
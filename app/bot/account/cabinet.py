@@ -5,6 +5,7 @@ from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
 
 class Cabinet:
     slug = "account.cabinet"
+    snapshot_groups = ("balances", "referrals")
 
     async def render(self, ctx):
         snap = await ctx.ensure_snapshot()
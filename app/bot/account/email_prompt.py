@@ -22,6 +22,7 @@ class EmailForReceipt:
     """
 
     slug = "payments.email"
+    snapshot_groups = ("balances",)
     _CANCEL = "email:cancel"
 
     @classmethod
@@ -8,6 +8,7 @@ from app.settings import settings
 
 class Referral:
     slug = "account.referral"
+    snapshot_groups = ("balances", "referrals")
 
     async def render(self, ctx):
         snap = await ctx.ensure_snapshot()
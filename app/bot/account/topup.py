@@ -5,12 +5,13 @@ from datetime import datetime, timedelta
 
 from app.bot.ui import ikb_rows
 from app.bot.account.email_prompt import EmailForReceipt
-from app.bot.context import BotContext, State
+from app.bot.context import BotContext
 from app.settings import settings
 
 
 class TopUp:
     slug = "account.topup"
+    snapshot_groups = ("balances",)
 
     PACKAGES = [
         ("1", "✨ Купить 1 генерацию — 250 ₽", 250, 1),
@@ -234,9 +235,9 @@ async def topup_callbacks(dp, state_storage):
                         pass
             await s.commit()
 
-        st = state_storage.setdefault(cq.from_user.id, State())
-        ctx = BotContext(user_id=cq.from_user.id, state=st)
-        await ctx.ensure_snapshot(refresh=True)
+        st = await state_storage.get(cq.from_user.id)
+        ctx = BotContext(user_id=cq.from_user.id, state=st, bot=cq.bot)
+        await ctx.ensure_snapshot(groups=TopUp.snapshot_groups, refresh=True)
 
         async def _animate_success(meta: dict | None = None):
             st.current_page = "flow.animate"
@@ -5,8 +5,12 @@ from typing import Dict, Tuple, List
 
 from sqlalchemy import text
 
+from app.bot.known_users import KnownUsersStats, get_known_users
+from app.bot.snapshot_cache import SnapshotCacheStats, get_snapshot_cache
 from app.bot.admin.live_metrics import get_active_generations, get_online_user_ids
 from app.infrastructure.db.base import async_session
+from app.infrastructure.telegram.admission import GateStats, get_update_gate
+from app.infrastructure.telegram.mailboxes import MailboxStats, get_mailboxes
 from app.settings import settings
 
 
@@ -44,6 +48,13 @@ class AdminStats:
     api_costs_today: Dict[str, Tuple[int, Decimal, Decimal]]
     last_requests: List[RecentRequest]
     segments: Dict[str, Tuple[int, float]]
+    # из generation_history, то есть по всем процессам: выдано из кэша / сгенерировано в KlingAI сегодня
+    result_cache_served_today: int
+    result_cache_entries: int
+    mailboxes: MailboxStats
+    update_gate: GateStats
+    snapshot_cache: SnapshotCacheStats
+    known_users: KnownUsersStats
 
 
 def _fmt_int(val: int) -> str:
@@ -165,7 +176,9 @@ async def fetch_admin_stats() -> AdminStats:
         rows = await s.execute(
             text(
                 """
-                SELECT generation_type, COUNT(*) AS cnt
+                SELECT generation_type,
+                       SUM(CASE WHEN model = 'result_cache' THEN 0 ELSE 1 END) AS cnt,
+                       SUM(CASE WHEN model = 'result_cache' THEN 1 ELSE 0 END) AS cached
                   FROM generation_history
                  WHERE status = 'succeeded' AND DATE(timestamp) = :today
                  GROUP BY generation_type
@@ -174,7 +187,9 @@ async def fetch_admin_stats() -> AdminStats:
             {"today": today},
         )
         mapped = rows.mappings().all()
-        counts_today = {str(r["generation_type"]): int(r["cnt"]) for r in mapped if r.get("generation_type")}
+        # выдачи из кэша результатов пишутся в историю как animate_photo, но KlingAI не стоят
+        counts_today = {str(r["generation_type"]): int(r["cnt"] or 0) for r in mapped if r.get("generation_type")}
+        result_cache_served_today = sum(int(r["cached"] or 0) for r in mapped)
         kling_count = counts_today.get("animate_photo", 0)
         kling_cost_usd = kling_usd * kling_count
         api_costs_today: Dict[str, Tuple[int, Decimal, Decimal]] = {
@@ -228,6 +243,8 @@ async def fetch_admin_stats() -> AdminStats:
 
         active_by_type: Dict[str, int] = {}
         active_by_provider: Dict[str, int] = {}
+        result_cache_entries = int(await s.scalar(text("SELECT COUNT(*) FROM generation_cache")) or 0)
+
         for gen in active_generations:
             if gen.generation_type:
                 active_by_type[gen.generation_type] = active_by_type.get(gen.generation_type, 0) + 1
@@ -257,6 +274,12 @@ async def fetch_admin_stats() -> AdminStats:
         api_costs_today=api_costs_today,
         last_requests=last_requests,
         segments=segments,
+        result_cache_served_today=result_cache_served_today,
+        result_cache_entries=result_cache_entries,
+        mailboxes=get_mailboxes().stats(),
+        update_gate=get_update_gate().stats(),
+        snapshot_cache=get_snapshot_cache().stats(),
+        known_users=get_known_users().stats(),
     )
 
 
@@ -333,6 +356,32 @@ def render_stats_message(stats: AdminStats) -> str:
         label = provider_labels.get(provider_key, provider_key)
         lines.append(f"• {label}: {_fmt_int(count)} ген | {_fmt_money(rub)} ₽ / {_fmt_usd(usd)} $")
 
+    served = stats.result_cache_served_today
+    generated = stats.api_costs_today.get("klingai", (0, Decimal("0"), Decimal("0")))[0]
+    lines.append(
+        f"♻️ Кэш результатов сегодня: {_fmt_int(served)} из кэша / {_fmt_int(generated)} в KlingAI "
+        f"({(served / (served + generated) * 100) if served + generated else 0:.1f}%), "
+        f"записей {_fmt_int(stats.result_cache_entries)}"
+    )
+    boxes = stats.mailboxes
+    lines.append(
+        f"📬 Очереди апдейтов: {_fmt_int(boxes.active)} польз. в работе, ждут {_fmt_int(boxes.waiting)}, "
+        f"глубина {boxes.deepest} (макс. {boxes.max_depth}), обработано {_fmt_int(boxes.processed)}"
+    )
+    gate = stats.update_gate
+    lines.append(
+        f"🚦 Нагрузка: в работе {gate.inflight}/{gate.max_inflight} (пик {gate.peak_inflight}), "
+        f"в очереди {_fmt_int(gate.queued)} (пик {_fmt_int(gate.peak_queued)}), "
+        f"сброшено {_fmt_int(gate.shed_queue_full)} по переполнению / {_fmt_int(gate.shed_stale)} устаревших"
+    )
+    snaps = stats.snapshot_cache
+    lookups = snaps.hits + snaps.misses
+    lines.append(
+        f"🗂 Кэш профилей: {_fmt_int(snaps.size)} снапшотов, попаданий "
+        f"{(snaps.hits / lookups * 100) if lookups else 0:.1f}%, сбросов {_fmt_int(snaps.invalidations)}; "
+        f"известных пользователей {_fmt_int(stats.known_users.size)}"
+    )
+
     lines.append("")
     lines.append("🧾 Последние 10 запросов:")
     if stats.last_requests:
@@ -10,6 +10,7 @@ from app.infrastructure.db.repositories.user_repo import UserRepo
 
 class AdminPayPfoto:
     slug = "admin.paypfoto"
+    snapshot_groups = ()
     _NUM_RE = re.compile(r"\d+")
     _BACK_CB = "admin:menu"
 
@@ -1,14 +1,32 @@
 from __future__ import annotations
 
+import string
 from dataclasses import dataclass, field
-from typing import Any, Dict, List, Optional, Set
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Set
 
+from aiogram import Bot
+
+from app.bot.snapshot_cache import get_snapshot_cache
 from app.infrastructure.db.base import async_session
-from app.infrastructure.db.repositories.user_repo import UserRepo
+from app.infrastructure.db.repositories.user_repo import (
+    ALL_SNAPSHOT_GROUPS,
+    SNAPSHOT_BALANCES,
+    SNAPSHOT_FIELD_GROUPS,
+    UserRepo,
+)
+
+# ключ view с текстом, которому не хватило полей снапшота (см. BotContext.reply и resolve_view)
+_PENDING_KEY = "_snapshot_pending"
 
 
-@dataclass
+@dataclass(slots=True)
 class State:
+    """
+    Состояние диалога пользователя. Живёт в StateStore для каждого активного пользователя,
+    поэтому держим его компактным: __slots__ и только примитивы/ID — никаких объектов aiogram
+    (Message тянет за собой bot, chat, from_user и вложенные модели).
+    """
+
     # текущее «окно» бота
     current_page: str = "start"
     # показывали ли экран запуска (картинка «На главную»)
@@ -20,8 +38,10 @@ class State:
 
     # сценарий «Живое фото»
     animate_photo_file_id: str | None = None
+    animate_photo_unique_id: str | None = None
     animate_photo_prompt: str | None = None
-    animate_last_message: Any | None = None
+    # чат, из которого пришло фото: туда отправляем прогресс и результат
+    animate_chat_id: int | None = None
     animate_hint_message_id: int | None = None
     share_video_file_id: str | None = None
     share_video_caption: str | None = None
@@ -45,15 +65,22 @@ class BotContext:
 
     - `user_id` — Telegram ID пользователя
     - `state` — храним текущее «окно», выборы и т.д.
+    - `bot` — бот, получивший апдейт (для отправок вне ответа на конкретное сообщение)
     - `snapshot` — лениво подгружаемые данные пользователя из БД
       (баланс, кол-во друзей, user_id). Вызвать `await ensure_snapshot()`
       до использования.
+    - `snapshot_groups` — группы полей снапшота, которые нужны текущей странице
+      (`Page.snapshot_groups`, выставляет роутер); по умолчанию — все.
     """
 
-    def __init__(self, user_id: int, state: State):
+    def __init__(self, user_id: int, state: State, bot: Bot | None = None):
         self.user_id = user_id
         self.state = state
+        self.bot = bot
         self._user_snapshot: Optional[Dict[str, Any]] = None
+        # какие группы уже лежат в _user_snapshot
+        self._loaded_groups: Set[str] = set()
+        self.snapshot_groups: FrozenSet[str] = ALL_SNAPSHOT_GROUPS
 
     # ---------- Вспомогательные структуры ----------
 
@@ -86,8 +113,11 @@ class BotContext:
             self.state.flashes.clear()
             text = prefix + text
         snap = self._user_snapshot or {}
-        text = text.format_map(self._SnapshotDict(snap))
-        view = {"text": text, "buttons": buttons}
+        view = {"text": text.format_map(self._SnapshotDict(snap)), "buttons": buttons}
+        missing = _snapshot_groups_in(text) - self._loaded_groups
+        if missing:
+            # reply синхронный: недостающие группы дочитает resolve_view перед отправкой
+            view[_PENDING_KEY] = _PendingText(self, text, frozenset(missing))
         if parse_mode:
             view["parse_mode"] = parse_mode
         if photo:
@@ -131,18 +161,91 @@ class BotContext:
             raise RuntimeError("Call await ctx.ensure_snapshot() before using ctx.snapshot")
         return self._user_snapshot
 
-    async def ensure_snapshot(self, *, refresh: bool = False) -> Dict[str, Any]:
+    async def ensure_snapshot(
+        self,
+        *,
+        groups: Optional[Iterable[str]] = None,
+        refresh: bool = False,
+        cached: bool = True,
+    ) -> Dict[str, Any]:
         """
-        Лениво подтягивает (и кэширует на время апдейта) данные пользователя из БД.
-        Гарантирует, что юзер существует в таблице users (создаст при первом обращении).
+        Лениво подтягивает данные пользователя: из общего кэша снапшотов (его сбрасывает каждая
+        запись через UserRepo), иначе из БД — и запоминает на время апдейта.
+        Читаются только группы `groups` (по умолчанию — `snapshot_groups` текущей страницы),
+        которых ещё нет в контексте; страница без снапшота в БД не ходит вовсе.
+        Группа balances гарантирует, что юзер существует в таблице users.
         Возвращает dict с балансами: animate_balance_tokens и legacy balance_tokens.
+        refresh=True — перечитать после действий, которые могли изменить пользователя;
+        cached=False — прочитать из БД в обход общего кэша (перед платными действиями).
         """
-        if refresh or self._user_snapshot is None:
+        wanted = set(self.snapshot_groups if groups is None else groups)
+        if refresh:
+            self._user_snapshot = None
+            self._loaded_groups = set()
+        missing = wanted - self._loaded_groups
+        if not missing:
+            if self._user_snapshot is None:
+                self._user_snapshot = {}
+            return self._user_snapshot
+        cache = get_snapshot_cache()
+        snap = cache.get(self.user_id, missing) if cached else None
+        if snap is None:
+            generation = cache.generation
             async with async_session() as s:
                 repo = UserRepo(s)
-                snap = await repo.snapshot(telegram_id=self.user_id)
-                self._user_snapshot = snap
-                # Синхронизируем email из БД (включая очистку, если его убрали)
-                if "email" in snap:
-                    self.state.email = snap.get("email")
+                snap = await repo.snapshot(telegram_id=self.user_id, groups=missing)
+            # balances приходят с любой группой — строка users читается всегда
+            missing.add(SNAPSHOT_BALANCES)
+            cache.put(self.user_id, snap, groups=missing, generation=generation)
+        merged = dict(self._user_snapshot or {})
+        merged.update(snap)
+        self._user_snapshot = merged
+        self._loaded_groups |= {SNAPSHOT_FIELD_GROUPS[name] for name in snap if name in SNAPSHOT_FIELD_GROUPS}
+        # Синхронизируем email из БД (включая очистку, если его убрали)
+        if "email" in snap:
+            self.state.email = snap.get("email")
         return self._user_snapshot
+
+
+@dataclass(slots=True)
+class _PendingText:
+    ctx: BotContext
+    template: str
+    groups: FrozenSet[str]
+
+
+_formatter = string.Formatter()
+
+
+def _snapshot_groups_in(text: str) -> Set[str]:
+    """
+    Группы снапшота, поля которых упомянуты в шаблоне как плейсхолдеры ({friends_count} и т.п.).
+    """
+    if "{" not in text:
+        return set()
+    groups: Set[str] = set()
+    try:
+        for _, name, _, _ in _formatter.parse(text):
+            group = SNAPSHOT_FIELD_GROUPS.get(name or "")
+            if group:
+                groups.add(group)
+    except ValueError:
+        # непарные скобки: format_map в reply всё равно упадёт с понятной ошибкой
+        return set()
+    return groups
+
+
+async def resolve_view(view: Dict[str, Any] | None) -> Dict[str, Any] | None:
+    """
+    Дочитывает группы снапшота, которых не хватило тексту view в момент reply, и
+    переформатирует текст. Для view без таких плейсхолдеров ничего не делает.
+    """
+    if not view or _PENDING_KEY not in view:
+        return view
+    pending: _PendingText = view.pop(_PENDING_KEY)
+    snap = await pending.ctx.ensure_snapshot(groups=pending.groups)
+    text = pending.template.format_map(BotContext._SnapshotDict(snap))
+    if view.get("video_caption") == view.get("text"):
+        view["video_caption"] = text
+    view["text"] = text
+    return view
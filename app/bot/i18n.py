@@ -164,6 +164,19 @@ TRANSLATIONS = {
         "Готовлю ваше видео... ✨\n"
         "Фото уже «оживает» — запускаю движение и плавность..."
     ),
+    "animate.queue_position": (
+        "Ваше видео в очереди: <b>{position}</b> ⏳\n"
+        "Начну оживлять фото, как только освободится место."
+    ),
+    "system.busy_toast": "Бот сейчас перегружен, попробуйте через минуту 🙏",
+    "system.busy_message": (
+        "Сейчас очень много запросов ⏳\n"
+        "Повторите, пожалуйста, через минуту."
+    ),
+    "animate.already_queued": (
+        "Это видео уже готовится ⏳\n"
+        "Пришлю его, как только будет готово."
+    ),
     "animate.preparing_stage2": (
         "Сейчас аккуратно выравниваю мимику и мелкие детали,\n"
         "чтобы выглядело естественно... 💬"
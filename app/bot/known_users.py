@@ -0,0 +1,113 @@
+"""
+Кэш пользователей, которые уже точно есть в таблице users.
+
+Каждая команда бота начинается с `_ensure_user`: сессия, SELECT пользователя, при необходимости
+UPDATE username/имени и commit. Для пользователя, которого процесс уже видел, это лишние
+обращения к БД — поэтому здесь хранится отпечаток (username, first_name, last_name) последней
+записанной версии, и запись идёт только если Telegram прислал что-то новое.
+
+Запись забывается при смене сегмента (оплата, бан) или имени: событие USER_CHANGED_CHANNEL
+приходит и из этого процесса, и через NOTIFY из API. Размер ограничен `max_entries` (LRU).
+"""
+from __future__ import annotations
+
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+from app.settings import settings
+
+# изменения, после которых пользователя надо перепроверить в БД (балансы сюда не относятся)
+_IDENTITY_FIELDS = frozenset({"segment", "username", "first_name", "last_name"})
+
+
+@dataclass(slots=True)
+class _Fingerprint:
+    username: Optional[str]
+    first_name: Optional[str]
+    last_name: Optional[str]
+
+
+@dataclass(frozen=True)
+class KnownUsersStats:
+    size: int
+    hits: int
+    misses: int
+    invalidations: int
+
+
+class KnownUsers:
+    def __init__(self, *, max_entries: int = 100000) -> None:
+        self._max_entries = max(1, int(max_entries))
+        self._users: "OrderedDict[int, _Fingerprint]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def is_current(
+        self,
+        telegram_id: int,
+        *,
+        username: Optional[str] = None,
+        first_name: Optional[str] = None,
+        last_name: Optional[str] = None,
+    ) -> bool:
+        """
+        True, если пользователь уже записан и переданные поля совпадают с записанными
+        (None, как и в UserRepo.get_or_create, означает «не обновлять»).
+        """
+        known = self._users.get(int(telegram_id))
+        if known is None:
+            self.misses += 1
+            return False
+        for value, stored in ((username, known.username), (first_name, known.first_name), (last_name, known.last_name)):
+            if value is not None and value != stored:
+                self.misses += 1
+                return False
+        self._users.move_to_end(int(telegram_id))
+        self.hits += 1
+        return True
+
+    def remember(
+        self,
+        telegram_id: int,
+        *,
+        username: Optional[str],
+        first_name: Optional[str],
+        last_name: Optional[str],
+    ) -> None:
+        telegram_id = int(telegram_id)
+        self._users[telegram_id] = _Fingerprint(username, first_name, last_name)
+        self._users.move_to_end(telegram_id)
+        while len(self._users) > self._max_entries:
+            self._users.popitem(last=False)
+
+    def forget(self, telegram_id: int) -> None:
+        if self._users.pop(int(telegram_id), None) is not None:
+            self.invalidations += 1
+
+    def on_user_changed(self, payload: Dict[str, Any]) -> None:
+        telegram_id = payload.get("telegram_id")
+        if telegram_id is None:
+            return
+        fields = payload.get("fields")
+        if fields is None or _IDENTITY_FIELDS.intersection(fields):
+            self.forget(int(telegram_id))
+
+    def stats(self) -> KnownUsersStats:
+        return KnownUsersStats(
+            size=len(self._users),
+            hits=self.hits,
+            misses=self.misses,
+            invalidations=self.invalidations,
+        )
+
+
+_known: KnownUsers | None = None
+
+
+def get_known_users() -> KnownUsers:
+    global _known
+    if _known is None:
+        _known = KnownUsers(max_entries=settings.KNOWN_USERS_CACHE_SIZE)
+    return _known
@@ -1,31 +1,26 @@
 from __future__ import annotations
 
-import asyncio
-from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, Message
+import logging
 
-from app.bot.admin.live_metrics import finish_generation, start_generation
-from app.bot.ui import ikb_rows
+from aiogram import Bot
+from aiogram.types import Message
+
+from app.application.services import result_cache
+from app.bot.ui import SKIP_RENDER, ikb_rows
 from app.bot.account.topup import TopUp
 from app.infrastructure.db.base import async_session
 from app.infrastructure.db.repositories.user_repo import UserRepo
-from app.infrastructure.providers.klingai import KlingClient, KlingError
-from app.settings import settings
-import subprocess
-import tempfile
+from app.infrastructure.providers.klingai import DEFAULT_MODEL
+from app.infrastructure.queue.job_runner import CHARGE_BUCKET, enqueue_generation, has_pending_generation
+from app.infrastructure.telegram.outbound import PRIORITY_HIGH, outbound_priority
 from pathlib import Path
-from typing import Tuple
-import re
-
 
-async def _get_file_url(bot, file_id: str) -> str:
-    file = await bot.get_file(file_id)
-    if not settings.BOT_TOKEN:
-        raise RuntimeError("BOT_TOKEN не задан")
-    return f"https://api.telegram.org/file/bot{settings.BOT_TOKEN}/{file.file_path}"
+log = logging.getLogger("bot.animate")
 
 
 class AnimatePhoto:
     slug = "flow.animate"
+    snapshot_groups = ("balances",)
 
     def _preview_video_path(self) -> Path | None:
         candidates = [
@@ -44,24 +39,15 @@ class AnimatePhoto:
             ]
         )
 
-    def _final_actions(self, ctx):
-        buttons = [
-            InlineKeyboardButton(text=ctx.t("buttons.try_more"), callback_data="nav:flow.animate"),
-        ]
-        return InlineKeyboardMarkup(inline_keyboard=[buttons])
-
     def _paywall(self, ctx):
         rows = [[(title, f"topup_animate:{key}")] for key, title, _, _ in TopUp.ANIMATE_PACKAGES]
         view = ctx.reply(ctx.t("paywall.animate"), ikb_rows(rows), parse_mode="HTML", disable_preview=True)
         video_path = self._preview_video_path()
         if video_path and video_path.exists():
-            try:
-                view["video"] = video_path.read_bytes()
-                view["video_filename"] = video_path.name
-                view["video_caption"] = view.get("text")
-                view["video_parse_mode"] = view.get("parse_mode")
-            except Exception:
-                pass
+            view["video_path"] = str(video_path)
+            view["video_filename"] = video_path.name
+            view["video_caption"] = view.get("text")
+            view["video_parse_mode"] = view.get("parse_mode")
         return view
 
     async def render(self, ctx):
@@ -86,13 +72,10 @@ class AnimatePhoto:
         )
         video_path = self._preview_video_path()
         if video_path and video_path.exists():
-            try:
-                view["video"] = video_path.read_bytes()
-                view["video_filename"] = video_path.name
-                view["video_caption"] = view.get("text")
-                view["video_parse_mode"] = view.get("parse_mode")
-            except Exception:
-                pass
+            view["video_path"] = str(video_path)
+            view["video_filename"] = video_path.name
+            view["video_caption"] = view.get("text")
+            view["video_parse_mode"] = view.get("parse_mode")
         return view
 
     async def handle(self, ctx, m: str):
@@ -104,21 +87,23 @@ class AnimatePhoto:
             return ctx.reply(ctx.t("animate.waiting_photo"), self._actions(ctx), parse_mode="HTML")
 
         ctx.state.animate_photo_prompt = text
-        return await self._run_generation(ctx, message=ctx.state.animate_last_message)
+        # в личном чате chat_id совпадает с user_id
+        return await self._run_generation(ctx, bot=ctx.bot, chat_id=ctx.state.animate_chat_id or ctx.user_id)
 
     async def handle_photo(self, ctx, message: Message):
         if message.photo:
             ctx.state.animate_photo_file_id = message.photo[-1].file_id
-            ctx.state.animate_last_message = message
+            ctx.state.animate_photo_unique_id = message.photo[-1].file_unique_id
+            ctx.state.animate_chat_id = message.chat.id if message.chat else ctx.user_id
         caption = (message.caption or "").strip()
         if caption:
             ctx.state.animate_photo_prompt = caption
-            return await self._run_generation(ctx, message=message)
+            return await self._run_generation(ctx, bot=message.bot, chat_id=ctx.state.animate_chat_id)
 
         try:
             sent = await message.answer(ctx.t("animate.photo_received"), parse_mode="HTML")
             ctx.state.animate_hint_message_id = sent.message_id
-            return "__skip_render__"
+            return SKIP_RENDER
         except Exception:
             ctx.state.animate_hint_message_id = None
             return ctx.reply(ctx.t("animate.photo_received"), None, parse_mode="HTML")
@@ -133,320 +118,150 @@ class AnimatePhoto:
             return await TopUp().on_callback(ctx, query)
         if data == "run:animate":
             if ctx.state.animate_photo_file_id and ctx.state.animate_photo_prompt:
-                return await self._run_generation(ctx, message=query.message)
+                chat_id = query.message.chat.id if query.message and query.message.chat else ctx.user_id
+                return await self._run_generation(ctx, bot=query.bot, chat_id=chat_id)
             return self.slug
         if data.startswith("nav:"):
             return data.split("nav:", 1)[1]
         return None
 
-    async def _run_generation(self, ctx, message: Message | None):
+    async def _send_cached(self, ctx, bot: Bot, chat_id: int) -> bool:
+        cached = await result_cache.lookup(
+            user_id=ctx.user_id,
+            photo_unique_id=ctx.state.animate_photo_unique_id,
+            prompt=ctx.state.animate_photo_prompt or "",
+            aspect=ctx.state.video_format or "9:16",
+            model=DEFAULT_MODEL,
+        )
+        if cached is None:
+            return False
+        # сначала списание, потом отправка — как у очереди: неоплаченное видео не уходит
+        log_id = await self._charge_cached(ctx)
+        if log_id is None:
+            return False
+        caption = ctx.t("animate.ready_final")
+        markup = ikb_rows([[(ctx.t("buttons.try_more"), "nav:flow.animate")]])
+        try:
+            # как и свежая генерация, готовый результат идёт в исходящей очереди первым
+            with outbound_priority(PRIORITY_HIGH):
+                if cached.media_type == "document":
+                    await bot.send_document(chat_id, cached.file_id, caption=caption, parse_mode="HTML", reply_markup=markup)
+                else:
+                    await bot.send_video(chat_id, cached.file_id, caption=caption, parse_mode="HTML", reply_markup=markup)
+                    ctx.state.share_video_file_id = cached.file_id
+                    ctx.state.share_video_caption = caption
+                    ctx.state.share_video_parse_mode = "HTML"
+        except Exception:
+            # file_id мог стать недействительным — возвращаем списание и генерируем заново
+            await self._refund_cached(ctx, log_id)
+            return False
+        return True
+
+    async def _charge_cached(self, ctx) -> int | None:
+        """
+        Готовое видео стоит как генерация: условное списание и запись в истории одной транзакцией.
+        Возвращает id записи истории; None — не хватило баланса или БД недоступна (тогда обычный путь).
+        """
+        request_info = f"prompt={(ctx.state.animate_photo_prompt or '')[:120]} | aspect={ctx.state.video_format or '9:16'}"
+        try:
+            async with async_session() as s:
+                repo = UserRepo(s)
+                if await repo.debit_balance(telegram_id=ctx.user_id, bucket=CHARGE_BUCKET) is None:
+                    return None
+                log_id = await repo.start_generation(
+                    telegram_id=ctx.user_id,
+                    model="result_cache",
+                    request=request_info,
+                    cost=1,
+                    generation_type="animate_photo",
+                )
+                await repo.finish_generation(generation_id=log_id, status="succeeded", cost=1)
+                await s.commit()
+            return log_id
+        except Exception as exc:  # noqa: BLE001
+            log.warning("charge for cached result failed for user %s: %s", ctx.user_id, exc)
+            return None
+
+    async def _refund_cached(self, ctx, log_id: int) -> None:
+        try:
+            async with async_session() as s:
+                repo = UserRepo(s)
+                await repo.inc_balance(telegram_id=ctx.user_id, delta=1, bucket=CHARGE_BUCKET)
+                await repo.finish_generation(generation_id=log_id, status="failed", cost=0)
+                await s.commit()
+        except Exception as exc:  # noqa: BLE001
+            log.error("refund for undelivered cached result failed for user %s: %s", ctx.user_id, exc)
+
+    async def _run_generation(self, ctx, *, bot: Bot | None, chat_id: int | None):
         if not ctx.state.animate_photo_file_id:
             return ctx.reply(ctx.t("animate.waiting_photo"), self._actions(ctx), parse_mode="HTML")
         if not ctx.state.animate_photo_prompt:
             return ctx.reply(ctx.t("animate.waiting_photo"), self._actions(ctx), parse_mode="HTML")
 
         try:
-            if ctx.state.animate_hint_message_id and message and message.chat:
-                await message.bot.delete_message(chat_id=message.chat.id, message_id=ctx.state.animate_hint_message_id)
+            if ctx.state.animate_hint_message_id and bot and chat_id:
+                await bot.delete_message(chat_id=chat_id, message_id=ctx.state.animate_hint_message_id)
         except Exception:
             pass
         ctx.state.animate_hint_message_id = None
 
-        snap = await ctx.ensure_snapshot(refresh=True)
+        # баланс перед платной генерацией — прямо из БД
+        snap = await ctx.ensure_snapshot(refresh=True, cached=False)
         total_balance = snap.get("animate_balance_tokens", 0)
         if total_balance <= 0:
             return self._paywall(ctx)
 
-        bot = message.bot if message else None
-        if bot is None:
-            return ctx.reply(ctx.t("animate.error_unavailable"), self._actions(ctx), parse_mode="HTML")
-
-        # Сообщаем, что генерация началась, и обновляем статусы
-        preparing_msg = None
-        stop_event = asyncio.Event()
-        progress_task = None
-        stage_texts = [
-            ctx.t("animate.preparing_stage1"),
-            ctx.t("animate.preparing_stage2"),
-            ctx.t("animate.preparing_stage3"),
-        ]
-
-        async def _progress_updates():
-            nonlocal preparing_msg
-            delays = [40, 40]  # сек между обновлениями
-            dot_interval = 1.2
-
-            def _with_dots(base: str, dots: int) -> str:
-                if "..." in base:
-                    return base.replace("...", "." * dots)
-                return f"{base.rstrip('. ')}{'.' * dots}"
-
-            try:
-                loop = asyncio.get_event_loop()
-                for idx, base_text in enumerate(stage_texts):
-                    if stop_event.is_set():
-                        return
-                    dots = 3
-                    rendered = _with_dots(base_text, dots)
-                    if idx == 0:
-                        try:
-                            preparing_msg = await message.answer(rendered, parse_mode="HTML")
-                        except Exception:
-                            return
-                    else:
-                        try:
-                            await preparing_msg.edit_text(rendered, parse_mode="HTML")
-                        except Exception:
-                            pass
-
-                    stage_timeout = delays[idx] if idx < len(delays) else None
-                    started = loop.time()
-
-                    while True:
-                        if stop_event.is_set():
-                            return
-
-                        if stage_timeout is not None:
-                            elapsed = loop.time() - started
-                            if elapsed >= stage_timeout:
-                                break
-                            timeout = min(dot_interval, max(stage_timeout - elapsed, 0))
-                        else:
-                            timeout = dot_interval
+        # Этот пользователь уже генерировал то же самое — отдаём готовое видео без нового запроса в KlingAI
+        if bot is not None and chat_id and await self._send_cached(ctx, bot, chat_id):
+            return SKIP_RENDER
 
-                        try:
-                            await asyncio.wait_for(stop_event.wait(), timeout=timeout)
-                            return
-                        except asyncio.TimeoutError:
-                            pass
-
-                        dots = (dots % 3) + 1
-                        rendered = _with_dots(base_text, dots)
-                        try:
-                            await preparing_msg.edit_text(rendered, parse_mode="HTML")
-                        except Exception:
-                            pass
-
-                if not stop_event.is_set():
-                    await stop_event.wait()
-            except Exception:
-                pass
-
-        try:
-            progress_task = asyncio.create_task(_progress_updates())
-        except Exception:
-            pass
-
-        def _is_progress_message(text: str | None) -> bool:
-            if not text:
-                return False
-            normalized = text.replace(".", "")
-            for base in stage_texts:
-                base_norm = base.replace("...", "").replace(".", "")
-                if base_norm.strip() and base_norm in normalized:
-                    return True
-            return False
-
-        async def _stop_progress():
-            stop_event.set()
-            if progress_task:
-                try:
-                    await progress_task
-                except Exception:
-                    pass
-            if preparing_msg:
-                try:
-                    if _is_progress_message(getattr(preparing_msg, "text", None)):
-                        await bot.delete_message(chat_id=preparing_msg.chat.id, message_id=preparing_msg.message_id)
-                except Exception:
-                    pass
+        if bot is None or not chat_id:
+            return ctx.reply(ctx.t("animate.error_unavailable"), self._actions(ctx), parse_mode="HTML")
 
+        payload = {
+            "photo_file_id": ctx.state.animate_photo_file_id,
+            "prompt": ctx.state.animate_photo_prompt or "",
+            "photo_unique_id": ctx.state.animate_photo_unique_id,
+            "aspect": ctx.state.video_format or "9:16",
+            "model": DEFAULT_MODEL,
+            "lang": ctx.lang,
+        }
+        # Повторный тап по кнопке: такая же генерация уже в очереди — вторую не ставим
         try:
-            photo_url = await _get_file_url(bot, ctx.state.animate_photo_file_id)
+            duplicate = await has_pending_generation(
+                user_id=ctx.user_id,
+                match={k: payload[k] for k in ("photo_unique_id", "prompt", "aspect")},
+            )
         except Exception:
-            await _stop_progress()
-            return ctx.reply("Не удалось получить фото, попробуйте снова.", self._actions(ctx), parse_mode="HTML")
-
-        prompt_raw = ctx.state.animate_photo_prompt or ""
+            duplicate = False
+        if duplicate:
+            return ctx.reply(ctx.t("animate.already_queued"), self._actions(ctx), parse_mode="HTML")
 
-        def _sanitize_prompt(text: str) -> str:
-            # вырезаем IPv4, чтобы не ловить блокировку "prompt not allowed because it contains IP"
-            ipv4 = re.compile(r"\b(?:\d{1,3}\.){3}\d{1,3}\b")
-            return ipv4.sub("[ip]", text)
-
-        prompt = _sanitize_prompt(prompt_raw[:500])
-        aspect = ctx.state.video_format or "9:16"
-        request_info = f"prompt={prompt[:120]} | aspect={aspect}"
-        log_id = None
+        # Сразу показываем первый этап прогресса; дальше сообщение ведёт воркер очереди
+        progress_message_id = None
         try:
-            async with async_session() as s:
-                log_id = await UserRepo(s).start_generation(
-                    telegram_id=ctx.user_id,
-                    model="klingai",
-                    request=request_info,
-                    cost=None,
-                    generation_type="animate_photo",
-                )
-                await s.commit()
+            sent = await bot.send_message(chat_id, ctx.t("animate.preparing_stage1"), parse_mode="HTML")
+            progress_message_id = sent.message_id
         except Exception:
-            log_id = None
-
-        await bot.send_chat_action(ctx.user_id, "upload_video")
-
-        client = None
-        gen_token = None
-        gen_status = "failed"
-        delay_notice_task = None
-        delay_notice_event = asyncio.Event()
+            progress_message_id = None
 
-        async def _delay_notice() -> None:
-            try:
-                await asyncio.wait_for(delay_notice_event.wait(), timeout=600)
-            except asyncio.TimeoutError:
-                try:
-                    await bot.send_message(chat_id=ctx.user_id, text=ctx.t("animate.delay_notice"))
-                except Exception:
-                    pass
+        # генерация списывается в одной транзакции с постановкой в очередь: проверка баланса выше
+        # только подсказка, несколько задач подряд не уведут баланс в минус
         try:
-            client = KlingClient()
-            gen_token = start_generation(ctx.user_id, "animate_photo", "klingai")
-            gen = await client.create_video(
-                prompt=prompt,
-                image_url=photo_url,
-                duration="5",
+            job_id = await enqueue_generation(
+                user_id=ctx.user_id,
+                chat_id=chat_id,
+                payload=payload,
+                progress_message_id=progress_message_id,
             )
-            delay_notice_task = asyncio.create_task(_delay_notice())
-            status = await client.poll_until_ready(gen.id, interval=5.0, attempts=360)
-            if not status.video_url:
-                raise KlingError("KlingAI не вернул ссылку на видео")
-            video_bytes = await client.download_file(status.video_url)
-            gen_status = "succeeded"
-        except KlingError:
-            return ctx.reply(ctx.t("animate.error_unavailable"), self._actions(ctx), parse_mode="HTML")
         except Exception:
-            return ctx.reply("Не удалось собрать видео, попробуйте ещё раз.", self._actions(ctx), parse_mode="HTML")
-        finally:
-            delay_notice_event.set()
-            if delay_notice_task:
-                try:
-                    await delay_notice_task
-                except Exception:
-                    pass
-            if gen_token:
-                finish_generation(gen_token)
-            if log_id is not None:
-                try:
-                    async with async_session() as s:
-                        await UserRepo(s).finish_generation(
-                            generation_id=log_id,
-                            status=gen_status,
-                            cost=1 if gen_status == "succeeded" else 0,
-                        )
-                        await s.commit()
-                except Exception:
-                    pass
-            await _stop_progress()
-            if client:
-                try:
-                    await client.close()
-                except Exception:
-                    pass
-
-        if gen_status == "succeeded":
-            # списываем 1 генерацию
+            job_id = None
+            view = ctx.reply(ctx.t("animate.error_unavailable"), self._actions(ctx), parse_mode="HTML")
+        else:
+            view = self._paywall(ctx) if job_id is None else SKIP_RENDER
+        if job_id is None and progress_message_id:
             try:
-                async with async_session() as s:
-                    await UserRepo(s).inc_balance(telegram_id=ctx.user_id, delta=-1, bucket="animate")
-                    await s.commit()
-                await ctx.ensure_snapshot(refresh=True)
+                await bot.delete_message(chat_id=chat_id, message_id=progress_message_id)
             except Exception:
                 pass
-
-        filename = "result.mp4"
-
-        def _target_size(aspect: str) -> Tuple[int, int]:
-            if aspect == "16:9":
-                return 960, 540
-            if aspect == "1:1":
-                return 540, 540
-            return 540, 960  # 9:16
-
-        def _add_silent_audio(data: bytes, out_ext: str = "mp4") -> bytes:
-            try:
-                with tempfile.NamedTemporaryFile(suffix=".mp4", delete=True) as src, tempfile.NamedTemporaryFile(suffix=f".{out_ext}", delete=True) as dst:
-                    src.write(data)
-                    src.flush()
-                    cmd = [
-                        "ffmpeg",
-                        "-y",
-                        "-i",
-                        src.name,
-                        "-f",
-                        "lavfi",
-                        "-i",
-                        "anullsrc=channel_layout=stereo:sample_rate=44100",
-                        "-shortest",
-                        "-c:v",
-                        "libx264",
-                        "-pix_fmt",
-                        "yuv420p",
-                        "-c:a",
-                        "aac",
-                        "-movflags",
-                        "+faststart",
-                        dst.name,
-                    ]
-                    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-                    if result.returncode != 0:
-                        return data
-                    dst.seek(0)
-                    return dst.read()
-            except Exception:
-                return data
-
-        def _force_aspect(data: bytes, aspect: str) -> bytes:
-            try:
-                w, h = _target_size(aspect)
-                with tempfile.NamedTemporaryFile(suffix=".mp4", delete=True) as src, tempfile.NamedTemporaryFile(suffix=".mp4", delete=True) as dst:
-                    src.write(data)
-                    src.flush()
-                    vf = (
-                        f"scale={w}:{h}:force_original_aspect_ratio=decrease:flags=lanczos,"
-                        f"pad={w}:{h}:(ow-iw)/2:(oh-ih)/2,"
-                        "setsar=1"
-                    )
-                    cmd = [
-                        "ffmpeg",
-                        "-y",
-                        "-i",
-                        src.name,
-                        "-vf",
-                        vf,
-                        "-metadata:s:v:0",
-                        "rotate=0",
-                        "-c:v",
-                        "libx264",
-                        "-pix_fmt",
-                        "yuv420p",
-                        "-movflags",
-                        "+faststart",
-                        dst.name,
-                    ]
-                    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-                    if result.returncode != 0:
-                        return data
-                    dst.seek(0)
-                    return dst.read()
-            except Exception:
-                return data
-
-        video_bytes_aspect = _force_aspect(video_bytes, aspect)
-        video_bytes_mp4 = _add_silent_audio(video_bytes_aspect, out_ext="mp4")
-        return {
-            "video": video_bytes_mp4,
-            "video_filename": filename,
-            "video_caption": ctx.t("animate.ready_final"),
-            "video_parse_mode": "HTML",
-            "buttons": self._final_actions(ctx),
-            "disable_preview": True,
-        }
+        return view
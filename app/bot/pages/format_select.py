@@ -5,6 +5,7 @@ from app.bot.ui import ikb_rows
 
 class FormatSelect:
     slug = "format.select"
+    snapshot_groups = ()
 
     FORMATS = [
         ("9:16 - вертикальный формат", "9:16"),
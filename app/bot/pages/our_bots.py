@@ -3,6 +3,7 @@ from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
 
 class OurBots:
     slug = "our_bots"
+    snapshot_groups = ()
 
     async def render(self, ctx):
         buttons = InlineKeyboardMarkup(
@@ -5,6 +5,7 @@ from app.bot.ui import ikb_rows, kb
 
 class Start:
     slug = "start"
+    snapshot_groups = ()
 
     async def render(self, ctx):
         text = ctx.t("start.intro")
@@ -20,13 +21,11 @@ class Start:
         # Пробуем отправить приветственное видео как в примере
         video_path = Path("pfoto/старт.MP4")
         if video_path.exists():
-            try:
-                view["video"] = video_path.read_bytes()
-                view["video_filename"] = video_path.name
-                view["video_caption"] = view.get("text")
-                view["video_parse_mode"] = view.get("parse_mode")
-            except Exception:
-                pass
+            # отправляется по file_id из реестра ассетов, файл грузится в Telegram только один раз
+            view["video_path"] = str(video_path)
+            view["video_filename"] = video_path.name
+            view["video_caption"] = view.get("text")
+            view["video_parse_mode"] = view.get("parse_mode")
 
         return view
 
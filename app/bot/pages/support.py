@@ -5,6 +5,7 @@ from app.bot.ui import ikb_rows
 
 class Support:
     slug = "support"
+    snapshot_groups = ()
 
     async def render(self, ctx):
         buttons = InlineKeyboardMarkup(
@@ -1,24 +1,37 @@
 from __future__ import annotations
 
+from typing import FrozenSet
+
 from app.bot.context import BotContext
 from app.bot.pages import ALL_PAGES
+from app.bot.ui import SKIP_RENDER
+from app.infrastructure.db.repositories.user_repo import ALL_SNAPSHOT_GROUPS
 
 # Индекс по slug -> объект страницы
 PAGE_INDEX = {p.slug: p for p in ALL_PAGES}
 
 
+def page_snapshot_groups(page) -> FrozenSet[str]:
+    """
+    Группы снапшота, которые объявила страница (`snapshot_groups`); без объявления — все.
+    """
+    groups = getattr(page, "snapshot_groups", None)
+    return ALL_SNAPSHOT_GROUPS if groups is None else frozenset(groups)
+
+
 async def route(ctx: BotContext, incoming_text: str):
     """
     Универсальный маршрутизатор.
     1) Берём текущую страницу по slug из state
-    2) Гарантируем наличие снапшота пользователя (создаст его при первом заходе)
+    2) Подгружаем те группы снапшота, которые объявила страница (пользователь создаётся при первом заходе)
     3) Отдаём управление handle(), который может вернуть следующий slug
     4) Рендерим целевую страницу и возвращаем {"text", "buttons"}
     """
     # текущая страница (если slug неизвестен, идём на "start")
     page = PAGE_INDEX.get(ctx.state.current_page, PAGE_INDEX["start"])
 
-    # гарантируем, что в контексте есть данные юзера
+    # гарантируем, что в контексте есть нужные странице данные юзера
+    ctx.snapshot_groups = page_snapshot_groups(page)
     await ctx.ensure_snapshot()
 
     # сначала даём странице обработать входящий текст
@@ -27,6 +40,9 @@ async def route(ctx: BotContext, incoming_text: str):
     if isinstance(next_step, dict):
         return next_step
 
+    if next_step == SKIP_RENDER:
+        return None
+
     if next_step:
         ctx.state.current_page = next_step
 
@@ -34,6 +50,7 @@ async def route(ctx: BotContext, incoming_text: str):
     target = PAGE_INDEX.get(ctx.state.current_page, PAGE_INDEX["start"])
 
     # ещё раз гарантируем снапшот (на случай, если handle изменил юзера/баланс)
+    ctx.snapshot_groups = page_snapshot_groups(target)
     await ctx.ensure_snapshot(refresh=True)
 
     return await target.render(ctx)
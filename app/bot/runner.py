@@ -2,6 +2,7 @@ from __future__ import annotations
 
 import asyncio
 import os
+import signal
 import zlib
 from pathlib import Path
 
@@ -24,33 +25,61 @@ import logging
 from sqlalchemy import text
 from sqlalchemy.ext.asyncio import AsyncConnection
 
-from app.bot.context import BotContext, State
+from app.bot.context import BotContext, resolve_view
+from app.bot.known_users import get_known_users
+from app.bot.snapshot_cache import get_snapshot_cache
+from app.bot.state_store import StatePinMiddleware, get_state_store
 from app.bot.admin.dashboard import fetch_admin_stats, render_stats_message
 from app.bot.admin.live_metrics import touch_user_activity
-from app.bot.router import route, PAGE_INDEX
+from app.bot.router import route, PAGE_INDEX, page_snapshot_groups
 from app.bot.account.topup import topup_callbacks
+from app.bot.ui import SKIP_RENDER
+from app.application.usecases.animate.run_generation import RunAnimateGeneration
 from app.infrastructure.db.base import async_session, engine
-from app.infrastructure.db.repositories.user_repo import UserRepo
+from app.infrastructure.db.repositories.user_repo import USER_CHANGED_CHANNEL, UserRepo
+from app.application.services.asset_registry import get_asset_registry
+from app.application.services.message_bus import PgListener, subscribe
+from app.infrastructure.providers.kling_poller import KLING_TASK_CHANNEL, on_task_event, stop_status_poller
+from app.infrastructure.providers.klingai import close_shared_http_client
+from app.infrastructure.queue.job_runner import JobRunner
+from app.infrastructure.queue.job_scheduler import FairScheduler, parse_segment_weights
+from app.infrastructure.telegram.admission import AdmissionMiddleware, ConcurrencyMiddleware, get_update_gate
+from app.infrastructure.telegram.mailboxes import MailboxMiddleware, get_mailboxes
+from app.infrastructure.telegram.outbound import install_outbound_limiter
+from app.infrastructure.telegram.sharding import get_ring
+from app.infrastructure.telegram.updates import TELEGRAM_UPDATES_CHANNEL, UpdateConsumer
 from app.settings import settings
 
-SKIP_RENDER = "__skip_render__"
-
 load_dotenv()
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 
 dp = Dispatcher()
-user_states: dict[int, State] = {}
-
-def _bot_lock_key() -> int:
+# приём в ограниченную очередь → очередь пользователя → слот из BOT_MAX_INFLIGHT_UPDATES:
+# апдейты одного пользователя — строго по очереди, разных пользователей — параллельно, но не больше лимита
+update_gate = get_update_gate()
+dp.update.outer_middleware(AdmissionMiddleware(update_gate))
+dp.update.outer_middleware(MailboxMiddleware(get_mailboxes()))
+dp.update.outer_middleware(ConcurrencyMiddleware(update_gate, callback_ttl=settings.BOT_CALLBACK_TTL))
+# состояния диалогов: LRU в памяти поверх bot_states, запись отложенная
+state_store = get_state_store()
+# пока апдейт в обработке, State его автора не вытесняется из памяти
+dp.update.outer_middleware(StatePinMiddleware(state_store))
+# кто уже есть в users: команды не повторяют SELECT/UPDATE/commit без изменений
+known_users = get_known_users()
+
+def _bot_lock_key(shard: int = 0) -> int:
     token = BOT_TOKEN or settings.BOT_TOKEN or ""
     seed = f"live-photo-bot:{token}"
+    # шард 0 делит ключ с режимом long polling: они взаимоисключающие
+    if shard:
+        seed += f":shard{shard}"
     return zlib.crc32(seed.encode())
 
-async def _acquire_bot_lock() -> AsyncConnection | None:
+async def _acquire_bot_lock(shard: int = 0) -> AsyncConnection | None:
     conn: AsyncConnection | None = None
     try:
         conn = await engine.connect()
-        res = await conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": _bot_lock_key()})
+        res = await conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": _bot_lock_key(shard)})
         if res.scalar():
             return conn
     except Exception as exc:  # noqa: BLE001
@@ -59,9 +88,9 @@ async def _acquire_bot_lock() -> AsyncConnection | None:
         await conn.close()
     return None
 
-async def _release_bot_lock(conn: AsyncConnection) -> None:
+async def _release_bot_lock(conn: AsyncConnection, shard: int = 0) -> None:
     try:
-        await conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": _bot_lock_key()})
+        await conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": _bot_lock_key(shard)})
     except Exception as exc:  # noqa: BLE001
         logging.warning("Failed to release bot lock: %s", exc)
     finally:
@@ -92,6 +121,12 @@ async def _ensure_user(
     first_name: str | None = None,
     last_name: str | None = None,
 ) -> None:
+    # Пользователь уже записан и Telegram не прислал ничего нового — в БД не идём.
+    # invited_by на существующего пользователя не влияет; /start с источником идёт полным путём.
+    if not (source_key or source_value) and known_users.is_current(
+        user_id, username=username, first_name=first_name, last_name=last_name
+    ):
+        return
     async with async_session() as s:
         repo = UserRepo(s)
         inviter_telegram_id = None
@@ -102,7 +137,7 @@ async def _ensure_user(
                 inviter_telegram_id = inviter.telegram_id
                 inviter_internal_id = inviter.internal_id
 
-        await repo.get_or_create(
+        user, _created = await repo.get_or_create(
             telegram_id=user_id,
             username=username,
             first_name=first_name,
@@ -119,6 +154,12 @@ async def _ensure_user(
                 source_value=source_value,
             )
         await s.commit()
+    known_users.remember(
+        user_id,
+        username=user.username,
+        first_name=user.first_name,
+        last_name=user.last_name,
+    )
 
 async def _mark_ban(user_id: int) -> None:
     async with async_session() as s:
@@ -179,9 +220,9 @@ def _parse_start_payload(text: str | None) -> tuple[int | None, str | None, str
     return ref_id, source_key, source_value
 
 
-def ctx_for(m: Message) -> BotContext:
-    st = user_states.setdefault(m.from_user.id, State())
-    return BotContext(user_id=m.from_user.id, state=st)
+async def ctx_for(m: Message) -> BotContext:
+    st = await state_store.get(m.from_user.id)
+    return BotContext(user_id=m.from_user.id, state=st, bot=m.bot)
 
 
 def _menu_shortcut(ctx: BotContext, text: str | None) -> str | None:
@@ -215,7 +256,11 @@ def _menu_shortcut(ctx: BotContext, text: str | None) -> str | None:
     return None
 
 
-async def send_view(msg: Message | CallbackQuery, view: dict):
+async def send_view(msg: Message | CallbackQuery, view: dict | None):
+    # плейсхолдеры из групп снапшота, которые страница не объявила, дочитываются здесь
+    view = await resolve_view(view)
+    if not view:
+        return
     text = view.get("text")
     buttons = view.get("buttons")  # reply keyboard
     inline_buttons = view.get("inline_buttons") or view.get("photo_buttons")
@@ -225,7 +270,7 @@ async def send_view(msg: Message | CallbackQuery, view: dict):
     disable_preview = bool(view.get("disable_preview"))
     video_caption = view.get("video_caption")
     video_parse_mode = view.get("video_parse_mode") or parse_mode
-    use_video_caption = bool(view.get("video") and video_caption)
+    use_video_caption = bool((view.get("video") or view.get("video_path")) and video_caption)
     if use_video_caption:
         # Не отправляем отдельное текстовое сообщение, используем caption у видео
         text = None
@@ -353,12 +398,33 @@ async def send_view(msg: Message | CallbackQuery, view: dict):
                 await target.answer_audio(file)
 
         video = view.get("video")
+        video_path = view.get("video_path")
         video_as_document = bool(view.get("video_as_document"))
-        if video:
+        if video or video_path:
             filename = view.get("video_filename", "video.mp4")
             resp = None
+            assets = get_asset_registry()
+
             async def _send_video(as_document: bool):
-                file = BufferedInputFile(video, filename=filename)
+                if not video_path:
+                    return await _send_video_file(BufferedInputFile(video, filename=filename), as_document)
+                kind = "document" if as_document else "video"
+                file, cached = await assets.input_file(video_path, kind)
+                try:
+                    sent = await _send_video_file(file, as_document)
+                except TelegramBadRequest:
+                    if not cached:
+                        raise
+                    # сохранённый file_id больше не принимается — загружаем заново
+                    await assets.forget(video_path, kind)
+                    file, cached = await assets.input_file(video_path, kind)
+                    sent = await _send_video_file(file, as_document)
+                media = getattr(sent, "document" if as_document else "video", None)
+                if media is not None and not cached:
+                    await assets.remember(video_path, kind, media.file_id)
+                return sent
+
+            async def _send_video_file(file, as_document: bool):
                 if as_document:
                     return await target.answer_document(
                         file,
@@ -392,7 +458,7 @@ async def send_view(msg: Message | CallbackQuery, view: dict):
             # сохраним file_id и при необходимости обновим кнопку "Поделиться"
             try:
                 if user_id and resp and getattr(resp, "video", None):
-                    st = user_states.get(int(user_id))
+                    st = await state_store.get(int(user_id))
                     if st:
                         st.share_video_file_id = resp.video.file_id
                         st.share_video_caption = video_caption if use_video_caption else None
@@ -452,10 +518,10 @@ async def start(m: Message):
         last_name=getattr(m.from_user, "last_name", None),
     )
 
-    st = user_states.setdefault(m.from_user.id, State())
+    st = await state_store.get(m.from_user.id)
     st.current_page = "start"
 
-    ctx = ctx_for(m)
+    ctx = await ctx_for(m)
     # Для явного /start сразу отдаём стартовый экран с обложкой
     start_page = PAGE_INDEX["start"]
     view = await start_page.render(ctx)
@@ -465,9 +531,9 @@ async def start(m: Message):
 async def photo_cmd(m: Message):
     _touch_user(getattr(m.from_user, "id", None))
     await _ensure_user(m.from_user.id, m.from_user.username)
-    st = user_states.setdefault(m.from_user.id, State())
+    st = await state_store.get(m.from_user.id)
     st.current_page = "flow.animate"
-    ctx = ctx_for(m)
+    ctx = await ctx_for(m)
     view = await route(ctx, "")
     await send_view(m, view)
 
@@ -475,9 +541,9 @@ async def photo_cmd(m: Message):
 async def balance_cmd(m: Message):
     _touch_user(getattr(m.from_user, "id", None))
     await _ensure_user(m.from_user.id, m.from_user.username)
-    st = user_states.setdefault(m.from_user.id, State())
+    st = await state_store.get(m.from_user.id)
     st.current_page = "account.cabinet"
-    ctx = ctx_for(m)
+    ctx = await ctx_for(m)
     view = await route(ctx, "")
     await send_view(m, view)
 
@@ -485,9 +551,9 @@ async def balance_cmd(m: Message):
 async def payment_cmd(m: Message):
     _touch_user(getattr(m.from_user, "id", None))
     await _ensure_user(m.from_user.id, m.from_user.username)
-    st = user_states.setdefault(m.from_user.id, State())
+    st = await state_store.get(m.from_user.id)
     st.current_page = "account.topup"
-    ctx = ctx_for(m)
+    ctx = await ctx_for(m)
     view = await route(ctx, "")
     await send_view(m, view)
 
@@ -495,9 +561,9 @@ async def payment_cmd(m: Message):
 async def cabinet_cmd(m: Message):
     _touch_user(getattr(m.from_user, "id", None))
     await _ensure_user(m.from_user.id, m.from_user.username)
-    st = user_states.setdefault(m.from_user.id, State())
+    st = await state_store.get(m.from_user.id)
     st.current_page = "account.cabinet"
-    ctx = ctx_for(m)
+    ctx = await ctx_for(m)
     view = await route(ctx, "")
     await send_view(m, view)
 
@@ -505,9 +571,9 @@ async def cabinet_cmd(m: Message):
 async def pay_cmd(m: Message):
     _touch_user(getattr(m.from_user, "id", None))
     await _ensure_user(m.from_user.id, m.from_user.username)
-    st = user_states.setdefault(m.from_user.id, State())
+    st = await state_store.get(m.from_user.id)
     st.current_page = "account.topup"
-    ctx = ctx_for(m)
+    ctx = await ctx_for(m)
     view = await route(ctx, "")
     await send_view(m, view)
 
@@ -515,9 +581,9 @@ async def pay_cmd(m: Message):
 async def help_cmd(m: Message):
     _touch_user(getattr(m.from_user, "id", None))
     await _ensure_user(m.from_user.id, m.from_user.username)
-    st = user_states.setdefault(m.from_user.id, State())
+    st = await state_store.get(m.from_user.id)
     st.current_page = "support"
-    ctx = ctx_for(m)
+    ctx = await ctx_for(m)
     view = await route(ctx, "")
     await send_view(m, view)
 
@@ -525,9 +591,9 @@ async def help_cmd(m: Message):
 async def support_cmd(m: Message):
     _touch_user(getattr(m.from_user, "id", None))
     await _ensure_user(m.from_user.id, m.from_user.username)
-    st = user_states.setdefault(m.from_user.id, State())
+    st = await state_store.get(m.from_user.id)
     st.current_page = "support"
-    ctx = ctx_for(m)
+    ctx = await ctx_for(m)
     view = await route(ctx, "")
     await send_view(m, view)
 
@@ -549,17 +615,17 @@ async def paypfoto_cmd(m: Message):
     _touch_user(getattr(m.from_user, "id", None))
     if not _is_hard_admin(m.from_user.id):
         return
-    st = user_states.setdefault(m.from_user.id, State())
+    st = await state_store.get(m.from_user.id)
     st.current_page = "admin.paypfoto"
     st.admin_paypfoto_user_id = None
-    ctx = ctx_for(m)
+    ctx = await ctx_for(m)
     view = await route(ctx, "")
     await send_view(m, view)
 
 @dp.message(F.text)
 async def on_text(m: Message):
     _touch_user(getattr(m.from_user, "id", None))
-    ctx = ctx_for(m)
+    ctx = await ctx_for(m)
     # Игнорируем любые команды (aiogram Command-хендлеры уже их обрабатывают), чтобы не озвучивать слэш-текст
     if m.text and m.text.strip().startswith("/"):
         return
@@ -575,7 +641,7 @@ async def on_text(m: Message):
 @dp.message(F.photo)
 async def on_photo(m: Message):
     _touch_user(getattr(m.from_user, "id", None))
-    ctx = ctx_for(m)
+    ctx = await ctx_for(m)
     page = PAGE_INDEX.get(ctx.state.current_page, PAGE_INDEX["start"])
     if hasattr(page, "handle_photo"):
         result = await page.handle_photo(ctx, m)
@@ -595,7 +661,7 @@ async def on_photo(m: Message):
 @dp.message(F.voice | F.audio)
 async def on_voice(m: Message):
     _touch_user(getattr(m.from_user, "id", None))
-    ctx = ctx_for(m)
+    ctx = await ctx_for(m)
     page = PAGE_INDEX.get(ctx.state.current_page, PAGE_INDEX["start"])
     if hasattr(page, "handle_voice"):
         result = await page.handle_voice(ctx, m)
@@ -616,9 +682,8 @@ async def nav_cb(q: CallbackQuery):
         await q.answer()
     except Exception:
         pass
-    st = user_states.setdefault(q.from_user.id, State())
-    ctx = BotContext(user_id=q.from_user.id, state=st)
-    await ctx.ensure_snapshot()
+    st = await state_store.get(q.from_user.id)
+    ctx = BotContext(user_id=q.from_user.id, state=st, bot=q.bot)
     origin = st.current_page
     target = q.data.split("nav:", 1)[1]
     if target == "format.select":
@@ -682,19 +747,23 @@ async def on_cb(q: CallbackQuery):
             await q.answer()
             return
 
-    st = user_states.setdefault(q.from_user.id, State())
-    ctx = BotContext(user_id=q.from_user.id, state=st)
-    await ctx.ensure_snapshot()
+    st = await state_store.get(q.from_user.id)
+    ctx = BotContext(user_id=q.from_user.id, state=st, bot=q.bot)
     page = PAGE_INDEX.get(ctx.state.current_page, PAGE_INDEX["start"])
+    ctx.snapshot_groups = page_snapshot_groups(page)
+    await ctx.ensure_snapshot()
 
     if hasattr(page, "on_callback"):
         result = await page.on_callback(ctx, q)
         if isinstance(result, dict):
             await send_view(q, result)
             return
+        if result == SKIP_RENDER:
+            return
         if result:
             ctx.state.current_page = result
         render_page = PAGE_INDEX[ctx.state.current_page]
+        ctx.snapshot_groups = page_snapshot_groups(render_page)
         await ctx.ensure_snapshot(refresh=True)
         view = await render_page.render(ctx)
         try:
@@ -713,7 +782,7 @@ async def on_cb(q: CallbackQuery):
 @dp.inline_query()
 async def inline_share(query: InlineQuery):
     _touch_user(getattr(query.from_user, "id", None))
-    st = user_states.get(query.from_user.id)
+    st = await state_store.get(query.from_user.id)
     file_id = None
     caption = None
     parse_mode = None
@@ -739,35 +808,142 @@ async def inline_share(query: InlineQuery):
     ]
     await query.answer(results, cache_time=1, is_personal=True)
 
+async def _remember_share_video(user_id: int, file_id: str, caption: str | None, parse_mode: str | None) -> None:
+    st = await state_store.get(int(user_id))
+    if st:
+        st.share_video_file_id = file_id
+        st.share_video_caption = caption
+        st.share_video_parse_mode = parse_mode
+
 logging.basicConfig(level=logging.INFO)
 
 async def main():
     if not BOT_TOKEN:
         raise RuntimeError("BOT_TOKEN не задан в .env")
 
-    bot = Bot(BOT_TOKEN)
-    lock_conn = await _acquire_bot_lock()
+    # все вызовы Bot API идут через общий лимитер исходящих сообщений
+    # webhook: апдейты принимает API, этот процесс обслуживает шард BOT_SHARD из BOT_SHARDS;
+    # polling: единственный процесс, как раньше
+    webhook_mode = settings.BOT_MODE == "webhook"
+    shard = settings.BOT_SHARD if webhook_mode else 0
+    if not 0 <= shard < settings.BOT_SHARDS:
+        raise RuntimeError(f"BOT_SHARD={shard} вне диапазона 0..{settings.BOT_SHARDS - 1}")
+    if webhook_mode and not settings.TELEGRAM_WEBHOOK_SECRET:
+        raise RuntimeError("BOT_MODE=webhook требует TELEGRAM_WEBHOOK_SECRET")
+
+    bot = install_outbound_limiter(Bot(BOT_TOKEN))
+    lock_conn = await _acquire_bot_lock(shard)
     if not lock_conn:
-        logging.error("Another bot instance is already running. Exiting to avoid getUpdates conflict.")
+        logging.error("Another bot instance is already serving shard %s. Exiting to avoid duplicate updates.", shard)
         await bot.session.close()
         return
-    # очищаем глобальное меню команд, чтобы скрыть подсказки /start, /photo и т.д.
-    try:
-        await bot.delete_my_commands()
-    except Exception:
-        pass
-
-    asyncio.create_task(_payment_status_watcher(bot))
-
-    await topup_callbacks(dp, user_states)
-
+    if shard == 0:
+        # очищаем глобальное меню команд, чтобы скрыть подсказки /start, /photo и т.д.
+        try:
+            await bot.delete_my_commands()
+        except Exception:
+            pass
+        # платежи общие для всех шардов — проверяет их только один процесс
+        asyncio.create_task(_payment_status_watcher(bot))
+        asyncio.create_task(_referral_counters_watcher())
+
+    state_store.start()
+    await topup_callbacks(dp, state_store)
+
+    run_generation = RunAnimateGeneration(bot, on_delivered=_remember_share_video)
+    job_runner = JobRunner(
+        run_generation,
+        workers=settings.GENERATION_WORKERS,
+        poll_interval=settings.GENERATION_JOB_POLL_INTERVAL,
+        max_attempts=settings.GENERATION_JOB_MAX_ATTEMPTS,
+        scheduler=FairScheduler(
+            global_cap=settings.GENERATION_WORKERS,
+            per_user_cap=settings.GENERATION_PER_USER_LIMIT,
+            weights=parse_segment_weights(settings.GENERATION_SEGMENT_WEIGHTS),
+            throttle_window=settings.GENERATION_THROTTLE_WINDOW,
+        ),
+        on_queue_position=run_generation.show_queue_position,
+        on_queue_left=run_generation.forget_queue_position,
+        owns=_shard_filter(shard) if webhook_mode else None,
+    )
+    await job_runner.start()
+
+    # callback KlingAI (и апдейты Telegram в режиме вебхука) приходят в API-процесс и доезжают сюда через NOTIFY
+    subscribe(KLING_TASK_CHANNEL, on_task_event)
+    # записи в users (оплата в API, списания, бан) сбрасывают кэши пользователя
+    subscribe(USER_CHANGED_CHANNEL, known_users.on_user_changed)
+    subscribe(USER_CHANGED_CHANNEL, get_snapshot_cache().on_user_changed)
+    channels = [KLING_TASK_CHANNEL, USER_CHANGED_CHANNEL] + ([TELEGRAM_UPDATES_CHANNEL] if webhook_mode else [])
+    bus_listener = PgListener(engine, channels)
+    bus_listener.start()
+
+    consumer: UpdateConsumer | None = None
     try:
-        await dp.start_polling(bot, handle_as_tasks=True)
+        if webhook_mode:
+            consumer = UpdateConsumer.for_dispatcher(
+                dp, bot, shard=shard, retention=settings.TELEGRAM_UPDATES_RETENTION
+            )
+            if shard == 0 and settings.TELEGRAM_WEBHOOK_URL:
+                await bot.set_webhook(
+                    settings.TELEGRAM_WEBHOOK_URL,
+                    secret_token=settings.TELEGRAM_WEBHOOK_SECRET,
+                    allowed_updates=dp.resolve_used_update_types(),
+                )
+            consumer.start()
+            logging.info("Bot shard %s/%s consumes webhook updates", shard, settings.BOT_SHARDS)
+            await _wait_for_shutdown()
+        else:
+            # getUpdates не работает, пока у бота установлен вебхук
+            await bot.delete_webhook()
+            await dp.start_polling(bot, handle_as_tasks=True)
     finally:
-        await _release_bot_lock(lock_conn)
+        if consumer is not None:
+            await consumer.stop()
+        await job_runner.stop()
+        await run_generation.ticker.stop()
+        # дописываем отложенные состояния, чтобы деплой их не потерял
+        await state_store.stop()
+        await bus_listener.stop()
+        await stop_status_poller()
+        await close_shared_http_client()
+        await _release_bot_lock(lock_conn, shard)
         # Корректно закрываем HTTP-сессию бота при остановке, чтобы избежать утечек
         await bot.session.close()
 
+def _shard_filter(shard: int):
+    ring = get_ring(settings.BOT_SHARDS)
+    return lambda user_id: ring.shard_for(user_id) == shard
+
+async def _wait_for_shutdown() -> None:
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+    await stop.wait()
+
+async def _referral_counters_watcher() -> None:
+    """
+    Фоновая сверка счётчиков рефералов в users с referral_bonuses: расхождения (запись бонуса
+    в обход UserRepo, гонка двух первых бонусов за одного друга) логируются и исправляются.
+    """
+    interval = settings.REFERRAL_COUNTERS_CHECK_INTERVAL
+    if interval <= 0:
+        return
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            async with async_session() as s:
+                drift = await UserRepo(s).check_referral_counters(fix=True)
+                await s.commit()
+            if drift:
+                logging.warning("referral counters drifted for %s users, fixed: %s", len(drift), drift[:20])
+        except Exception as exc:  # noqa: BLE001
+            logging.warning("referral counters check failed: %s", exc)
+
+
 async def _payment_status_watcher(bot: Bot) -> None:
     """
     Фоновый воркер: берёт платежи в статусах pending/waiting_for_capture, проверяет их в YooKassa
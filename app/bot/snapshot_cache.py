@@ -0,0 +1,122 @@
+"""
+Кэш снапшотов пользователей (UserRepo.snapshot) между апдейтами.
+
+Снапшот читается почти на каждом экране, а меняется редко: оплата, списание за генерацию,
+реферальный бонус, email. Поэтому он живёт в памяти `ttl` секунд, а каждая запись в users
+через UserRepo сбрасывает его явно — событием USER_CHANGED_CHANNEL после commit
+(из этого процесса напрямую, из API через LISTEN/NOTIFY). TTL страхует от записей в обход UserRepo.
+
+Загрузка, начатая до сброса, в кэш не попадает: иначе она вернула бы туда значение до commit.
+Запись помнит, какие группы полей (SNAPSHOT_GROUPS) в ней есть: экран без рефералов кладёт
+только балансы, а экран с рефералами потом дочитывает их и дополняет ту же запись.
+"""
+from __future__ import annotations
+
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, FrozenSet, Iterable, Optional
+
+from app.infrastructure.db.repositories.user_repo import ALL_SNAPSHOT_GROUPS
+from app.settings import settings
+
+
+@dataclass(slots=True)
+class _Entry:
+    snapshot: Dict[str, Any]
+    groups: FrozenSet[str]
+    expires: float
+
+
+@dataclass(frozen=True)
+class SnapshotCacheStats:
+    size: int
+    hits: int
+    misses: int
+    invalidations: int
+
+
+class SnapshotCache:
+    def __init__(self, *, ttl: float = 30.0, max_entries: int = 50000) -> None:
+        self._ttl = float(ttl)
+        self._max_entries = max(1, int(max_entries))
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        # растёт при каждом сбросе: загрузка, заставшая сброс, не кэшируется
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, telegram_id: int, groups: Optional[Iterable[str]] = None) -> Optional[Dict[str, Any]]:
+        """
+        Снапшот, если в записи есть все группы `groups` (None — все группы), иначе None.
+        """
+        telegram_id = int(telegram_id)
+        entry = self._entries.get(telegram_id)
+        if entry is None or entry.expires <= time.monotonic():
+            if entry is not None:
+                del self._entries[telegram_id]
+            self.misses += 1
+            return None
+        if not entry.groups.issuperset(ALL_SNAPSHOT_GROUPS if groups is None else groups):
+            self.misses += 1
+            return None
+        self._entries.move_to_end(telegram_id)
+        self.hits += 1
+        # копия: страницы вправе дополнять свой снапшот, не трогая общий
+        return dict(entry.snapshot)
+
+    def put(
+        self,
+        telegram_id: int,
+        snapshot: Dict[str, Any],
+        *,
+        generation: int,
+        groups: Optional[Iterable[str]] = None,
+    ) -> None:
+        if self._ttl <= 0 or generation != self.generation:
+            return
+        telegram_id = int(telegram_id)
+        groups = ALL_SNAPSHOT_GROUPS if groups is None else frozenset(groups)
+        snapshot = dict(snapshot)
+        previous = self._entries.get(telegram_id)
+        if previous is not None and previous.expires > time.monotonic():
+            # запись не сбрасывалась с момента загрузки (иначе её бы не было) — группы складываются,
+            # но срок жизни остаётся от старой загрузки: её данные не моложе
+            merged = dict(previous.snapshot)
+            merged.update(snapshot)
+            self._entries[telegram_id] = _Entry(merged, previous.groups | groups, previous.expires)
+            self._entries.move_to_end(telegram_id)
+            return
+        self._entries[telegram_id] = _Entry(snapshot, groups, time.monotonic() + self._ttl)
+        self._entries.move_to_end(telegram_id)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, telegram_id: int) -> None:
+        self.generation += 1
+        if self._entries.pop(int(telegram_id), None) is not None:
+            self.invalidations += 1
+
+    def on_user_changed(self, payload: Dict[str, Any]) -> None:
+        telegram_id = payload.get("telegram_id")
+        if telegram_id is not None:
+            self.invalidate(int(telegram_id))
+
+    def stats(self) -> SnapshotCacheStats:
+        return SnapshotCacheStats(
+            size=len(self._entries),
+            hits=self.hits,
+            misses=self.misses,
+            invalidations=self.invalidations,
+        )
+
+
+_cache: SnapshotCache | None = None
+
+
+def get_snapshot_cache() -> SnapshotCache:
+    global _cache
+    if _cache is None:
+        _cache = SnapshotCache(ttl=settings.SNAPSHOT_CACHE_TTL, max_entries=settings.SNAPSHOT_CACHE_SIZE)
+    return _cache
@@ -0,0 +1,375 @@
+"""
+Хранилище состояний диалога (State) пользователей бота.
+
+Два уровня:
+    - в памяти — LRU на `max_entries` состояний с TTL простоя `ttl`: активные пользователи
+      обслуживаются без обращений к БД, а память не растёт с числом всех, кто когда-либо писал боту;
+    - долговременный (`StateBackend`, по умолчанию таблица bot_states в основной БД — Postgres
+      или sqlite в dev) — состояние переживает рестарты и деплои.
+
+Запись отложенная (write-behind): обработчики меняют State на месте, а фоновый цикл раз в
+`flush_interval` секунд сериализует состояния, к которым обращались, и пачкой пишет только изменившиеся.
+Вытесненное из памяти и ещё не записанное состояние ждёт ближайшей записи в `_pending`.
+
+Пока апдейт пользователя в обработке, его состояние закреплено (`pinned`, см. `StatePinMiddleware`):
+LRU и TTL его не вытесняют, иначе изменения объекта, который держит обработчик, потерялись бы,
+а следующий get загрузил бы из БД новую копию.
+
+Сериализация компактная: JSON только с полями, отличными от значений по умолчанию.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from dataclasses import MISSING, dataclass, fields
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, Mapping, Optional, Protocol, Set
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from app.bot.context import State
+from app.infrastructure.db.base import async_session
+from app.infrastructure.db.repositories.state_repo import StateRepo
+from app.settings import settings
+
+log = logging.getLogger("state_store")
+
+
+def _defaults() -> Dict[str, Any]:
+    out: Dict[str, Any] = {}
+    for f in fields(State):
+        if f.default is not MISSING:
+            out[f.name] = f.default
+        elif f.default_factory is not MISSING:  # type: ignore[misc]
+            out[f.name] = f.default_factory()  # type: ignore[misc]
+    return out
+
+
+_DEFAULTS = _defaults()
+
+
+def dump_state(state: State) -> str:
+    data = {}
+    for name, default in _DEFAULTS.items():
+        value = getattr(state, name)
+        if value != default:
+            data[name] = value
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+def load_state(raw: str | None) -> State:
+    if not raw:
+        return State()
+    try:
+        data = json.loads(raw)
+    except ValueError:
+        log.warning("broken state payload, starting from scratch")
+        return State()
+    known = {k: v for k, v in data.items() if k in _DEFAULTS}
+    return State(**known)
+
+
+_EMPTY = dump_state(State())
+
+
+class StateBackend(Protocol):
+    async def load_many(self, user_ids: Iterable[int]) -> Dict[int, str]: ...
+
+    async def save_many(self, states: Mapping[int, str]) -> None: ...
+
+
+class DbStateBackend:
+    def __init__(self, session_factory=async_session) -> None:
+        self._session_factory = session_factory
+
+    async def load_many(self, user_ids: Iterable[int]) -> Dict[int, str]:
+        async with self._session_factory() as s:
+            return await StateRepo(s).get_many(user_ids)
+
+    async def save_many(self, states: Mapping[int, str]) -> None:
+        async with self._session_factory() as s:
+            await StateRepo(s).put_many(states)
+            await s.commit()
+
+
+@dataclass(slots=True)
+class _Entry:
+    state: State
+    # последняя сериализация, совпадающая с долговременным уровнем
+    saved: str
+    touched: float
+
+
+@dataclass
+class StateStoreStats:
+    resident: int
+    pending: int
+    hits: int
+    misses: int
+    writes: int
+    evictions: int
+
+
+class StateStore:
+    def __init__(
+        self,
+        backend: StateBackend | None = None,
+        *,
+        max_entries: int = 50000,
+        ttl: float = 3600.0,
+        flush_interval: float = 1.0,
+        batch_size: int = 500,
+    ) -> None:
+        self._backend = backend
+        self._max_entries = max(1, int(max_entries))
+        self._ttl = float(ttl)
+        self._flush_interval = max(0.05, float(flush_interval))
+        self._batch_size = max(1, int(batch_size))
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        self._touched: Set[int] = set()
+        self._pending: Dict[int, str] = {}
+        # пачка, которую сейчас пишет flush: до коммита в БД ещё старые версии
+        self._inflight: Dict[int, str] = {}
+        self._loading: Dict[int, asyncio.Future] = {}
+        # user_id -> число обработчиков, держащих состояние; такие записи не вытесняются
+        self._pins: Dict[int, int] = {}
+        self._task: asyncio.Task | None = None
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+
+    # ---------- чтение ----------
+
+    async def get(self, user_id: int) -> State:
+        """
+        Состояние пользователя (создаётся пустым, если его ещё нет). Изменения объекта на месте
+        будут записаны ближайшим flush.
+        """
+        user_id = int(user_id)
+        now = time.monotonic()
+        entry = self._entries.get(user_id)
+        if entry is not None and now - entry.touched > self._ttl and user_id not in self._pins:
+            self._evict(user_id)
+            entry = None
+        if entry is not None:
+            self.hits += 1
+            entry.touched = now
+            self._entries.move_to_end(user_id)
+            self._touched.add(user_id)
+            return entry.state
+
+        self.misses += 1
+        fut = self._loading.get(user_id)
+        if fut is None:
+            fut = asyncio.ensure_future(self._load(user_id))
+            self._loading[user_id] = fut
+            fut.add_done_callback(lambda _f, uid=user_id: self._loading.pop(uid, None))
+        return await asyncio.shield(fut)
+
+    def peek(self, user_id: int) -> Optional[State]:
+        """
+        Состояние, только если оно уже в памяти (без обращения к БД).
+        """
+        entry = self._entries.get(int(user_id))
+        return entry.state if entry is not None else None
+
+    async def _load(self, user_id: int) -> State:
+        raw = self._pending.get(user_id)
+        if raw is None:
+            raw = self._inflight.get(user_id)
+        if raw is None and self._backend is not None:
+            try:
+                raw = (await self._backend.load_many([user_id])).get(user_id)
+            except Exception as exc:  # noqa: BLE001
+                log.warning("state load failed for user=%s: %s", user_id, exc)
+        state = load_state(raw)
+        self._entries[user_id] = _Entry(state=state, saved=raw if raw is not None else _EMPTY, touched=time.monotonic())
+        self._touched.add(user_id)
+        self._shrink()
+        return state
+
+    # ---------- закрепление ----------
+
+    @asynccontextmanager
+    async def pinned(self, user_id: int) -> AsyncIterator[None]:
+        """
+        Не даёт вытеснить состояние пользователя, пока блок выполняется (вложенные блоки считаются).
+        """
+        user_id = int(user_id)
+        self._pins[user_id] = self._pins.get(user_id, 0) + 1
+        try:
+            yield
+        finally:
+            left = self._pins[user_id] - 1
+            if left:
+                self._pins[user_id] = left
+            else:
+                del self._pins[user_id]
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                # обработчик мог менять State и после последнего get
+                entry.touched = time.monotonic()
+                self._touched.add(user_id)
+
+    # ---------- вытеснение ----------
+
+    def _evict(self, user_id: int) -> None:
+        entry = self._entries.pop(user_id, None)
+        self._touched.discard(user_id)
+        if entry is None:
+            return
+        self.evictions += 1
+        if self._backend is None:
+            return
+        blob = dump_state(entry.state)
+        if blob != entry.saved:
+            self._pending[user_id] = blob
+
+    def _shrink(self) -> None:
+        excess = len(self._entries) - self._max_entries
+        if excess <= 0:
+            return
+        # закреплённые пропускаем: если закреплено всё, память временно превышает лимит
+        victims = [uid for uid in self._entries if uid not in self._pins][:excess]
+        for user_id in victims:
+            self._evict(user_id)
+
+    def _expire(self, now: float) -> None:
+        # OrderedDict упорядочен по последнему обращению: просроченные — в начале
+        expired = []
+        for user_id, entry in self._entries.items():
+            if now - entry.touched <= self._ttl:
+                break
+            if user_id not in self._pins:
+                expired.append(user_id)
+        for user_id in expired:
+            self._evict(user_id)
+
+    # ---------- запись ----------
+
+    async def flush(self, *, full: bool = False) -> int:
+        """
+        Пишет изменившиеся состояния одной пачкой. full=True проверяет все резидентные состояния
+        (при остановке), а не только те, к которым обращались с прошлой записи.
+        """
+        if self._backend is None:
+            self._touched.clear()
+            return 0
+        candidates = list(self._entries) if full else list(self._touched)
+        self._touched = set()
+        changed: Dict[int, tuple[_Entry, str]] = {}
+        for user_id in candidates:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                continue
+            blob = dump_state(entry.state)
+            if blob != entry.saved:
+                changed[user_id] = (entry, blob)
+
+        batch = dict(self._pending)
+        batch.update({user_id: blob for user_id, (_, blob) in changed.items()})
+        if not batch:
+            return 0
+        self._pending = {}
+        self._inflight.update(batch)
+        items = list(batch.items())
+        try:
+            for i in range(0, len(items), self._batch_size):
+                await self._backend.save_many(dict(items[i : i + self._batch_size]))
+        except Exception as exc:  # noqa: BLE001
+            log.warning("state flush of %s entries failed: %s", len(batch), exc)
+            for user_id, blob in batch.items():
+                # более свежая версия могла появиться, пока шла запись
+                self._pending.setdefault(user_id, blob)
+            return 0
+        finally:
+            for user_id, blob in batch.items():
+                if self._inflight.get(user_id) is blob:
+                    del self._inflight[user_id]
+            # State меняют на месте без нового get: если он изменился после сериализации,
+            # запись нужна снова, а _touched уже очищен
+            for user_id, (entry, blob) in changed.items():
+                if self._entries.get(user_id) is entry and dump_state(entry.state) != blob:
+                    self._touched.add(user_id)
+        for entry, blob in changed.values():
+            entry.saved = blob
+        self.writes += len(batch)
+        return len(batch)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self._flush_interval)
+            try:
+                self._expire(time.monotonic())
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:  # noqa: BLE001
+                log.warning("state flush loop error: %s", exc)
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._task = None
+        await self.flush(full=True)
+
+    def stats(self) -> StateStoreStats:
+        return StateStoreStats(
+            resident=len(self._entries),
+            pending=len(self._pending),
+            hits=self.hits,
+            misses=self.misses,
+            writes=self.writes,
+            evictions=self.evictions,
+        )
+
+
+class StatePinMiddleware(BaseMiddleware):
+    """
+    Закрепляет состояние автора апдейта на время обработки. Подключается outer-middleware
+    к `dp.update` после MailboxMiddleware: апдейты одного пользователя к этому моменту уже идут по очереди.
+    """
+
+    def __init__(self, store: StateStore) -> None:
+        self._store = store
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+        async with self._store.pinned(user.id):
+            return await handler(event, data)
+
+
+_store: StateStore | None = None
+
+
+def get_state_store() -> StateStore:
+    global _store
+    if _store is None:
+        backend = None if settings.STATE_BACKEND == "memory" else DbStateBackend()
+        _store = StateStore(
+            backend,
+            max_entries=settings.STATE_CACHE_SIZE,
+            ttl=settings.STATE_CACHE_TTL,
+            flush_interval=settings.STATE_FLUSH_INTERVAL,
+        )
+    return _store
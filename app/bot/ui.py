@@ -5,6 +5,9 @@ from aiogram.types import (
     InlineKeyboardMarkup, InlineKeyboardButton,
 )
 
+# Страница уже ответила сама (например, отправила сообщение прогресса) — рендер не нужен
+SKIP_RENDER = "__skip_render__"
+
 def kb(rows: list[list[str]]) -> ReplyKeyboardMarkup:
     """
     Обычная reply-клавиатура.
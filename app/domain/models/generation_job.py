@@ -0,0 +1,40 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+
+@dataclass(frozen=True, slots=True)
+class GenerationJob:
+
+    id: int
+    user_id: int
+    chat_id: int
+    status: str
+    payload: Dict[str, Any]
+    attempts: int
+    task_id: Optional[str]
+    history_id: Optional[int]
+    progress_message_id: Optional[int]
+    error: Optional[str]
+    created_at: datetime
+    updated_at: datetime
+    started_at: Optional[datetime]
+    finished_at: Optional[datetime]
+    # когда за задачу списана генерация; повторный прогон (рестарт) второй раз не списывает
+    charged_at: Optional[datetime] = None
+
+
+@dataclass(frozen=True)
+class QueuedJob:
+    """
+    Ожидающая задача очереди в том виде, в каком её видит планировщик (строка JobRepo.list_queued).
+    """
+
+    id: int
+    user_id: int
+    segment: str | None = None
+    chat_id: int | None = None
+    progress_message_id: int | None = None
+    lang: str | None = None
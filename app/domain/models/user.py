@@ -4,7 +4,7 @@ from datetime import datetime
 
 from uuid import UUID
 
-from sqlalchemy import BigInteger, Integer, Text, TIMESTAMP, Boolean, ForeignKey
+from sqlalchemy import BigInteger, Integer, Text, TIMESTAMP, Boolean, ForeignKey, func
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
 
 
@@ -35,6 +35,13 @@ class User(Base):
     animate_balance_tokens: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
     avatar_balance_tokens: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
     friends_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    # счётчики по referral_bonuses, где пользователь — пригласивший; ведёт UserRepo._log_referral_bonus
+    referral_friends: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    referral_earned: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+    # referred_user_id трёх последних бонусов, от нового к старому
+    recent_referral_1: Mapped[int | None] = mapped_column(BigInteger, nullable=True)
+    recent_referral_2: Mapped[int | None] = mapped_column(BigInteger, nullable=True)
+    recent_referral_3: Mapped[int | None] = mapped_column(BigInteger, nullable=True)
     invited_by: Mapped[int | None] = mapped_column(BigInteger, nullable=True)
     referred_id: Mapped[int | None] = mapped_column(Integer, nullable=True)
     segment: Mapped[str] = mapped_column(Text, nullable=False, default="lead")
@@ -70,8 +77,9 @@ class SegmentHistory(Base):
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     user_id: Mapped[int] = mapped_column(BigInteger, ForeignKey("users.telegram_id", ondelete="CASCADE"))
     segment: Mapped[str] = mapped_column(Text, nullable=False)
+    # UserRepo._append_segment_history пишет сырым INSERT без created_at — как в миграции, default на стороне БД
     created_at: Mapped[datetime] = mapped_column(
-        TIMESTAMP(timezone=True), nullable=False, default=datetime.utcnow
+        TIMESTAMP(timezone=True), nullable=False, default=datetime.utcnow, server_default=func.now()
     )
 
 
@@ -91,8 +99,9 @@ class ReferralBonus(Base):
     deposit_rub_amount: Mapped[int | None] = mapped_column(Integer, nullable=True)
     deposit_token_amount: Mapped[int | None] = mapped_column(Integer, nullable=True)
     pay_id: Mapped[UUID | None] = mapped_column(Text, nullable=True)
+    # UserRepo._log_referral_bonus пишет сырым INSERT без created_at — как в миграции, default на стороне БД
     created_at: Mapped[datetime] = mapped_column(
-        TIMESTAMP(timezone=True), nullable=False, default=datetime.utcnow
+        TIMESTAMP(timezone=True), nullable=False, default=datetime.utcnow, server_default=func.now()
     )
 
 
@@ -102,7 +111,7 @@ class GenerationHistory(Base):
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     user_id: Mapped[int] = mapped_column(BigInteger, ForeignKey("users.telegram_id", ondelete="CASCADE"))
     timestamp: Mapped[datetime] = mapped_column(
-        TIMESTAMP(timezone=True), nullable=False, default=datetime.utcnow
+        TIMESTAMP(timezone=True), nullable=False, default=datetime.utcnow, server_default=func.now()
     )
     model: Mapped[str | None] = mapped_column(Text, nullable=True)
     request: Mapped[str | None] = mapped_column(Text, nullable=True)
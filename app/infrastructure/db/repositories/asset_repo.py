@@ -0,0 +1,53 @@
+from __future__ import annotations
+
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+
+class AssetRepo:
+    """
+    Таблица telegram_assets: (хэш содержимого, бот, тип) -> file_id уже загруженного в Telegram файла.
+    """
+
+    def __init__(self, s: AsyncSession) -> None:
+        self.s = s
+
+    async def get(self, *, content_hash: str, bot_key: str, kind: str) -> Optional[str]:
+        res = await self.s.execute(
+            text(
+                """
+                SELECT file_id
+                  FROM telegram_assets
+                 WHERE content_hash = :content_hash AND bot_key = :bot_key AND kind = :kind
+                """
+            ),
+            {"content_hash": content_hash, "bot_key": bot_key, "kind": kind},
+        )
+        value = res.scalar()
+        return str(value) if value else None
+
+    async def put(self, *, content_hash: str, bot_key: str, kind: str, file_id: str) -> None:
+        await self.s.execute(
+            text(
+                """
+                INSERT INTO telegram_assets (content_hash, bot_key, kind, file_id)
+                VALUES (:content_hash, :bot_key, :kind, :file_id)
+                ON CONFLICT (content_hash, bot_key, kind) DO UPDATE
+                   SET file_id = EXCLUDED.file_id
+                """
+            ),
+            {"content_hash": content_hash, "bot_key": bot_key, "kind": kind, "file_id": file_id},
+        )
+
+    async def delete(self, *, content_hash: str, bot_key: str, kind: str) -> None:
+        await self.s.execute(
+            text(
+                """
+                DELETE FROM telegram_assets
+                 WHERE content_hash = :content_hash AND bot_key = :bot_key AND kind = :kind
+                """
+            ),
+            {"content_hash": content_hash, "bot_key": bot_key, "kind": kind},
+        )
@@ -0,0 +1,349 @@
+from __future__ import annotations
+
+import json
+import zlib
+from typing import Any, Optional
+
+from sqlalchemy import bindparam, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.domain.models.generation_job import GenerationJob, QueuedJob
+
+_JOB_COLUMNS = """
+    id, user_id, chat_id, status, payload, attempts, task_id, history_id,
+    progress_message_id, error, created_at, updated_at, started_at, finished_at, charged_at
+"""
+
+# advisory lock выбора задачи планировщиком — общий для всех процессов (шардов) бота
+_CLAIM_LOCK_KEY = zlib.crc32(b"generation_jobs:claim")
+
+
+class JobRepo:
+    """
+    Репозиторий поверх таблицы generation_jobs — персистентная очередь генераций.
+    Выборка задач идёт через FOR UPDATE SKIP LOCKED, поэтому воркеры не мешают друг другу.
+    """
+
+    def __init__(self, s: AsyncSession) -> None:
+        self.s = s
+
+    async def enqueue(
+        self,
+        *,
+        user_id: int,
+        chat_id: int,
+        payload: dict[str, Any],
+        progress_message_id: int | None = None,
+        charged: bool = False,
+    ) -> int:
+        """
+        charged=True — генерация за задачу уже списана в этой же транзакции.
+        """
+        res = await self.s.execute(
+            text(
+                """
+                INSERT INTO generation_jobs (user_id, chat_id, status, payload, progress_message_id, charged_at)
+                VALUES (
+                    :user_id, :chat_id, 'queued', CAST(:payload AS jsonb), :progress_message_id,
+                    CASE WHEN :charged THEN CURRENT_TIMESTAMP END
+                )
+                RETURNING id
+                """
+            ),
+            {
+                "user_id": user_id,
+                "chat_id": chat_id,
+                "payload": json.dumps(payload or {}, ensure_ascii=False),
+                "progress_message_id": progress_message_id,
+                "charged": bool(charged),
+            },
+        )
+        return int(res.scalar_one())
+
+    async def claim_next(self) -> Optional[GenerationJob]:
+        """
+        Забирает самую старую задачу из очереди и переводит её в running.
+        """
+        res = await self.s.execute(
+            text(
+                f"""
+                UPDATE generation_jobs
+                   SET status = 'running',
+                       attempts = attempts + 1,
+                       started_at = now(),
+                       updated_at = now()
+                 WHERE id = (
+                        SELECT id
+                          FROM generation_jobs
+                         WHERE status = 'queued'
+                         ORDER BY id
+                         FOR UPDATE SKIP LOCKED
+                         LIMIT 1
+                 )
+                RETURNING {_JOB_COLUMNS}
+                """
+            )
+        )
+        row = res.mappings().first()
+        return self._row_to_job(row) if row else None
+
+    async def list_queued(self, *, limit: int = 500, after_id: int = 0) -> list[QueuedJob]:
+        """
+        Ожидающие задачи вместе с сегментом пользователя — вход для FairScheduler.
+        after_id — продолжение постраничного чтения (задачи с id больше).
+        """
+        res = await self.s.execute(
+            text(
+                """
+                SELECT j.id, j.user_id, j.chat_id, j.progress_message_id, j.payload, u.segment
+                  FROM generation_jobs j
+                  LEFT JOIN users u ON u.telegram_id = j.user_id
+                 WHERE j.status = 'queued'
+                   AND j.id > :after_id
+                 ORDER BY j.id
+                 LIMIT :limit
+                """
+            ),
+            {"limit": limit, "after_id": after_id},
+        )
+        jobs: list[QueuedJob] = []
+        for row in res.mappings().all():
+            payload = row.get("payload") or {}
+            if isinstance(payload, str):
+                payload = json.loads(payload)
+            jobs.append(
+                QueuedJob(
+                    id=int(row["id"]),
+                    user_id=int(row["user_id"]),
+                    segment=row.get("segment"),
+                    chat_id=int(row["chat_id"]),
+                    progress_message_id=row.get("progress_message_id"),
+                    lang=payload.get("lang"),
+                )
+            )
+        return jobs
+
+    async def lock_claims(self) -> None:
+        """
+        Транзакционный advisory lock на «посчитать running -> выбрать -> захватить»: шарды делают это
+        по очереди, поэтому общий предел параллельности KlingAI не превышается. Снимается вместе
+        с коммитом/откатом. Вне Postgres (тесты на sqlite) процесс один — лок не нужен.
+        """
+        if self.s.get_bind().dialect.name != "postgresql":
+            return
+        await self.s.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": _CLAIM_LOCK_KEY})
+
+    async def running_by_user(self) -> dict[int, int]:
+        res = await self.s.execute(
+            text(
+                """
+                SELECT user_id, COUNT(*) AS cnt
+                  FROM generation_jobs
+                 WHERE status = 'running'
+                 GROUP BY user_id
+                """
+            )
+        )
+        return {int(row.user_id): int(row.cnt) for row in res}
+
+    async def claim(self, job_id: int) -> Optional[GenerationJob]:
+        """
+        Переводит конкретную задачу в running, если её ещё никто не забрал.
+        """
+        res = await self.s.execute(
+            text(
+                f"""
+                UPDATE generation_jobs
+                   SET status = 'running',
+                       attempts = attempts + 1,
+                       started_at = now(),
+                       updated_at = now()
+                 WHERE id = :id AND status = 'queued'
+                RETURNING {_JOB_COLUMNS}
+                """
+            ),
+            {"id": job_id},
+        )
+        row = res.mappings().first()
+        return self._row_to_job(row) if row else None
+
+    async def requeue(self, job_id: int) -> None:
+        """
+        Возвращает задачу в очередь без траты попытки (например, KlingAI попросил подождать).
+        """
+        await self.s.execute(
+            text(
+                """
+                UPDATE generation_jobs
+                   SET status = 'queued',
+                       attempts = GREATEST(attempts - 1, 0),
+                       updated_at = now()
+                 WHERE id = :id
+                """
+            ),
+            {"id": job_id},
+        )
+
+    async def attach(
+        self,
+        *,
+        job_id: int,
+        task_id: str | None = None,
+        history_id: int | None = None,
+        progress_message_id: int | None = None,
+    ) -> None:
+        """
+        Сохраняет промежуточные идентификаторы, чтобы задачу можно было продолжить после рестарта.
+        """
+        await self.s.execute(
+            text(
+                """
+                UPDATE generation_jobs
+                   SET task_id = COALESCE(:task_id, task_id),
+                       history_id = COALESCE(:history_id, history_id),
+                       progress_message_id = COALESCE(:progress_message_id, progress_message_id),
+                       updated_at = now()
+                 WHERE id = :id
+                """
+            ),
+            {
+                "id": job_id,
+                "task_id": task_id,
+                "history_id": history_id,
+                "progress_message_id": progress_message_id,
+            },
+        )
+
+    async def mark_charged(self, job_id: int) -> bool:
+        """
+        Отмечает, что за задачу списана генерация. False — отметка уже стояла.
+        Вызывается в одной транзакции со списанием: вместе с ней либо оба изменения, либо ни одного.
+        """
+        res = await self.s.execute(
+            text(
+                """
+                UPDATE generation_jobs
+                   SET charged_at = CURRENT_TIMESTAMP,
+                       updated_at = CURRENT_TIMESTAMP
+                 WHERE id = :id AND charged_at IS NULL
+                """
+            ),
+            {"id": job_id},
+        )
+        return bool(res.rowcount)
+
+    async def release_charge(self, job_id: int) -> bool:
+        """
+        Снимает отметку charged_at, чтобы вернуть списание. False — возвращать нечего
+        (не списывали или уже вернули). Вызывается в одной транзакции с возвратом на баланс.
+        """
+        res = await self.s.execute(
+            text(
+                """
+                UPDATE generation_jobs
+                   SET charged_at = NULL,
+                       updated_at = CURRENT_TIMESTAMP
+                 WHERE id = :id AND charged_at IS NOT NULL
+                """
+            ),
+            {"id": job_id},
+        )
+        return bool(res.rowcount)
+
+    async def finish(self, *, job_id: int, status: str, error: str | None = None) -> None:
+        await self.s.execute(
+            text(
+                """
+                UPDATE generation_jobs
+                   SET status = :status,
+                       error = :error,
+                       finished_at = now(),
+                       updated_at = now()
+                 WHERE id = :id
+                """
+            ),
+            {"id": job_id, "status": status, "error": error[:4000] if error else None},
+        )
+
+    async def requeue_running(self, job_ids: list[int] | None = None) -> int:
+        """
+        Возвращает в очередь задачи, оставшиеся в running после падения/рестарта процесса.
+        job_ids ограничивает набор (задачи своего шарда), None — все.
+        """
+        if job_ids is not None and not job_ids:
+            return 0
+        stmt = text(
+            """
+            UPDATE generation_jobs
+               SET status = 'queued',
+                   updated_at = now()
+             WHERE status = 'running'
+            """
+            + ("AND id IN :ids" if job_ids is not None else "")
+        )
+        params: dict[str, Any] = {}
+        if job_ids is not None:
+            stmt = stmt.bindparams(bindparam("ids", expanding=True))
+            params["ids"] = [int(i) for i in job_ids]
+        res = await self.s.execute(stmt, params)
+        return int(res.rowcount or 0)
+
+    async def list_running(self) -> list[tuple[int, int]]:
+        """
+        (id, user_id) задач в running.
+        """
+        res = await self.s.execute(
+            text("SELECT id, user_id FROM generation_jobs WHERE status = 'running' ORDER BY id")
+        )
+        return [(int(row.id), int(row.user_id)) for row in res]
+
+    async def has_pending(self, *, user_id: int, match: dict[str, Any]) -> bool:
+        # payload @> match: задача с теми же ключевыми полями ещё в очереди или в работе
+        res = await self.s.execute(
+            text(
+                """
+                SELECT 1
+                  FROM generation_jobs
+                 WHERE user_id = :user_id
+                   AND status IN ('queued', 'running')
+                   AND payload @> CAST(:match AS jsonb)
+                 LIMIT 1
+                """
+            ),
+            {"user_id": user_id, "match": json.dumps(match, ensure_ascii=False)},
+        )
+        return res.first() is not None
+
+    async def count_pending(self) -> int:
+        res = await self.s.execute(
+            text("SELECT COUNT(*) FROM generation_jobs WHERE status IN ('queued', 'running')")
+        )
+        return int(res.scalar() or 0)
+
+    @staticmethod
+    def _row_to_job(row) -> Optional[GenerationJob]:
+        if row is None:
+            return None
+
+        data = dict(row)
+        payload = data.get("payload") or {}
+        if isinstance(payload, str):
+            payload = json.loads(payload)
+
+        return GenerationJob(
+            id=int(data["id"]),
+            user_id=int(data["user_id"]),
+            chat_id=int(data["chat_id"]),
+            status=data["status"],
+            payload=dict(payload),
+            attempts=int(data.get("attempts") or 0),
+            task_id=data.get("task_id"),
+            history_id=data.get("history_id"),
+            progress_message_id=data.get("progress_message_id"),
+            error=data.get("error"),
+            created_at=data["created_at"],
+            updated_at=data["updated_at"],
+            started_at=data.get("started_at"),
+            finished_at=data.get("finished_at"),
+            charged_at=data.get("charged_at"),
+        )
@@ -0,0 +1,93 @@
+from __future__ import annotations
+
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class ResultCacheRepo:
+    """
+    Таблица generation_cache: ключ запроса генерации (с user_id) -> file_id уже отправленного в Telegram видео.
+    """
+
+    def __init__(self, s: AsyncSession) -> None:
+        self.s = s
+
+    async def hit(self, *, key: str, ttl_seconds: int) -> Optional[Tuple[str, str]]:
+        """
+        Возвращает (file_id, media_type) свежей записи и сразу отмечает попадание.
+        """
+        now = _now()
+        res = await self.s.execute(
+            text(
+                """
+                UPDATE generation_cache
+                   SET hits = hits + 1,
+                       last_hit_at = :now
+                 WHERE key = :key
+                   AND created_at >= :cutoff
+                RETURNING file_id, media_type
+                """
+            ),
+            {"key": key, "now": now, "cutoff": now - timedelta(seconds=ttl_seconds)},
+        )
+        row = res.first()
+        return (str(row.file_id), str(row.media_type)) if row else None
+
+    async def put(self, *, key: str, user_id: int, file_id: str, media_type: str) -> None:
+        await self.s.execute(
+            text(
+                """
+                INSERT INTO generation_cache (key, user_id, file_id, media_type, hits, created_at, last_hit_at)
+                VALUES (:key, :user_id, :file_id, :media_type, 0, :now, :now)
+                ON CONFLICT (key) DO UPDATE
+                   SET file_id = EXCLUDED.file_id,
+                       media_type = EXCLUDED.media_type,
+                       hits = 0,
+                       created_at = EXCLUDED.created_at,
+                       last_hit_at = EXCLUDED.last_hit_at
+                """
+            ),
+            {"key": key, "user_id": int(user_id), "file_id": file_id, "media_type": media_type, "now": _now()},
+        )
+
+    async def evict(self, *, ttl_seconds: int, max_entries: int) -> int:
+        """
+        Удаляет протухшие записи и, если записей больше max_entries, — самые давно использованные.
+        Граница LRU — last_hit_at записи номер max_entries (один проход по индексу), дальше
+        удаление по диапазону того же индекса, без сравнения таблицы самой с собой.
+        """
+        res = await self.s.execute(
+            text("DELETE FROM generation_cache WHERE created_at < :cutoff"),
+            {"cutoff": _now() - timedelta(seconds=ttl_seconds)},
+        )
+        removed = int(res.rowcount or 0)
+        if max_entries > 0:
+            cutoff = await self.s.scalar(
+                text(
+                    """
+                    SELECT last_hit_at
+                      FROM generation_cache
+                     ORDER BY last_hit_at DESC
+                     LIMIT 1 OFFSET :max_entries
+                    """
+                ),
+                {"max_entries": max_entries},
+            )
+            if cutoff is not None:
+                res = await self.s.execute(
+                    text("DELETE FROM generation_cache WHERE last_hit_at <= :cutoff"),
+                    {"cutoff": cutoff},
+                )
+                removed += int(res.rowcount or 0)
+        return removed
+
+    async def count(self) -> int:
+        res = await self.s.execute(text("SELECT COUNT(*) FROM generation_cache"))
+        return int(res.scalar() or 0)
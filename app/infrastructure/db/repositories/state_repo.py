@@ -0,0 +1,45 @@
+from __future__ import annotations
+
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Mapping
+
+from sqlalchemy import bindparam, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+
+class StateRepo:
+    """
+    Таблица bot_states: user_id -> сериализованное состояние диалога (State).
+    """
+
+    def __init__(self, s: AsyncSession) -> None:
+        self.s = s
+
+    async def get_many(self, user_ids: Iterable[int]) -> Dict[int, str]:
+        ids = [int(uid) for uid in user_ids]
+        if not ids:
+            return {}
+        res = await self.s.execute(
+            text("SELECT user_id, data FROM bot_states WHERE user_id IN :ids").bindparams(
+                bindparam("ids", expanding=True)
+            ),
+            {"ids": ids},
+        )
+        return {int(row[0]): str(row[1]) for row in res.fetchall()}
+
+    async def put_many(self, states: Mapping[int, str]) -> None:
+        if not states:
+            return
+        now = datetime.now(timezone.utc)
+        await self.s.execute(
+            text(
+                """
+                INSERT INTO bot_states (user_id, data, updated_at)
+                VALUES (:user_id, :data, :updated_at)
+                ON CONFLICT (user_id) DO UPDATE
+                   SET data = EXCLUDED.data,
+                       updated_at = EXCLUDED.updated_at
+                """
+            ),
+            [{"user_id": int(uid), "data": data, "updated_at": now} for uid, data in states.items()],
+        )
@@ -0,0 +1,121 @@
+from __future__ import annotations
+
+import json
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional
+
+from sqlalchemy import bindparam, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class UpdateRepo:
+    """
+    Таблица telegram_updates — входящие апдейты вебхука Telegram, разложенные по шардам.
+    Каждый шард читает только свои строки, поэтому выборка не требует блокировок строк:
+    один шард обслуживает ровно один процесс (advisory lock в боте).
+    Жизнь строки: put -> take (taken_at) -> finish (done_at) -> purge через retention.
+    """
+
+    def __init__(self, s: AsyncSession) -> None:
+        self.s = s
+
+    async def put(self, *, update_id: int, shard: int, user_id: Optional[int], payload: Dict[str, Any]) -> bool:
+        """
+        Сохраняет апдейт; повторная доставка того же update_id игнорируется. True — апдейт новый.
+        """
+        res = await self.s.execute(
+            text(
+                """
+                INSERT INTO telegram_updates (update_id, shard, user_id, payload)
+                VALUES (:update_id, :shard, :user_id, :payload)
+                ON CONFLICT (update_id) DO NOTHING
+                """
+            ),
+            {
+                "update_id": int(update_id),
+                "shard": int(shard),
+                "user_id": user_id,
+                "payload": json.dumps(payload, ensure_ascii=False),
+            },
+        )
+        return bool(res.rowcount)
+
+    async def take(self, *, shard: int, limit: int = 100) -> List[Dict[str, Any]]:
+        """
+        Берёт в работу самые старые невзятые апдейты шарда в порядке update_id и помечает их taken_at.
+        Строки остаются в таблице до finish(): падение посреди обработки их не теряет.
+        """
+        res = await self.s.execute(
+            text(
+                """
+                SELECT update_id, payload
+                  FROM telegram_updates
+                 WHERE shard = :shard
+                   AND taken_at IS NULL
+                 ORDER BY update_id
+                 LIMIT :limit
+                """
+            ),
+            {"shard": int(shard), "limit": int(limit)},
+        )
+        rows = res.fetchall()
+        if not rows:
+            return []
+        await self.s.execute(
+            text("UPDATE telegram_updates SET taken_at = :now WHERE update_id IN :ids").bindparams(
+                bindparam("ids", expanding=True)
+            ),
+            {"now": _now(), "ids": [int(row[0]) for row in rows]},
+        )
+        out: List[Dict[str, Any]] = []
+        for _, payload in rows:
+            out.append(json.loads(payload) if isinstance(payload, str) else dict(payload))
+        return out
+
+    async def finish(self, update_ids: Iterable[int]) -> None:
+        """
+        Отмечает апдейты обработанными. Строка живёт ещё retention секунд (см. purge) —
+        пока она есть, повторная доставка того же update_id отсекается в put().
+        """
+        ids = [int(update_id) for update_id in update_ids]
+        if not ids:
+            return
+        await self.s.execute(
+            text("UPDATE telegram_updates SET done_at = :now WHERE update_id IN :ids").bindparams(
+                bindparam("ids", expanding=True)
+            ),
+            {"now": _now(), "ids": ids},
+        )
+
+    async def release_taken(self, *, shard: int) -> int:
+        """
+        Возвращает в очередь взятые, но не обработанные апдейты шарда — их брал упавший процесс.
+        Вызывается при старте воркера шарда: шард в каждый момент обслуживает один процесс.
+        """
+        res = await self.s.execute(
+            text(
+                """
+                UPDATE telegram_updates
+                   SET taken_at = NULL
+                 WHERE shard = :shard
+                   AND taken_at IS NOT NULL
+                   AND done_at IS NULL
+                """
+            ),
+            {"shard": int(shard)},
+        )
+        return int(res.rowcount or 0)
+
+    async def purge(self, *, shard: int, retention_seconds: float) -> int:
+        """
+        Удаляет обработанные апдейты шарда старше retention_seconds.
+        """
+        res = await self.s.execute(
+            text("DELETE FROM telegram_updates WHERE shard = :shard AND done_at < :cutoff"),
+            {"shard": int(shard), "cutoff": _now() - timedelta(seconds=retention_seconds)},
+        )
+        return int(res.rowcount or 0)
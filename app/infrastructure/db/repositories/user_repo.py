@@ -1,19 +1,57 @@
 from __future__ import annotations
 
-from typing import Dict, Set
+from typing import Any, Dict, FrozenSet, Iterable, List, Mapping, Optional, Set, Tuple
 
-from sqlalchemy import select, update, func, text
+from sqlalchemy import literal_column, or_, select, update, func, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.application.services.message_bus import publish_on_commit
 from app.domain.models.user import User
 from app.settings import settings
 
+# Данные пользователя изменились (после commit): {"telegram_id": ..., "fields": [...]}
+USER_CHANGED_CHANNEL = "user_changed"
+
+# Группы полей снапшота: страница объявляет, какие из них ей нужны, и читаются только они.
+# balances — одна строка users по первичному ключу; referrals — счётчики рефералов из той же
+# строки и подписи последних рефералов (ещё три чтения users по ключу).
+SNAPSHOT_BALANCES = "balances"
+SNAPSHOT_REFERRALS = "referrals"
+SNAPSHOT_GROUPS: Dict[str, Tuple[str, ...]] = {
+    SNAPSHOT_BALANCES: (
+        "user_id",
+        "internal_id",
+        "balance_tokens",
+        "balance_common",
+        "animate_balance_tokens",
+        "avatar_balance_tokens",
+        "email",
+        "clone_unlimited",
+        "free_tier_used",
+        "segment",
+        "first_name",
+        "last_name",
+        "invited_by",
+        "referred_id",
+    ),
+    SNAPSHOT_REFERRALS: ("friends_count", "recent_refs", "invitee_bonus"),
+}
+ALL_SNAPSHOT_GROUPS: FrozenSet[str] = frozenset(SNAPSHOT_GROUPS)
+SNAPSHOT_FIELD_GROUPS: Dict[str, str] = {
+    name: group for group, names in SNAPSHOT_GROUPS.items() for name in names
+}
+
 
 class UserRepo:
     def __init__(self, s: AsyncSession):
         self.s = s
 
+    def _changed(self, telegram_id: int, *fields: str) -> None:
+        # кэши снапшотов и известных пользователей сбрасываются после commit, в том числе в других процессах
+        publish_on_commit(self.s, USER_CHANGED_CHANNEL, {"telegram_id": int(telegram_id), "fields": sorted(fields)})
+
     # ---------- CRUD ----------
 
     async def get(self, telegram_id: int) -> User | None:
@@ -35,17 +73,70 @@ class UserRepo:
         segment: str | None = None,
         return_created: bool = False,
     ) -> User | tuple[User, bool]:
+        """
+        Возвращает пользователя, создавая его при первом обращении; переданные username/email/имя
+        обновляются, если отличаются. На Postgres — один INSERT ... ON CONFLICT; вызов без полей
+        для обновления начинается с SELECT, чтобы не брать блокировку строки на каждое чтение.
+        """
+        ref_id = invited_by if invited_by and invited_by != telegram_id else None
+        ref_internal_id = referred_id if ref_id else None
+        refreshed = {
+            key: value
+            for key, value in (("username", username), ("email", email), ("first_name", first_name), ("last_name", last_name))
+            if value is not None
+        }
+        new_user = dict(refreshed, invited_by=ref_id, referred_id=ref_internal_id, segment=segment or "lead")
+
+        if self.s.get_bind().dialect.name == "postgresql":
+            u, created = await self._upsert(telegram_id, refreshed, new_user)
+        else:
+            u, created = await self._select_or_insert(telegram_id, refreshed, new_user)
+
+        if created:
+            await self._append_segment_history(telegram_id=telegram_id, segment=u.segment)
+            if ref_id:
+                await self._apply_referral_bonus(
+                    inviter_id=ref_id,
+                    invitee_id=telegram_id,
+                    inviter_internal_id=ref_internal_id,
+                )
+
+        return (u, created) if return_created else u
+
+    async def _upsert(
+        self,
+        telegram_id: int,
+        refreshed: Dict[str, Any],
+        new_user: Dict[str, Any],
+    ) -> tuple[User, bool]:
+        if not refreshed:
+            u = await self.get(telegram_id)
+            if u:
+                return u, False
+
+        stmt = _upsert_statement(telegram_id, refreshed, new_user)
+        row = (await self.s.execute(stmt, execution_options={"populate_existing": True})).first()
+
+        if row is None:
+            # пользователь уже есть и не изменился (или его только что вставил параллельный запрос)
+            return await self._get_existing(telegram_id), False
+        u, inserted = row
+        if not inserted:
+            self._changed(telegram_id, *refreshed)
+        return u, bool(inserted)
+
+    async def _select_or_insert(
+        self,
+        telegram_id: int,
+        refreshed: Dict[str, Any],
+        new_user: Dict[str, Any],
+    ) -> tuple[User, bool]:
+        # Без ON CONFLICT ... RETURNING xmax (sqlite в dev/тестах): SELECT, затем UPDATE или INSERT
         u = await self.get(telegram_id)
         if u:
-            updates: Dict[str, object] = {}
-            if username is not None and username != u.username:
-                updates["username"] = username
-            if email is not None and email != u.email:
-                updates["email"] = email
-            if first_name is not None and first_name != u.first_name:
-                updates["first_name"] = first_name
-            if last_name is not None and last_name != u.last_name:
-                updates["last_name"] = last_name
+            updates: Dict[str, object] = {
+                key: value for key, value in refreshed.items() if value != getattr(u, key)
+            }
             if updates:
                 updates["updated_at"] = func.now()
                 await self.s.execute(
@@ -53,30 +144,23 @@ class UserRepo:
                     .where(User.telegram_id == telegram_id)
                     .values(**updates)
                 )
-                for key, val in updates.items():
+                # updated_at уже выставлен в UPDATE; func.now() на объекте дал бы при flush ещё один UPDATE
+                for key, val in refreshed.items():
                     setattr(u, key, val)
                 await self.s.flush()
-            return (u, False) if return_created else u
-
-        ref_id = invited_by if invited_by and invited_by != telegram_id else None
-        ref_internal_id = referred_id if ref_id else None
+                self._changed(telegram_id, *(key for key in updates if key != "updated_at"))
+            return u, False
 
         internal_id = await self._allocate_internal_id()
 
         u = User(
             telegram_id=telegram_id,
             internal_id=internal_id,
-            username=username,
-            email=email,
-            first_name=first_name,
-            last_name=last_name,
             balance_tokens=0,
             animate_balance_tokens=0,
             avatar_balance_tokens=0,
             friends_count=0,
-            invited_by=ref_id,
-            referred_id=ref_internal_id,
-            segment=segment or "lead",
+            **new_user,
         )
         self.s.add(u)
         try:
@@ -86,138 +170,180 @@ class UserRepo:
             await self.s.rollback()
             existing = await self.get(telegram_id)
             if existing:
-                return (existing, False) if return_created else existing
+                return existing, False
             raise
+        return u, True
 
-        await self._append_segment_history(telegram_id=telegram_id, segment=u.segment)
-
-        if ref_id:
-            await self._apply_referral_bonus(
-                inviter_id=ref_id,
-                invitee_id=telegram_id,
-                inviter_internal_id=ref_internal_id,
-            )
-
-        return (u, True) if return_created else u
+    async def _get_existing(self, telegram_id: int) -> User:
+        u = await self.get(telegram_id)
+        if u is None:
+            raise RuntimeError(f"user {telegram_id} disappeared during get_or_create")
+        return u
 
     async def inc_balance(self, *, telegram_id: int, delta: int, bucket: str | None = None) -> int:
         """
         Атомично увеличивает баланс и возвращает новое значение выбранного кошелька.
         bucket: None | "animate" | "avatar" — если None, используется legacy balance_tokens.
+        Один UPDATE ... RETURNING; пользователь создаётся, только если его ещё нет.
         """
-        await self.get_or_create(telegram_id)
-
-        if bucket == "animate":
-            column = User.animate_balance_tokens
-        elif bucket == "avatar":
-            column = User.avatar_balance_tokens
-        else:
-            column = User.balance_tokens
-
-        column_name = column.key
-        res = await self.s.execute(
+        column = self._balance_column(bucket)
+        stmt = (
             update(User)
             .where(User.telegram_id == telegram_id)
             .values(
                 **{
-                    column_name: column + delta,
+                    column.key: column + delta,
+                    "updated_at": func.now(),
+                }
+            )
+            .returning(column)
+        )
+        new_val = (await self.s.execute(stmt)).scalar_one_or_none()
+        if new_val is None:
+            await self.get_or_create(telegram_id)
+            new_val = (await self.s.execute(stmt)).scalar_one()
+        await self.s.flush()
+        self._changed(telegram_id, "balance")
+        return int(new_val)
+
+    async def debit_balance(self, *, telegram_id: int, amount: int = 1, bucket: str | None = None) -> Optional[int]:
+        """
+        Списывает amount, только если на кошельке хватает: один условный UPDATE ... RETURNING,
+        поэтому параллельные списания не уводят баланс в минус. None — не хватило (или нет пользователя).
+        """
+        column = self._balance_column(bucket)
+        stmt = (
+            update(User)
+            .where(User.telegram_id == telegram_id, column >= amount)
+            .values(
+                **{
+                    column.key: column - amount,
                     "updated_at": func.now(),
                 }
             )
             .returning(column)
         )
-        new_val = res.scalar_one()
+        new_val = (await self.s.execute(stmt)).scalar_one_or_none()
+        if new_val is None:
+            return None
         await self.s.flush()
+        self._changed(telegram_id, "balance")
         return int(new_val)
 
+    @staticmethod
+    def _balance_column(bucket: str | None):
+        if bucket == "animate":
+            return User.animate_balance_tokens
+        if bucket == "avatar":
+            return User.avatar_balance_tokens
+        return User.balance_tokens
+
     # ---------- Snapshot для интерфейсов ----------
 
-    async def snapshot(self, *, telegram_id: int) -> Dict[str, int]:
+    # Пользователь, счётчики рефералов и подписи трёх последних рефералов — одна строка users
+    # и три чтения users по первичному ключу, сколько бы рефералов ни было. Счётчики ведёт
+    # _log_referral_bonus, сверяет check_referral_counters.
+    _SNAPSHOT_SQL = text(
         """
-        Компактный слепок для подстановки в тексты бота.
-        Возвращает:
-          - user_id           (telegram_id)
-          - balance_tokens    (int)
-          - friends_count     (int)
+        SELECT u.telegram_id, u.internal_id, u.email, u.segment, u.first_name, u.last_name,
+               u.balance_tokens, u.animate_balance_tokens, u.avatar_balance_tokens, u.friends_count,
+               u.clone_unlimited, u.free_tier_used, u.invited_by, u.referred_id,
+               u.referral_friends, u.referral_earned,
+               u.recent_referral_1, r1.username AS recent_username_1, r1.internal_id AS recent_internal_id_1,
+               u.recent_referral_2, r2.username AS recent_username_2, r2.internal_id AS recent_internal_id_2,
+               u.recent_referral_3, r3.username AS recent_username_3, r3.internal_id AS recent_internal_id_3
+          FROM users u
+          LEFT JOIN users r1 ON r1.telegram_id = u.recent_referral_1
+          LEFT JOIN users r2 ON r2.telegram_id = u.recent_referral_2
+          LEFT JOIN users r3 ON r3.telegram_id = u.recent_referral_3
+         WHERE u.telegram_id = :uid
         """
-        u = await self.get_or_create(telegram_id)
+    )
 
-        friends = int(u.friends_count or 0)
-        res = await self.s.execute(
-            text(
-                """
-                SELECT COUNT(DISTINCT referred_user_id)
-                  FROM referral_bonuses
-                 WHERE referrer_user_id = :uid
-                """
-            ),
-            {"uid": telegram_id},
+    async def snapshot(self, *, telegram_id: int, groups: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+        """
+        Компактный слепок для подстановки в тексты бота (балансы, рефералы, профиль).
+        groups — нужные группы полей из SNAPSHOT_GROUPS (None — все). Группа balances
+        возвращается всегда: это строка users, без которой не посчитать остальное.
+        Любой набор групп — один запрос; пользователь создаётся только при первом обращении.
+        """
+        if groups is not None and SNAPSHOT_REFERRALS not in set(groups):
+            return _build_user_snapshot(await self.get_or_create(telegram_id))
+
+        row = (await self.s.execute(self._SNAPSHOT_SQL, {"uid": telegram_id})).mappings().first()
+        if row is None:
+            await self.get_or_create(telegram_id)
+            row = (await self.s.execute(self._SNAPSHOT_SQL, {"uid": telegram_id})).mappings().one()
+        recent = [
+            _referral_label(row[f"recent_username_{n}"], row[f"recent_internal_id_{n}"], row[f"recent_referral_{n}"])
+            for n in (1, 2, 3)
+            if row[f"recent_referral_{n}"] is not None
+        ]
+        return _build_snapshot(
+            row,
+            friends=int(row["referral_friends"] or 0),
+            referral_total=int(row["referral_earned"] or 0),
+            recent_refs=recent,
         )
-        friends = max(friends, int(res.scalar() or 0))
 
-        balance_common = int(u.balance_tokens or 0)
-        balance_animate = int(getattr(u, "animate_balance_tokens", 0) or 0)
-        balance_avatar = int(getattr(u, "avatar_balance_tokens", 0) or 0)
-        total_balance = balance_common + balance_animate + balance_avatar
-
-        # Суммарные и последние рефералки
-        res = await self.s.execute(
-            text(
-                """
-                SELECT COALESCE(SUM(amount), 0)
-                  FROM referral_bonuses
-                 WHERE referrer_user_id = :uid
-                """
-            ),
-            {"uid": telegram_id},
+    # Ожидаемые значения счётчиков по referral_bonuses — только у тех, у кого они разошлись
+    _REFERRAL_COUNTERS_DRIFT_SQL = text(
+        """
+        WITH ranked AS (
+            SELECT referrer_user_id, referred_user_id, amount,
+                   ROW_NUMBER() OVER (PARTITION BY referrer_user_id ORDER BY id DESC) AS rn
+              FROM referral_bonuses
+             WHERE referrer_user_id IS NOT NULL
+        ), agg AS (
+            SELECT referrer_user_id,
+                   COUNT(DISTINCT referred_user_id) AS friends,
+                   COALESCE(SUM(amount), 0) AS earned,
+                   MAX(CASE WHEN rn = 1 THEN referred_user_id END) AS recent_1,
+                   MAX(CASE WHEN rn = 2 THEN referred_user_id END) AS recent_2,
+                   MAX(CASE WHEN rn = 3 THEN referred_user_id END) AS recent_3
+              FROM ranked
+             GROUP BY referrer_user_id
         )
-        referral_total = int(res.scalar() or 0)
+        SELECT u.telegram_id,
+               COALESCE(agg.friends, 0) AS friends,
+               COALESCE(agg.earned, 0) AS earned,
+               agg.recent_1, agg.recent_2, agg.recent_3
+          FROM users u
+          LEFT JOIN agg ON agg.referrer_user_id = u.telegram_id
+         WHERE u.referral_friends <> COALESCE(agg.friends, 0)
+            OR u.referral_earned <> COALESCE(agg.earned, 0)
+            OR COALESCE(u.recent_referral_1, 0) <> COALESCE(agg.recent_1, 0)
+            OR COALESCE(u.recent_referral_2, 0) <> COALESCE(agg.recent_2, 0)
+            OR COALESCE(u.recent_referral_3, 0) <> COALESCE(agg.recent_3, 0)
+         ORDER BY u.telegram_id
+         LIMIT :limit
+        """
+    )
 
-        res = await self.s.execute(
-            text(
-                """
-                SELECT rb.referred_user_id, u.username, u.internal_id
-                  FROM referral_bonuses rb
-                  LEFT JOIN users u ON u.telegram_id = rb.referred_user_id
-                 WHERE rb.referrer_user_id = :uid
-                 ORDER BY rb.id DESC
-                 LIMIT 3
-                """
-            ),
-            {"uid": telegram_id},
-        )
-        rows = res.mappings().all()
-        recent_refs = []
-        for row in rows:
-            username = row.get("username")
-            internal_id = row.get("internal_id")
-            if username:
-                recent_refs.append(f"@{username}")
-            elif internal_id:
-                recent_refs.append(f"ID {internal_id}")
-            else:
-                recent_refs.append(str(row.get("referred_user_id") or ""))
-        recent_refs_text = "\n".join(recent_refs)
-
-        return {
-            "user_id": u.telegram_id,
-            "internal_id": int(u.internal_id),
-            "balance_tokens": total_balance,
-            "balance_common": balance_common,
-            "animate_balance_tokens": balance_animate,
-            "avatar_balance_tokens": balance_avatar,
-            "friends_count": friends,
-            "email": u.email,
-            "clone_unlimited": bool(u.clone_unlimited),
-            "free_tier_used": bool(u.free_tier_used),
-            "segment": u.segment,
-            "first_name": u.first_name,
-            "last_name": u.last_name,
-            "invited_by": u.invited_by,
-            "referred_id": u.referred_id,
-            "recent_refs": recent_refs_text,
-            "invitee_bonus": referral_total,
-        }
+    async def check_referral_counters(self, *, fix: bool = False, limit: int = 1000) -> List[int]:
+        """
+        Сверяет счётчики рефералов в users с referral_bonuses (полный проход по таблице бонусов —
+        для фоновой проверки, не для запросов пользователя). Возвращает telegram_id расхождений;
+        fix=True — переписывает их ожидаемыми значениями.
+        """
+        res = await self.s.execute(self._REFERRAL_COUNTERS_DRIFT_SQL, {"limit": int(limit)})
+        drift = res.mappings().all()
+        if fix:
+            for row in drift:
+                await self.s.execute(
+                    update(User)
+                    .where(User.telegram_id == row["telegram_id"])
+                    .values(
+                        referral_friends=int(row["friends"]),
+                        referral_earned=int(row["earned"]),
+                        recent_referral_1=row["recent_1"],
+                        recent_referral_2=row["recent_2"],
+                        recent_referral_3=row["recent_3"],
+                    )
+                )
+                self._changed(row["telegram_id"], "referrals")
+            await self.s.flush()
+        return [int(row["telegram_id"]) for row in drift]
 
     async def set_clone_unlimited(self, *, telegram_id: int, value: bool) -> None:
         await self.s.execute(
@@ -226,6 +352,7 @@ class UserRepo:
             .values(clone_unlimited=value, updated_at=func.now())
         )
         await self.s.flush()
+        self._changed(telegram_id, "clone_unlimited")
 
     async def set_free_tier_used(self, *, telegram_id: int, value: bool) -> None:
         await self.s.execute(
@@ -234,6 +361,7 @@ class UserRepo:
             .values(free_tier_used=value, updated_at=func.now())
         )
         await self.s.flush()
+        self._changed(telegram_id, "free_tier_used")
 
     async def get_by_internal_id(self, internal_id: int) -> User | None:
         res = await self.s.execute(
@@ -274,6 +402,7 @@ class UserRepo:
                 .where(User.telegram_id == inviter_id)
                 .values(friends_count=User.friends_count + 1, updated_at=func.now())
             )
+            self._changed(inviter_id, "friends_count")
             await self._log_referral_bonus(
                 ref_id=inviter_internal_id,
                 referrer_user_id=inviter_id,
@@ -299,6 +428,7 @@ class UserRepo:
             .values(email=email, updated_at=func.now())
         )
         await self.s.flush()
+        self._changed(telegram_id, "email")
 
     async def record_source(
         self,
@@ -365,6 +495,7 @@ class UserRepo:
         )
         await self._append_segment_history(telegram_id=telegram_id, segment=segment)
         await self.s.flush()
+        self._changed(telegram_id, "segment")
         return segment
 
     async def log_generation(
@@ -473,6 +604,27 @@ class UserRepo:
         deposit_rub_amount: int | None = None,
         deposit_token_amount: int | None = None,
     ) -> None:
+        if referrer_user_id:
+            # счётчики пригласившего — до вставки, пока EXISTS не видит новую строку.
+            # Два первых бонуса за одного друга в параллельных транзакциях посчитают его дважды;
+            # такое расхождение чинит check_referral_counters.
+            await self.s.execute(
+                text(
+                    """
+                    UPDATE users
+                       SET referral_friends = referral_friends + CASE WHEN EXISTS (
+                               SELECT 1 FROM referral_bonuses
+                                WHERE referred_user_id = :referred_user_id AND referrer_user_id = :referrer_user_id
+                           ) THEN 0 ELSE 1 END,
+                           referral_earned = referral_earned + :amount,
+                           recent_referral_3 = recent_referral_2,
+                           recent_referral_2 = recent_referral_1,
+                           recent_referral_1 = :referred_user_id
+                     WHERE telegram_id = :referrer_user_id
+                    """
+                ),
+                {"referrer_user_id": referrer_user_id, "referred_user_id": referred_user_id, "amount": int(amount or 0)},
+            )
         await self.s.execute(
             text(
                 """
@@ -494,3 +646,104 @@ class UserRepo:
             },
         )
         await self.s.flush()
+        if referrer_user_id:
+            # сумма и последние рефералы в снапшоте пригласившего
+            self._changed(referrer_user_id, "referrals")
+
+
+
+def _upsert_statement(telegram_id: int, refreshed: Dict[str, Any], new_user: Dict[str, Any]):
+    """
+    INSERT ... ON CONFLICT (telegram_id) для Postgres: создаёт пользователя или обновляет поля
+    `refreshed`, если они отличаются. Возвращает (User, inserted).
+    """
+    stmt = pg_insert(User).values(
+        telegram_id=telegram_id,
+        # nextval в VALUES тратится и при конфликте, а internal_id видят пользователи:
+        # у существующего берём его же номер, COALESCE до nextval тогда не доходит
+        internal_id=func.coalesce(
+            select(User.internal_id).where(User.telegram_id == telegram_id).scalar_subquery(),
+            func.nextval("users_internal_id_seq"),
+        ),
+        created_at=func.now(),
+        updated_at=func.now(),
+        **new_user,
+    )
+    if refreshed:
+        # строку переписываем, только если что-то действительно изменилось
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[User.telegram_id],
+            set_={**{key: stmt.excluded[key] for key in refreshed}, "updated_at": func.now()},
+            where=or_(*(getattr(User, key).is_distinct_from(stmt.excluded[key]) for key in refreshed)),
+        )
+    else:
+        stmt = stmt.on_conflict_do_nothing(index_elements=[User.telegram_id])
+    # xmax = 0 только у строки, которую этот INSERT вставил, а не обновил
+    stmt = stmt.returning(User, literal_column("xmax = 0").label("inserted"))
+    return stmt
+
+_SNAPSHOT_USER_COLUMNS = (
+    "telegram_id",
+    "internal_id",
+    "email",
+    "segment",
+    "first_name",
+    "last_name",
+    "balance_tokens",
+    "animate_balance_tokens",
+    "avatar_balance_tokens",
+    "friends_count",
+    "clone_unlimited",
+    "free_tier_used",
+    "invited_by",
+    "referred_id",
+)
+
+
+def _referral_label(username: str | None, internal_id: int | None, referred_user_id: int | None) -> str:
+    if username:
+        return f"@{username}"
+    if internal_id:
+        return f"ID {internal_id}"
+    return str(referred_user_id or "")
+
+
+def _build_user_snapshot(user: Any) -> Dict[str, Any]:
+    # user — модель User или строка запроса с колонками _SNAPSHOT_USER_COLUMNS
+    if not isinstance(user, Mapping):
+        user = {column: getattr(user, column, None) for column in _SNAPSHOT_USER_COLUMNS}
+    balance_common = int(user["balance_tokens"] or 0)
+    balance_animate = int(user["animate_balance_tokens"] or 0)
+    balance_avatar = int(user["avatar_balance_tokens"] or 0)
+    return {
+        "user_id": user["telegram_id"],
+        "internal_id": int(user["internal_id"]),
+        "balance_tokens": balance_common + balance_animate + balance_avatar,
+        "balance_common": balance_common,
+        "animate_balance_tokens": balance_animate,
+        "avatar_balance_tokens": balance_avatar,
+        "email": user["email"],
+        "clone_unlimited": bool(user["clone_unlimited"]),
+        "free_tier_used": bool(user["free_tier_used"]),
+        "segment": user["segment"],
+        "first_name": user["first_name"],
+        "last_name": user["last_name"],
+        "invited_by": user["invited_by"],
+        "referred_id": user["referred_id"],
+    }
+
+
+def _build_snapshot(
+    user: Mapping[str, Any],
+    *,
+    friends: int,
+    referral_total: int,
+    recent_refs: List[str],
+) -> Dict[str, Any]:
+    snap = _build_user_snapshot(user)
+    snap.update(
+        friends_count=max(int(user["friends_count"] or 0), friends),
+        recent_refs="\n".join(recent_refs),
+        invitee_bonus=referral_total,
+    )
+    return snap
@@ -0,0 +1,388 @@
+"""
+Асинхронная постобработка видео через ffmpeg.
+
+Все вызовы идут через asyncio-сабпроцессы, поэтому кодирование не блокирует event loop бота.
+Одновременно работает не больше `MEDIA_WORKERS` процессов (по умолчанию — число ядер),
+остальные задачи ждут своей очереди; для каждой задачи логируются время ожидания и кодирования.
+
+Перед кодированием файл проверяется ffprobe (`probe`), и `plan_for` выбирает самый дешёвый путь:
+    passthrough — уже H.264/yuv420p нужного соотношения, со звуком AAC и moov в начале;
+    remux       — всё подходит, но moov в конце: копируем потоки с +faststart;
+    mux_audio   — видео подходит, нет звука (или не AAC): копируем видео, добавляем/перекодируем аудио;
+    transcode   — полный проход scale+pad+anullsrc через libx264.
+
+Ролик не держится в памяти процесса целиком: он скачивается потоком в `media_workspace()`
+(по умолчанию tmpfs /dev/shm), ffmpeg читает и пишет файлы там же, а бот отправляет результат
+через FSInputFile.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import shutil
+import struct
+import tempfile
+import time
+from collections import Counter
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Dict, List, Optional, Sequence, Tuple
+
+from app.settings import settings
+
+log = logging.getLogger("media.ffmpeg")
+
+
+def target_size(aspect: str) -> Tuple[int, int]:
+    if aspect == "16:9":
+        return 960, 540
+    if aspect == "1:1":
+        return 540, 540
+    return 540, 960  # 9:16
+
+
+PLAN_PASSTHROUGH = "passthrough"
+PLAN_REMUX = "remux"
+PLAN_MUX_AUDIO = "mux_audio"
+PLAN_TRANSCODE = "transcode"
+
+# допуск по соотношению сторон: Kling иногда отдаёт 1078x1918 и т.п.
+_ASPECT_TOLERANCE = 0.01
+
+
+@dataclass(frozen=True)
+class MediaProbe:
+    vcodec: str
+    width: int
+    height: int
+    pix_fmt: str
+    sar: str = "1:1"
+    rotation: int = 0
+    acodec: Optional[str] = None
+    faststart: bool = False
+
+    @property
+    def has_audio(self) -> bool:
+        return self.acodec is not None
+
+
+@dataclass(frozen=True)
+class MediaJobResult:
+    label: str
+    returncode: int
+    wait_s: float
+    run_s: float
+    stderr: bytes = b""
+    stdout: bytes = b""
+
+    @property
+    def ok(self) -> bool:
+        return self.returncode == 0
+
+
+@dataclass
+class MediaStats:
+    limit: int
+    running: int
+    waiting: int
+    completed: int
+    failed: int
+    total_wait_s: float
+    total_run_s: float
+    plans: Dict[str, int] = field(default_factory=dict)
+
+    @property
+    def encoder_skipped(self) -> float:
+        """Доля задач, обошедшихся без libx264."""
+        total = sum(self.plans.values())
+        if not total:
+            return 0.0
+        return 1.0 - self.plans.get(PLAN_TRANSCODE, 0) / total
+
+
+def moov_before_mdat(path: str) -> bool:
+    """
+    Проходит по атомам верхнего уровня MP4 и проверяет, что moov идёт раньше mdat
+    (иначе Telegram не может начать проигрывание до полной загрузки).
+    """
+    with open(path, "rb") as f:
+        size_total = os.fstat(f.fileno()).st_size
+        pos = 0
+        while pos + 8 <= size_total:
+            f.seek(pos)
+            header = f.read(8)
+            size, kind = struct.unpack(">I4s", header)
+            if size == 1:
+                size = struct.unpack(">Q", f.read(8))[0]
+            elif size == 0:
+                size = size_total - pos
+            if kind == b"moov":
+                return True
+            if kind == b"mdat":
+                return False
+            if size < 8:
+                return False
+            pos += size
+    return False
+
+
+def parse_probe(raw: bytes, faststart: bool) -> Optional[MediaProbe]:
+    try:
+        info = json.loads(raw or b"{}")
+    except ValueError:
+        return None
+    video = None
+    audio = None
+    for stream in info.get("streams") or []:
+        if stream.get("codec_type") == "video" and video is None:
+            video = stream
+        elif stream.get("codec_type") == "audio" and audio is None:
+            audio = stream
+    if video is None:
+        return None
+
+    rotation = 0
+    try:
+        rotation = int((video.get("tags") or {}).get("rotate") or 0)
+        for side in video.get("side_data_list") or []:
+            if "rotation" in side:
+                rotation = int(side["rotation"])
+    except (TypeError, ValueError):
+        rotation = 0
+
+    return MediaProbe(
+        vcodec=str(video.get("codec_name") or ""),
+        width=int(video.get("width") or 0),
+        height=int(video.get("height") or 0),
+        pix_fmt=str(video.get("pix_fmt") or ""),
+        sar=str(video.get("sample_aspect_ratio") or "1:1"),
+        rotation=rotation % 360,
+        acodec=str(audio.get("codec_name")) if audio else None,
+        faststart=faststart,
+    )
+
+
+def plan_for(probe: Optional[MediaProbe], aspect: str) -> str:
+    if probe is None:
+        return PLAN_TRANSCODE
+    w, h = target_size(aspect)
+    video_ok = (
+        probe.vcodec == "h264"
+        and probe.pix_fmt == "yuv420p"
+        and probe.sar in ("1:1", "0:1")
+        and probe.rotation == 0
+        and probe.width > 0
+        and probe.height > 0
+        and abs(probe.width * h - probe.height * w) <= _ASPECT_TOLERANCE * probe.height * w
+    )
+    if not video_ok:
+        return PLAN_TRANSCODE
+    if probe.acodec != "aac":
+        return PLAN_MUX_AUDIO
+    if not probe.faststart:
+        return PLAN_REMUX
+    return PLAN_PASSTHROUGH
+
+
+class MediaProcessor:
+    def __init__(self, *, workers: int | None = None, timeout: float = 300.0) -> None:
+        self._limit = max(1, int(workers or os.cpu_count() or 1))
+        self._sem = asyncio.Semaphore(self._limit)
+        self._timeout = timeout
+        self._running = 0
+        self._waiting = 0
+        self._completed = 0
+        self._failed = 0
+        self._total_wait = 0.0
+        self._total_run = 0.0
+        self._plans: Counter = Counter()
+
+    def stats(self) -> MediaStats:
+        return MediaStats(
+            limit=self._limit,
+            running=self._running,
+            waiting=self._waiting,
+            completed=self._completed,
+            failed=self._failed,
+            total_wait_s=self._total_wait,
+            total_run_s=self._total_run,
+            plans=dict(self._plans),
+        )
+
+    async def run(self, cmd: Sequence[str], *, label: str = "ffmpeg", capture: bool = False) -> MediaJobResult:
+        queued_at = time.monotonic()
+        self._waiting += 1
+        try:
+            await self._sem.acquire()
+        finally:
+            self._waiting -= 1
+        started_at = time.monotonic()
+        self._running += 1
+        returncode = -1
+        stdout = stderr = b""
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdout=asyncio.subprocess.PIPE if capture else asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.PIPE,
+            )
+            try:
+                stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout=self._timeout)
+                returncode = proc.returncode if proc.returncode is not None else -1
+            except asyncio.TimeoutError:
+                proc.kill()
+                await proc.wait()
+                log.warning("%s: killed after %.0fs", label, self._timeout)
+            except asyncio.CancelledError:
+                proc.kill()
+                raise
+        except FileNotFoundError as exc:
+            log.warning("%s: %s", label, exc)
+        finally:
+            self._running -= 1
+            self._sem.release()
+
+        finished_at = time.monotonic()
+        result = MediaJobResult(
+            label=label,
+            returncode=returncode,
+            wait_s=started_at - queued_at,
+            run_s=finished_at - started_at,
+            stderr=stderr or b"",
+            stdout=stdout or b"",
+        )
+        self._total_wait += result.wait_s
+        self._total_run += result.run_s
+        if result.ok:
+            self._completed += 1
+        else:
+            self._failed += 1
+        log.info("%s: rc=%s wait=%.2fs run=%.2fs", label, result.returncode, result.wait_s, result.run_s)
+        return result
+
+    async def probe(self, path: str) -> Optional[MediaProbe]:
+        cmd = ["ffprobe", "-v", "error", "-show_streams", "-of", "json", path]
+        result = await self.run(cmd, label="probe", capture=True)
+        if not result.ok:
+            return None
+        try:
+            faststart = moov_before_mdat(path)
+        except (OSError, struct.error):
+            faststart = False
+        return parse_probe(result.stdout, faststart)
+
+    async def fit_for_telegram(self, src: str, aspect: str, dst: str) -> str:
+        """
+        Приводит ролик к виду для Telegram самым дешёвым путём (см. plan_for).
+        Возвращает путь к файлу для отправки: dst, либо src, если обработка не нужна или не удалась.
+        """
+        try:
+            info = await self.probe(src)
+            plan = plan_for(info, aspect)
+            self._plans[plan] += 1
+            if plan == PLAN_PASSTHROUGH:
+                return src
+            result = await self.run(build_fit_command(plan, src, dst, aspect, info), label=f"{plan} {aspect}")
+            if not result.ok or not os.path.exists(dst):
+                return src
+            return dst
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            return src
+
+
+def build_fit_command(plan: str, src: str, dst: str, aspect: str, probe: Optional[MediaProbe] = None) -> List[str]:
+    silence = ["-f", "lavfi", "-i", "anullsrc=channel_layout=stereo:sample_rate=44100"]
+    tail = ["-movflags", "+faststart", dst]
+
+    if plan == PLAN_REMUX:
+        return ["ffmpeg", "-y", "-i", src, "-map", "0", "-c", "copy", *tail]
+
+    if plan == PLAN_MUX_AUDIO:
+        # видео копируем как есть; звук — исходный, перекодированный в AAC, либо тишина
+        if probe is not None and probe.has_audio:
+            return ["ffmpeg", "-y", "-i", src, "-map", "0:v:0", "-map", "0:a:0", "-c:v", "copy", "-c:a", "aac", *tail]
+        return [
+            "ffmpeg",
+            "-y",
+            "-i",
+            src,
+            *silence,
+            "-map",
+            "0:v:0",
+            "-map",
+            "1:a:0",
+            "-shortest",
+            "-c:v",
+            "copy",
+            "-c:a",
+            "aac",
+            *tail,
+        ]
+
+    # Один проход: вписываем кадр (scale+pad, SAR 1:1), добавляем тихую дорожку, кодируем один раз.
+    w, h = target_size(aspect)
+    vf = (
+        f"scale={w}:{h}:force_original_aspect_ratio=decrease:flags=lanczos,"
+        f"pad={w}:{h}:(ow-iw)/2:(oh-ih)/2,"
+        "setsar=1"
+    )
+    return [
+        "ffmpeg",
+        "-y",
+        "-i",
+        src,
+        *silence,
+        "-map",
+        "0:v:0",
+        "-map",
+        "1:a:0",
+        "-vf",
+        vf,
+        "-metadata:s:v:0",
+        "rotate=0",
+        "-shortest",
+        "-c:v",
+        "libx264",
+        "-pix_fmt",
+        "yuv420p",
+        "-c:a",
+        "aac",
+        *tail,
+    ]
+
+
+def _workspace_root() -> Optional[str]:
+    root = settings.MEDIA_TMP_DIR
+    if root:
+        return root
+    # /dev/shm — tmpfs в RAM: ролики по несколько МБ не трогают диск
+    if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK):
+        return "/dev/shm"
+    return None
+
+
+@asynccontextmanager
+async def media_workspace() -> AsyncIterator[str]:
+    """
+    Временная папка одной задачи: сюда скачивается ролик KlingAI и пишется результат ffmpeg.
+    Удаляется целиком при выходе, даже если задачу отменили.
+    """
+    path = tempfile.mkdtemp(prefix="animate-", dir=_workspace_root())
+    try:
+        yield path
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+_processor: MediaProcessor | None = None
+
+
+def get_media_processor() -> MediaProcessor:
+    global _processor
+    if _processor is None:
+        _processor = MediaProcessor(workers=settings.MEDIA_WORKERS or None, timeout=settings.MEDIA_TIMEOUT)
+    return _processor
@@ -0,0 +1,327 @@
+"""
+Единый опросчик статусов KlingAI для всех незавершённых задач процесса.
+
+Вместо отдельного цикла `poll_until_ready` на каждую генерацию задачи регистрируются
+в `KlingStatusPoller.wait(task_id)`, а один планировщик решает, когда проверять каждую из них.
+Интервал подстраивается под наблюдаемое распределение времени готовности:
+следующая проверка назначается на момент, к которому обычно завершается ещё `step` доля задач
+(редко в начале, часто около типичного времени готовности), с ограничением [dense, sparse].
+
+Если KlingAI присылает callback (`KLINGAI_CALLBACK_URL`), событие шины `KLING_TASK_CHANNEL` только
+будит задачу через `poke()`: статус и ссылка на видео всё равно берутся из get_status, телу callback
+не доверяем. Плановый опрос в этом режиме — редкая страховка (`fallback_interval`).
+"""
+from __future__ import annotations
+
+import asyncio
+import heapq
+import logging
+from bisect import bisect_right
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Callable, Deque, Dict, List, Optional
+
+from app.infrastructure.providers.klingai import KlingClient, KlingError, KlingGeneration, callback_url
+from app.settings import settings
+
+log = logging.getLogger("providers.klingai.poller")
+
+KLING_TASK_CHANNEL = "kling_task"
+
+_DONE_STATES = {"completed", "succeeded", "succeed"}
+_FAILED_STATES = {"failed", "error"}
+
+
+@dataclass
+class _Watch:
+    task_id: str
+    submitted_at: float
+    deadline: float
+    future: asyncio.Future
+    polls: int = 0
+    waiters: int = 0
+    # время актуальной записи в куче: остальные записи этой задачи устарели
+    due: float = 0.0
+    checking: bool = False
+    checked_at: float = float("-inf")
+    # callback пришёл во время проверки — перепроверить сразу после неё
+    poked: bool = False
+
+
+@dataclass
+class PollerStats:
+    tracked: int = 0
+    polls: int = 0
+    completed: int = 0
+    failed: int = 0
+    samples: List[float] = field(default_factory=list)
+
+
+class KlingStatusPoller:
+    def __init__(
+        self,
+        client_factory: Callable[[], KlingClient] = KlingClient,
+        *,
+        concurrency: int = 8,
+        sparse_interval: float = 15.0,
+        dense_interval: float = 2.0,
+        warmup_interval: float = 5.0,
+        warmup_window: float = 60.0,
+        step: float = 0.1,
+        min_samples: int = 10,
+        history: int = 500,
+        timeout: float = 1800.0,
+        fallback_interval: float | None = None,
+    ) -> None:
+        self._client_factory = client_factory
+        self._fallback_interval = fallback_interval
+        self._client: KlingClient | None = None
+        self._sem = asyncio.Semaphore(max(1, int(concurrency)))
+        self._sparse = float(sparse_interval)
+        self._dense = float(dense_interval)
+        self._warmup_interval = float(warmup_interval)
+        self._warmup_window = float(warmup_window)
+        self._step = float(step)
+        self._min_samples = int(min_samples)
+        self._timeout = float(timeout)
+        self._samples: Deque[float] = deque(maxlen=int(history))
+        self._sorted: List[float] | None = None
+        self._watches: Dict[str, _Watch] = {}
+        self._heap: list[tuple[float, str]] = []
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._inflight: set[asyncio.Task] = set()
+        self.polls = 0
+        self.completed = 0
+        self.failed = 0
+
+    # ---------- публичный API ----------
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._task = None
+        for task in list(self._inflight):
+            task.cancel()
+        for watch in self._watches.values():
+            if not watch.future.done():
+                watch.future.cancel()
+        self._watches.clear()
+        self._heap.clear()
+
+    async def wait(self, task_id: str, *, elapsed: float = 0.0, timeout: float | None = None) -> KlingGeneration:
+        """
+        Ждёт готовности задачи KlingAI. elapsed — сколько секунд задача уже выполняется
+        (например, после рестарта), чтобы планировщик сразу попал в нужную фазу.
+        """
+        self.start()
+        watch = self._watches.get(task_id)
+        if watch is None:
+            loop = asyncio.get_running_loop()
+            now = loop.time()
+            watch = _Watch(
+                task_id=task_id,
+                submitted_at=now - max(0.0, elapsed),
+                deadline=now + (timeout or self._timeout),
+                future=loop.create_future(),
+            )
+            self._watches[task_id] = watch
+            self._schedule(watch, now + self._delay_for(max(0.0, elapsed)))
+        watch.waiters += 1
+        try:
+            return await asyncio.shield(watch.future)
+        finally:
+            watch.waiters -= 1
+            if watch.waiters == 0 and not watch.future.done():
+                # последний ожидающий ушёл (отмена генерации) — задачу больше не опрашиваем
+                self._forget(watch)
+                watch.future.cancel()
+
+    def poke(self, task_id: str) -> bool:
+        """
+        Callback KlingAI о задаче: проверить её статус сейчас, не дожидаясь расписания
+        (не чаще dense_interval). Возвращает True, если задачу кто-то ждёт.
+        """
+        watch = self._watches.get(task_id)
+        if watch is None or watch.future.done():
+            return False
+        if watch.checking:
+            watch.poked = True
+        else:
+            now = asyncio.get_running_loop().time()
+            self._schedule(watch, max(now, watch.checked_at + self._dense))
+        return True
+
+    def stats(self) -> PollerStats:
+        return PollerStats(
+            tracked=len(self._watches),
+            polls=self.polls,
+            completed=self.completed,
+            failed=self.failed,
+            samples=list(self._samples),
+        )
+
+    # ---------- планирование ----------
+
+    def _sorted_samples(self) -> List[float]:
+        if self._sorted is None:
+            self._sorted = sorted(self._samples)
+        return self._sorted
+
+    def _delay_for(self, age: float) -> float:
+        if self._fallback_interval:
+            return self._fallback_interval
+        return self._next_delay(age)
+
+    def _next_delay(self, age: float) -> float:
+        samples = self._sorted_samples()
+        if len(samples) < self._min_samples:
+            # Пока статистики нет: редкий опрос в первые ~60с, дальше умеренный
+            if age < self._warmup_window:
+                return max(self._dense, min(self._sparse, self._warmup_window - age))
+            return self._warmup_interval
+
+        n = len(samples)
+        done = bisect_right(samples, age) / n
+        target = done + self._step
+        if target >= 1.0:
+            # хвост распределения: чем дольше задача превышает наблюдавшийся максимум, тем реже опрос
+            overdue = age - samples[-1]
+            return max(self._dense, min(self._sparse, self._dense + overdue / 4))
+        due = samples[min(n - 1, int(target * n))]
+        return max(self._dense, min(self._sparse, due - age))
+
+    def _schedule(self, watch: _Watch, at: float) -> None:
+        watch.due = min(at, watch.deadline)
+        heapq.heappush(self._heap, (watch.due, watch.task_id))
+        self._wakeup.set()
+
+    def _record_sample(self, duration: float) -> None:
+        self._samples.append(duration)
+        self._sorted = None
+
+    def _apply(self, watch: _Watch, status: KlingGeneration) -> bool:
+        state = (status.state or "").lower()
+        if state in _DONE_STATES and status.video_url:
+            loop = asyncio.get_running_loop()
+            self._record_sample(loop.time() - watch.submitted_at)
+            self._finish(watch, result=status)
+            self.completed += 1
+            return True
+        if state in _FAILED_STATES:
+            self._finish(watch, error=KlingError(status.failure_reason or "Generation failed"))
+            self.failed += 1
+            return True
+        return False
+
+    def _forget(self, watch: _Watch) -> None:
+        # под тем же task_id уже может ждать новая запись — её не трогаем
+        if self._watches.get(watch.task_id) is watch:
+            del self._watches[watch.task_id]
+
+    def _finish(self, watch: _Watch, *, result: KlingGeneration | None = None, error: Exception | None = None) -> None:
+        self._forget(watch)
+        if watch.future.done():
+            return
+        if error is not None:
+            watch.future.set_exception(error)
+        else:
+            watch.future.set_result(result)
+
+    async def _check(self, watch: _Watch) -> None:
+        loop = asyncio.get_running_loop()
+        watch.checking = True
+        async with self._sem:
+            if watch.future.done():
+                return
+            try:
+                if self._client is None:
+                    self._client = self._client_factory()
+                status: Optional[KlingGeneration] = await self._client.get_status(watch.task_id)
+            except KlingError as exc:
+                log.warning("poll task_id=%s failed: %s", watch.task_id, exc)
+                status = None
+            except Exception as exc:  # noqa: BLE001
+                log.warning("poll task_id=%s error: %s", watch.task_id, exc)
+                status = None
+            self.polls += 1
+            watch.polls += 1
+            watch.checking = False
+            watch.checked_at = loop.time()
+
+        if watch.future.done():
+            return
+        if status is not None and self._apply(watch, status):
+            return
+        now = loop.time()
+        if now >= watch.deadline:
+            self._finish(
+                watch,
+                error=KlingError(f"Превышено время ожидания генерации в KlingAI (generation_id={watch.task_id})"),
+            )
+            self.failed += 1
+            return
+        poked, watch.poked = watch.poked, False
+        self._schedule(watch, now + (self._dense if poked else self._delay_for(now - watch.submitted_at)))
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            self._wakeup.clear()
+            now = loop.time()
+            while self._heap and self._heap[0][0] <= now:
+                at, task_id = heapq.heappop(self._heap)
+                watch = self._watches.get(task_id)
+                if watch is None or watch.future.done() or at != watch.due:
+                    continue
+                task = asyncio.create_task(self._check(watch))
+                self._inflight.add(task)
+                task.add_done_callback(self._inflight.discard)
+
+            timeout = self._heap[0][0] - now if self._heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+
+_poller: KlingStatusPoller | None = None
+
+
+def get_status_poller() -> KlingStatusPoller:
+    global _poller
+    if _poller is None:
+        _poller = KlingStatusPoller(
+            concurrency=settings.KLINGAI_POLL_CONCURRENCY,
+            sparse_interval=settings.KLINGAI_POLL_SPARSE_INTERVAL,
+            dense_interval=settings.KLINGAI_POLL_DENSE_INTERVAL,
+            timeout=settings.KLINGAI_POLL_TIMEOUT,
+            fallback_interval=settings.KLINGAI_CALLBACK_FALLBACK_INTERVAL if callback_url() else None,
+        )
+    return _poller
+
+
+def on_task_event(payload: dict) -> None:
+    """
+    Подписчик шины: callback KlingAI пришёл (в этот или другой процесс) — проверяем задачу сейчас.
+    """
+    if _poller is None:
+        return
+    task_id = str(payload.get("task_id") or "")
+    if task_id:
+        _poller.poke(task_id)
+
+
+async def stop_status_poller() -> None:
+    global _poller
+    poller, _poller = _poller, None
+    if poller is not None:
+        await poller.stop()
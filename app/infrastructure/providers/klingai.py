@@ -6,18 +6,31 @@ from dataclasses import dataclass
 import hashlib
 import hmac
 import json
+import logging
 import time
-from typing import Any, Dict, Optional
+from typing import Any, AsyncIterator, Dict, Optional
 
 import httpx
 
 from app.settings import settings
 
+log = logging.getLogger("providers.klingai")
+
+DEFAULT_MODEL = "kling-v1"
+
 
 class KlingError(Exception):
     pass
 
 
+class KlingRateLimited(KlingError):
+    """KlingAI отклонил запрос из-за лимита частоты/параллельности — задачу стоит повторить позже."""
+
+
+# коды KlingAI: 1302 — слишком частые запросы, 1303 — превышена параллельность
+_RATE_LIMIT_CODES = {"1302", "1303"}
+
+
 @dataclass
 class KlingGeneration:
     id: str
@@ -26,12 +39,107 @@ class KlingGeneration:
     failure_reason: Optional[str] = None
 
 
+@dataclass
+class DownloadStats:
+    bytes: int = 0
+    seconds: float = 0.0
+    resumes: int = 0
+
+    @property
+    def mb_per_s(self) -> float:
+        if self.seconds <= 0:
+            return 0.0
+        return self.bytes / self.seconds / (1024 * 1024)
+
+
+# ---------- Общий HTTP-пул и JWT на весь процесс ----------
+
+_shared_http: httpx.AsyncClient | None = None
+# access_key -> (token, exp): один JWT на все задачи, перевыпуск за минуту до истечения
+_jwt_cache: Dict[str, tuple[str, int]] = {}
+
+
+def _http2_enabled() -> bool:
+    if not settings.KLINGAI_HTTP2:
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        log.warning("KLINGAI_HTTP2 включён, но пакет h2 не установлен — работаем по HTTP/1.1")
+        return False
+    return True
+
+
+def shared_http_client() -> httpx.AsyncClient:
+    """
+    Процессный httpx-клиент с keep-alive пулом: create/poll/download всех генераций
+    переиспользуют TCP+TLS соединения к KlingAI вместо нового рукопожатия на каждую задачу.
+    """
+    global _shared_http
+    if _shared_http is None or _shared_http.is_closed:
+        limits = httpx.Limits(
+            max_connections=settings.KLINGAI_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.KLINGAI_MAX_KEEPALIVE,
+            keepalive_expiry=settings.KLINGAI_KEEPALIVE_EXPIRY,
+        )
+        _shared_http = httpx.AsyncClient(
+            timeout=httpx.Timeout(30.0, connect=10.0),
+            limits=limits,
+            http2=_http2_enabled(),
+        )
+    return _shared_http
+
+
+async def close_shared_http_client() -> None:
+    global _shared_http
+    client, _shared_http = _shared_http, None
+    if client is not None and not client.is_closed:
+        await client.aclose()
+
+
+def parse_task(data_block: Dict[str, Any] | None, generation_id: str | None = None) -> KlingGeneration:
+    """
+    Разбирает блок задачи KlingAI — одинаковый в ответе GET и в теле callback.
+    """
+    data_block = data_block if isinstance(data_block, dict) else {}
+    result = data_block.get("task_result") or {}
+    videos = result.get("videos") or []
+    video_url = None
+    if videos and isinstance(videos, list):
+        first = videos[0] or {}
+        if isinstance(first, dict):
+            video_url = first.get("url")
+    return KlingGeneration(
+        id=str(data_block.get("task_id") or generation_id or ""),
+        state=str(data_block.get("task_status") or "unknown"),
+        video_url=video_url,
+        failure_reason=data_block.get("task_status_msg"),
+    )
+
+
+def callback_url() -> str | None:
+    """
+    Публичный URL для callback о готовности задачи (None — callback выключен, работаем опросом).
+    Без KLINGAI_CALLBACK_SECRET callback не включается: API такие запросы всё равно отклоняет.
+    """
+    url = (settings.KLINGAI_CALLBACK_URL or "").strip()
+    if not url:
+        return None
+    if not settings.KLINGAI_CALLBACK_SECRET:
+        log.warning("KLINGAI_CALLBACK_URL is set without KLINGAI_CALLBACK_SECRET: callback disabled, polling only")
+        return None
+    sep = "&" if "?" in url else "?"
+    return f"{url}{sep}token={settings.KLINGAI_CALLBACK_SECRET}"
+
+
 class KlingClient:
     """
     Минимальный async-клиент для KlingAI image->video.
+    По умолчанию работает поверх общего пула `shared_http_client()`;
+    закрывать его должен владелец процесса через `close_shared_http_client()`.
     """
 
-    def __init__(self) -> None:
+    def __init__(self, http: httpx.AsyncClient | None = None) -> None:
         if not settings.KLINGAI_ACCESS_KEY:
             raise KlingError("KLINGAI_ACCESS_KEY не задан")
         if not settings.KLINGAI_SECRET_KEY:
@@ -41,17 +149,17 @@ class KlingClient:
         self._base = settings.KLINGAI_BASE_URL.rstrip("/")
         self._access_key = settings.KLINGAI_ACCESS_KEY
         self._secret_key = settings.KLINGAI_SECRET_KEY
-        self._token: str | None = None
-        self._token_exp: int | None = None
         self._headers = {
             "Accept": "application/json",
             "Content-Type": "application/json",
         }
-        timeout = httpx.Timeout(30.0, connect=10.0)
-        self._client = httpx.AsyncClient(timeout=timeout)
+        self._client = http or shared_http_client()
 
     async def close(self) -> None:
-        await self._client.aclose()
+        """
+        Пул не закрываем: общий живёт до остановки процесса, а переданным управляет вызывающий.
+        """
+        return None
 
     def _b64url(self, raw: bytes) -> str:
         return base64.urlsafe_b64encode(raw).rstrip(b"=").decode("ascii")
@@ -73,9 +181,11 @@ class KlingClient:
 
     def _auth_header(self) -> str:
         now = int(time.time())
-        if not self._token or not self._token_exp or now >= self._token_exp - 60:
-            self._token, self._token_exp = self._encode_jwt_token()
-        return f"Bearer {self._token}"
+        cached = _jwt_cache.get(self._access_key)
+        if not cached or now >= cached[1] - 60:
+            cached = self._encode_jwt_token()
+            _jwt_cache[self._access_key] = cached
+        return f"Bearer {cached[0]}"
 
     async def _request(self, method: str, path: str, **kwargs) -> Dict[str, Any]:
         url = f"{self._base}{path}"
@@ -85,6 +195,8 @@ class KlingClient:
         except Exception as exc:  # noqa: BLE001
             raise KlingError(f"KlingAI запрос не удался: {exc}") from exc
 
+        if resp.status_code == 429:
+            raise KlingRateLimited(f"KlingAI 429: {resp.text}")
         if resp.status_code >= 400:
             raise KlingError(f"KlingAI {resp.status_code}: {resp.text}")
         try:
@@ -95,6 +207,8 @@ class KlingClient:
             code = payload.get("code")
             if code not in (None, 0, "0"):
                 message = payload.get("message") or "KlingAI ошибка"
+                if str(code) in _RATE_LIMIT_CODES:
+                    raise KlingRateLimited(f"KlingAI code {code}: {message}")
                 raise KlingError(f"KlingAI code {code}: {message}")
         return payload
 
@@ -115,7 +229,7 @@ class KlingClient:
         *,
         prompt: str,
         image_url: str,
-        model_name: str | None = "kling-v1",
+        model_name: str | None = DEFAULT_MODEL,
         mode: str = "std",
         duration: str = "5",
     ) -> KlingGeneration:
@@ -128,6 +242,9 @@ class KlingClient:
             payload["model_name"] = model_name
         if mode:
             payload["mode"] = mode
+        hook = callback_url()
+        if hook:
+            payload["callback_url"] = hook
         data = await self._request("POST", "/v1/videos/image2video", json=payload)
         data_block = data.get("data") if isinstance(data, dict) else {}
         gen_id = data_block.get("task_id")
@@ -139,19 +256,7 @@ class KlingClient:
     async def get_status(self, generation_id: str) -> KlingGeneration:
         data = await self._request("GET", f"/v1/videos/image2video/{generation_id}")
         data_block = data.get("data") if isinstance(data, dict) else {}
-        result = data_block.get("task_result") or {}
-        videos = result.get("videos") or []
-        video_url = None
-        if videos and isinstance(videos, list):
-            first = videos[0] or {}
-            if isinstance(first, dict):
-                video_url = first.get("url")
-        return KlingGeneration(
-            id=str(data_block.get("task_id") or generation_id),
-            state=str(data_block.get("task_status") or "unknown"),
-            video_url=video_url,
-            failure_reason=data_block.get("task_status_msg"),
-        )
+        return parse_task(data_block, generation_id)
 
     async def poll_until_ready(self, generation_id: str, *, interval: float = 3.0, attempts: int = 200) -> KlingGeneration:
         last = None
@@ -169,9 +274,66 @@ class KlingClient:
         raise KlingError(f"Превышено время ожидания генерации в KlingAI (generation_id={generation_id})")
 
     async def download_file(self, url: str) -> bytes:
-        try:
-            resp = await self._client.get(url, timeout=httpx.Timeout(120.0))
-            resp.raise_for_status()
-            return resp.content
-        except Exception as exc:  # noqa: BLE001
-            raise KlingError(f"Не удалось скачать файл из KlingAI: {exc}") from exc
+        return b"".join([chunk async for chunk in self.stream_file(url)])
+
+    async def stream_file(
+        self,
+        url: str,
+        *,
+        chunk_size: int = 64 * 1024,
+        retries: int = 3,
+        stats: DownloadStats | None = None,
+    ) -> AsyncIterator[bytes]:
+        """
+        Отдаёт файл кусками по мере загрузки. При обрыве сети докачивает с места остановки
+        через Range (до `retries` раз); если сервер Range не поддерживает, уже отданное пропускается.
+        """
+        stats = stats if stats is not None else DownloadStats()
+        started = time.monotonic()
+        received = 0
+        failures = 0
+        while True:
+            headers = {"Range": f"bytes={received}-"} if received else None
+            try:
+                async with self._client.stream("GET", url, headers=headers, timeout=httpx.Timeout(120.0)) as resp:
+                    resp.raise_for_status()
+                    skip = received if received and resp.status_code != 206 else 0
+                    async for chunk in resp.aiter_bytes(chunk_size):
+                        if skip:
+                            if len(chunk) <= skip:
+                                skip -= len(chunk)
+                                continue
+                            chunk = chunk[skip:]
+                            skip = 0
+                        received += len(chunk)
+                        stats.bytes = received
+                        yield chunk
+                break
+            except httpx.TransportError as exc:
+                failures += 1
+                if failures > retries:
+                    raise KlingError(f"Не удалось скачать файл из KlingAI: {exc}") from exc
+                stats.resumes += 1
+                log.info("download %s interrupted at %s bytes, resuming: %s", url, received, exc)
+                await asyncio.sleep(min(5.0, 0.5 * failures))
+            except httpx.HTTPStatusError as exc:
+                raise KlingError(f"Не удалось скачать файл из KlingAI: {exc}") from exc
+        stats.seconds = time.monotonic() - started
+        log.info(
+            "downloaded %s bytes in %.2fs (%.1f MB/s, resumes=%s)",
+            stats.bytes,
+            stats.seconds,
+            stats.mb_per_s,
+            stats.resumes,
+        )
+
+    async def download_to(self, url: str, path: str, *, chunk_size: int = 64 * 1024) -> DownloadStats:
+        """
+        Скачивает файл потоком прямо на диск (без буфера на весь ролик).
+        """
+        stats = DownloadStats()
+        with open(path, "wb") as f:
+            async for chunk in self.stream_file(url, chunk_size=chunk_size, stats=stats):
+                f.write(chunk)
+        return stats
+
@@ -0,0 +1,307 @@
+"""
+Персистентная очередь генераций поверх таблицы generation_jobs.
+
+Хендлер бота только пишет строку в очередь (`enqueue_generation`) и сразу отвечает,
+а ограниченный пул воркеров (`JobRunner`) забирает задачи и выполняет их.
+Пропускная способность определяется числом воркеров, а не количеством
+висящих корутин апдейтов; рестарт процесса не теряет задачи — они возвращаются в очередь.
+
+С `FairScheduler` следующая задача выбирается не по FIFO, а с учётом пределов параллельности
+KlingAI и взвешенной справедливой очереди по сегментам; ожидающим показывается место в очереди.
+
+В вебхук-режиме с несколькими шардами бота `owns(user_id)` оставляет раннеру только задачи
+пользователей его шарда: результат доставляет тот же процесс, что держит состояние пользователя.
+Предел параллельности KlingAI при этом общий — занятость считается по всем шардам.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict
+
+from app.domain.models.generation_job import GenerationJob, QueuedJob
+from app.infrastructure.db.base import async_session
+from app.infrastructure.db.repositories.job_repo import JobRepo
+from app.infrastructure.db.repositories.user_repo import UserRepo
+from app.infrastructure.queue.job_scheduler import FairScheduler
+
+log = logging.getLogger("queue.jobs")
+
+JobHandler = Callable[[GenerationJob], Awaitable[str]]
+PositionHandler = Callable[[QueuedJob, int], Awaitable[None]]
+LeftHandler = Callable[[int], None]
+OwnerFilter = Callable[[int], bool]
+
+# Статус, который хендлер возвращает, если задачу нужно отложить (провайдер попросил подождать)
+STATUS_REQUEUE = "queued"
+
+# Сколько ожидающих задач раннер рассматривает при выборе и подсчёте мест в очереди
+_QUEUE_WINDOW = 500
+
+# Кошелёк, с которого резервируется генерация при постановке в очередь
+CHARGE_BUCKET = "animate"
+
+# Общий сигнал «в очереди появилась задача» — будит воркеры без ожидания poll-интервала
+_WAKEUP = asyncio.Event()
+
+
+def wake_workers() -> None:
+    _WAKEUP.set()
+
+
+async def enqueue_generation(
+    *,
+    user_id: int,
+    chat_id: int,
+    payload: dict[str, Any],
+    progress_message_id: int | None = None,
+) -> int | None:
+    """
+    Ставит генерацию в очередь и в той же транзакции списывает за неё одну генерацию
+    (отметка charged_at у задачи); упавшая задача деньги возвращает (см. JobRunner._finish).
+    None — на балансе не хватило, задача не поставлена.
+    """
+    async with async_session() as s:
+        if await UserRepo(s).debit_balance(telegram_id=user_id, bucket=CHARGE_BUCKET) is None:
+            return None
+        job_id = await JobRepo(s).enqueue(
+            user_id=user_id,
+            chat_id=chat_id,
+            payload=payload,
+            progress_message_id=progress_message_id,
+            charged=True,
+        )
+        await s.commit()
+    wake_workers()
+    return job_id
+
+
+async def has_pending_generation(*, user_id: int, match: dict[str, Any]) -> bool:
+    async with async_session() as s:
+        return await JobRepo(s).has_pending(user_id=user_id, match=match)
+
+
+class JobRunner:
+    """
+    Пул воркеров очереди генераций.
+
+    handler(job) выполняет задачу и возвращает итоговый статус ("succeeded" / "failed"),
+    либо STATUS_REQUEUE — тогда задача возвращается в очередь, а планировщик временно
+    снижает параллельность. Неожиданное исключение помечает задачу как failed. Задачи,
+    которые после рестартов набрали больше `max_attempts` попыток, снимаются без выполнения.
+    Фильтр `owns` применяется при выборе задач планировщиком, поэтому задаётся вместе со `scheduler`.
+    `on_queue_left(job_id)` зовётся, когда задача, которой показывали место, ушла из очереди
+    не через хендлер: снята по числу попыток или пропала из очереди (отменена, забрана другим процессом).
+    """
+
+    def __init__(
+        self,
+        handler: JobHandler,
+        *,
+        workers: int = 4,
+        poll_interval: float = 2.0,
+        max_attempts: int = 3,
+        scheduler: FairScheduler | None = None,
+        on_queue_position: PositionHandler | None = None,
+        on_queue_left: LeftHandler | None = None,
+        owns: OwnerFilter | None = None,
+    ) -> None:
+        self._handler = handler
+        self._owns = owns
+        self._scheduler = scheduler
+        self._on_queue_position = on_queue_position
+        self._on_queue_left = on_queue_left
+        # задачи, которые сейчас выполняют воркеры этого процесса
+        self._active: set[int] = set()
+        self._claim_lock = asyncio.Lock()
+        self._positions: Dict[int, int] = {}
+        self._workers = max(1, int(workers))
+        self._poll_interval = max(0.1, float(poll_interval))
+        self._max_attempts = max(1, int(max_attempts))
+        self._tasks: list[asyncio.Task] = []
+        self._busy = 0
+
+    @property
+    def busy(self) -> int:
+        return self._busy
+
+    async def start(self) -> None:
+        try:
+            async with async_session() as s:
+                repo = JobRepo(s)
+                job_ids = None
+                if self._owns is not None:
+                    # задачи других шардов, возможно, ещё выполняются их процессами
+                    job_ids = [job_id for job_id, user_id in await repo.list_running() if self._owns(user_id)]
+                requeued = await repo.requeue_running(job_ids)
+                await s.commit()
+            if requeued:
+                log.info("Requeued %s interrupted generation jobs", requeued)
+        except Exception as exc:  # noqa: BLE001
+            log.warning("Failed to requeue interrupted jobs: %s", exc)
+
+        for idx in range(self._workers):
+            self._tasks.append(asyncio.create_task(self._worker(idx)))
+        if self._scheduler is not None and self._on_queue_position is not None:
+            self._tasks.append(asyncio.create_task(self._positions_loop()))
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except (asyncio.CancelledError, Exception):
+                pass
+        self._tasks.clear()
+
+    async def _claim(self) -> GenerationJob | None:
+        if self._scheduler is None:
+            async with async_session() as s:
+                job = await JobRepo(s).claim_next()
+                await s.commit()
+            return job
+
+        # выбор и захват под локом: воркеры процесса не должны выбрать одну задачу дважды,
+        # а advisory lock в той же транзакции упорядочивает выбор между шардами
+        async with self._claim_lock:
+            async with async_session() as s:
+                repo = JobRepo(s)
+                await repo.lock_claims()
+                queued = await self._queued(repo)
+                running = await repo.running_by_user()
+                picked = self._scheduler.pick(queued, running)
+                job = await repo.claim(picked.id) if picked else None
+                if job is not None:
+                    # до коммита: обновление мест в очереди не должно принять задачу за пропавшую
+                    self._active.add(job.id)
+                try:
+                    await s.commit()
+                except BaseException:
+                    if job is not None:
+                        self._active.discard(job.id)
+                    raise
+            self._scheduler.forget_idle({q.user_id for q in queued} | set(running))
+        return job
+
+    async def _queued(self, repo: JobRepo) -> list[QueuedJob]:
+        """
+        Ожидающие задачи этого раннера. С фильтром шарда очередь читается страницами, пока не наберётся
+        окно своих задач: иначе старейшие задачи чужих шардов заслонили бы свои.
+        """
+        if self._owns is None:
+            return await repo.list_queued(limit=_QUEUE_WINDOW)
+        own: list[QueuedJob] = []
+        after_id = 0
+        while len(own) < _QUEUE_WINDOW:
+            page = await repo.list_queued(limit=_QUEUE_WINDOW, after_id=after_id)
+            own.extend(q for q in page if self._owns(q.user_id))
+            if len(page) < _QUEUE_WINDOW:
+                break
+            after_id = page[-1].id
+        return own[:_QUEUE_WINDOW]
+
+    async def _requeue(self, job: GenerationJob) -> None:
+        try:
+            async with async_session() as s:
+                await JobRepo(s).requeue(job.id)
+                await s.commit()
+        except Exception as exc:  # noqa: BLE001
+            log.warning("Failed to requeue job id=%s: %s", job.id, exc)
+        if self._scheduler is not None:
+            # сама отложенная задача ещё учтена в _busy
+            self._scheduler.throttle(running=self._busy - 1)
+
+    async def _refresh_positions(self) -> None:
+        async with async_session() as s:
+            queued = await self._queued(JobRepo(s))
+        positions = self._scheduler.positions(queued) if self._scheduler else {}
+        for job_id in self._positions.keys() - positions.keys() - self._active:
+            self._left_queue(job_id)
+        by_id = {q.id: q for q in queued}
+        for job_id, position in positions.items():
+            if self._positions.get(job_id) == position:
+                continue
+            try:
+                await self._on_queue_position(by_id[job_id], position)
+            except Exception as exc:  # noqa: BLE001
+                log.warning("queue position update for job id=%s failed: %s", job_id, exc)
+        self._positions = positions
+
+    def _left_queue(self, job_id: int) -> None:
+        if self._on_queue_left is None:
+            return
+        try:
+            self._on_queue_left(job_id)
+        except Exception as exc:  # noqa: BLE001
+            log.warning("queue leave handler for job id=%s failed: %s", job_id, exc)
+
+    async def _positions_loop(self) -> None:
+        while True:
+            try:
+                await self._refresh_positions()
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:  # noqa: BLE001
+                log.warning("queue positions refresh failed: %s", exc)
+            await asyncio.sleep(self._poll_interval)
+
+    async def _finish(self, job: GenerationJob, status: str, error: str | None = None) -> None:
+        try:
+            async with async_session() as s:
+                repo = JobRepo(s)
+                await repo.finish(job_id=job.id, status=status, error=error)
+                # оплаченная задача не выполнилась — списание возвращается ровно один раз
+                if status == "failed" and await repo.release_charge(job.id):
+                    await UserRepo(s).inc_balance(telegram_id=job.user_id, delta=1, bucket=CHARGE_BUCKET)
+                await s.commit()
+        except Exception as exc:  # noqa: BLE001
+            log.warning("Failed to finish job id=%s status=%s err=%s", job.id, status, exc)
+
+    async def _wait_for_work(self) -> None:
+        try:
+            await asyncio.wait_for(_WAKEUP.wait(), timeout=self._poll_interval)
+        except asyncio.TimeoutError:
+            pass
+        _WAKEUP.clear()
+
+    async def _worker(self, idx: int) -> None:
+        while True:
+            try:
+                job = await self._claim()
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:  # noqa: BLE001
+                log.warning("worker#%s: claim failed: %s", idx, exc)
+                await asyncio.sleep(self._poll_interval)
+                continue
+
+            if job is None:
+                await self._wait_for_work()
+                continue
+
+            if job.attempts > self._max_attempts:
+                log.warning("worker#%s: drop job id=%s after %s attempts", idx, job.id, job.attempts)
+                await self._finish(job, "failed", "max attempts exceeded")
+                self._active.discard(job.id)
+                self._left_queue(job.id)
+                continue
+
+            self._busy += 1
+            try:
+                status = await self._handler(job)
+            except asyncio.CancelledError:
+                # задача остаётся в running и вернётся в очередь при следующем старте
+                raise
+            except Exception as exc:  # noqa: BLE001
+                log.exception("worker#%s: job id=%s crashed", idx, job.id)
+                await self._finish(job, "failed", repr(exc))
+            else:
+                if status == STATUS_REQUEUE:
+                    log.info("worker#%s: job id=%s postponed by provider", idx, job.id)
+                    await self._requeue(job)
+                else:
+                    await self._finish(job, status or "succeeded")
+            finally:
+                self._busy -= 1
+                self._active.discard(job.id)
@@ -0,0 +1,155 @@
+"""
+Допуск задач генерации к KlingAI и справедливый порядок очереди.
+
+`FairScheduler.pick` решает, какую из ожидающих задач запускать следующей:
+    - не больше `global_cap` задач в работе одновременно (предел KlingAI);
+    - не больше `per_user_cap` задач одного пользователя;
+    - среди остальных — взвешенная справедливая очередь (start-time fair queueing):
+      у каждого пользователя своё виртуальное время, запуск задачи сдвигает его на 1/weight,
+      первой идёт задача с наименьшим временем начала (при равенстве — более ранняя).
+      Вес зависит от сегмента (client > qual > lead), поэтому платящие обслуживаются чаще,
+      но лиды не голодают.
+
+Когда KlingAI отвечает «слишком много запросов», `throttle()` на `pause` секунд останавливает
+запуск новых задач и на `throttle_window` секунд снижает предел до числа уже выполняющихся.
+"""
+from __future__ import annotations
+
+import time
+from typing import Dict, Iterable, List, Mapping, Optional
+
+from app.domain.models.generation_job import QueuedJob
+
+DEFAULT_SEGMENT_WEIGHTS: Dict[str, float] = {"client": 4.0, "qual": 2.0, "lead": 1.0}
+
+
+def parse_segment_weights(raw: str) -> Dict[str, float]:
+    """
+    "client:4,qual:2,lead:1" -> {"client": 4.0, ...}; некорректные пары пропускаются.
+    """
+    weights = dict(DEFAULT_SEGMENT_WEIGHTS)
+    for part in (raw or "").replace(";", ",").split(","):
+        if ":" not in part:
+            continue
+        name, value = part.split(":", 1)
+        try:
+            weight = float(value)
+        except ValueError:
+            continue
+        if weight > 0:
+            weights[name.strip()] = weight
+    return weights
+
+
+class FairScheduler:
+    def __init__(
+        self,
+        *,
+        global_cap: int = 4,
+        per_user_cap: int = 1,
+        weights: Mapping[str, float] | None = None,
+        throttle_window: float = 30.0,
+        pause: float = 5.0,
+    ) -> None:
+        self.global_cap = max(1, int(global_cap))
+        self.per_user_cap = max(1, int(per_user_cap))
+        self._weights = dict(weights or DEFAULT_SEGMENT_WEIGHTS)
+        self._throttle_window = float(throttle_window)
+        self._throttled_cap: Optional[int] = None
+        self._throttled_until = 0.0
+        self._pause = float(pause)
+        self._paused_until = 0.0
+        self._vtime = 0.0
+        self._user_finish: Dict[int, float] = {}
+
+    # ---------- предел параллельности ----------
+
+    def effective_cap(self, now: float | None = None) -> int:
+        now = time.monotonic() if now is None else now
+        if self._throttled_cap is not None and now < self._throttled_until:
+            return self._throttled_cap
+        self._throttled_cap = None
+        return self.global_cap
+
+    def throttle(self, running: int, now: float | None = None) -> None:
+        """
+        KlingAI ограничил нас: не запускаем новые задачи сверх уже выполняющихся.
+        """
+        now = time.monotonic() if now is None else now
+        self._throttled_cap = max(1, min(self.global_cap, int(running)))
+        self._throttled_until = now + self._throttle_window
+        self._paused_until = now + self._pause
+
+    # ---------- порядок ----------
+
+    def _weight(self, job: QueuedJob) -> float:
+        return self._weights.get(job.segment or "lead", self._weights.get("lead", 1.0))
+
+    def _tags(self, job: QueuedJob, user_finish: Mapping[int, float], vtime: float) -> tuple[float, float]:
+        start = max(vtime, user_finish.get(job.user_id, 0.0))
+        return start, start + 1.0 / self._weight(job)
+
+    def _order(self, queued: Iterable[QueuedJob], user_finish: Dict[int, float], vtime: float) -> List[QueuedJob]:
+        """
+        Порядок обслуживания очереди по WFQ (без учёта пределов параллельности).
+        user_finish изменяется на месте.
+        """
+        pending: Dict[int, List[QueuedJob]] = {}
+        for job in sorted(queued, key=lambda j: j.id):
+            pending.setdefault(job.user_id, []).append(job)
+        order: List[QueuedJob] = []
+        while pending:
+            best = min((jobs[0] for jobs in pending.values()), key=lambda j: (self._tags(j, user_finish, vtime)[0], j.id))
+            start, finish = self._tags(best, user_finish, vtime)
+            vtime = start
+            user_finish[best.user_id] = finish
+            order.append(best)
+            jobs = pending[best.user_id]
+            jobs.pop(0)
+            if not jobs:
+                pending.pop(best.user_id)
+        return order
+
+    def pick(
+        self,
+        queued: Iterable[QueuedJob],
+        running_by_user: Mapping[int, int],
+        *,
+        now: float | None = None,
+    ) -> Optional[QueuedJob]:
+        now = time.monotonic() if now is None else now
+        if now < self._paused_until:
+            return None
+        running_total = sum(running_by_user.values())
+        if running_total >= self.effective_cap(now):
+            return None
+        eligible = [job for job in queued if running_by_user.get(job.user_id, 0) < self.per_user_cap]
+        if not eligible:
+            return None
+        # следующая задача — голова очереди пользователя с минимальным виртуальным временем начала
+        heads: Dict[int, QueuedJob] = {}
+        for job in eligible:
+            head = heads.get(job.user_id)
+            if head is None or job.id < head.id:
+                heads[job.user_id] = job
+        job = min(heads.values(), key=lambda j: (self._tags(j, self._user_finish, self._vtime)[0], j.id))
+        start, finish = self._tags(job, self._user_finish, self._vtime)
+        self._vtime = start
+        self._user_finish[job.user_id] = finish
+        return job
+
+    def positions(self, queued: Iterable[QueuedJob]) -> Dict[int, int]:
+        """
+        Ожидаемое место каждой задачи в очереди (1 — следующая к запуску): job_id -> позиция.
+        """
+        order = self._order(list(queued), dict(self._user_finish), self._vtime)
+        return {job.id: idx for idx, job in enumerate(order, start=1)}
+
+    def forget_idle(self, active_user_ids: Iterable[int]) -> None:
+        """
+        Чистит виртуальное время пользователей без задач, чтобы словарь не рос бесконечно.
+        """
+        keep = set(active_user_ids)
+        for uid in list(self._user_finish):
+            if uid not in keep and self._user_finish[uid] <= self._vtime:
+                self._user_finish.pop(uid, None)
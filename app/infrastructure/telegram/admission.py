@@ -0,0 +1,250 @@
+"""
+Ограничение числа одновременно обрабатываемых апдейтов и сброс нагрузки при перегрузке.
+
+Апдейт проходит три шага:
+    AdmissionMiddleware   — принимает апдейт в очередь ограниченного размера `max_queue`;
+                            если очередь полна, апдейт сбрасывается сразу;
+    (MailboxMiddleware    — ждёт завершения предыдущих апдейтов того же пользователя;)
+    ConcurrencyMiddleware — ждёт свободного слота из `max_inflight` и только тогда запускает
+                            обработчик. Callback-запрос, который прождал дольше `callback_ttl`,
+                            к этому моменту уже никому не нужен — он сбрасывается.
+
+Слот берётся уже после очереди пользователя, поэтому пачка апдейтов одного пользователя
+не занимает слоты, которые нужны другим. Сброшенный callback получает всплывающее
+«бот занят», сообщение — короткий ответ, остальные апдейты отбрасываются молча.
+В итоге при всплеске растёт очередь и число сброшенных апдейтов, а пул соединений БД
+не уходит в таймауты.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+from app.bot.i18n import DEFAULT_LANG, translate
+from app.infrastructure.telegram.outbound import PRIORITY_LOW, outbound_priority
+from app.settings import settings
+
+log = logging.getLogger("telegram.admission")
+
+SHED_QUEUE_FULL = "queue_full"
+SHED_STALE = "stale"
+
+_TICKET_KEY = "admission_ticket"
+
+
+class Overloaded(Exception):
+    def __init__(self, reason: str) -> None:
+        super().__init__(reason)
+        self.reason = reason
+
+
+@dataclass
+class Ticket:
+    admitted_at: float
+    started: bool = False
+    done: bool = False
+
+
+@dataclass(frozen=True)
+class GateStats:
+    inflight: int
+    queued: int
+    max_inflight: int
+    max_queue: int
+    peak_inflight: int
+    peak_queued: int
+    processed: int
+    shed_queue_full: int
+    shed_stale: int
+
+
+class UpdateGate:
+    def __init__(self, *, max_inflight: int = 32, max_queue: int = 1000) -> None:
+        self.max_inflight = max(1, int(max_inflight))
+        self.max_queue = max(0, int(max_queue))
+        self._inflight = 0
+        # принятые, но ещё не запущенные апдейты (в том числе ждущие своей очереди пользователя)
+        self._queued = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self.peak_inflight = 0
+        self.peak_queued = 0
+        self.processed = 0
+        self.shed: Dict[str, int] = {SHED_QUEUE_FULL: 0, SHED_STALE: 0}
+
+    def admit(self) -> Ticket:
+        # очередь — это принятые апдейты сверх свободных слотов
+        if self._queued >= self.max_queue + self.max_inflight - self._inflight:
+            self.shed[SHED_QUEUE_FULL] += 1
+            raise Overloaded(SHED_QUEUE_FULL)
+        self._queued += 1
+        self.peak_queued = max(self.peak_queued, self._queued)
+        return Ticket(admitted_at=time.monotonic())
+
+    def abandon(self, ticket: Ticket) -> None:
+        """
+        Снимает принятый апдейт, который так и не запустился (отмена, ошибка в middleware).
+        """
+        if not ticket.started and not ticket.done:
+            ticket.done = True
+            self._queued -= 1
+
+    async def acquire(self, ticket: Ticket, *, ttl: Optional[float] = None) -> None:
+        """
+        Ждёт слот. ttl — сколько апдейт может пролежать с момента приёма; дольше — Overloaded(stale).
+        """
+        deadline = ticket.admitted_at + ttl if ttl is not None else None
+        if deadline is not None and time.monotonic() >= deadline:
+            self._drop_stale(ticket)
+        if self._inflight < self.max_inflight and not self._waiters:
+            self._start(ticket)
+            return
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._waiters.append(fut)
+        timer = None
+        if deadline is not None:
+            timer = loop.call_later(max(0.0, deadline - time.monotonic()), self._expire, fut)
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # слот уже передан этому апдейту — отдаём его следующему
+                ticket.started = True
+                self._queued -= 1
+                self.release(ticket)
+            else:
+                self._forget(fut)
+            raise
+        except Overloaded:
+            self._drop_stale(ticket)
+        finally:
+            if timer is not None:
+                timer.cancel()
+        # слот передан освободившим его апдейтом, _inflight уже учтён
+        ticket.started = True
+        self._queued -= 1
+
+    def release(self, ticket: Ticket) -> None:
+        if ticket.done:
+            return
+        ticket.done = True
+        self.processed += 1
+        while self._waiters:
+            fut = self._waiters.popleft()
+            if not fut.done():
+                fut.set_result(None)
+                return
+        self._inflight -= 1
+
+    def _start(self, ticket: Ticket) -> None:
+        ticket.started = True
+        self._queued -= 1
+        self._inflight += 1
+        self.peak_inflight = max(self.peak_inflight, self._inflight)
+
+    def _drop_stale(self, ticket: Ticket) -> None:
+        ticket.done = True
+        self._queued -= 1
+        self.shed[SHED_STALE] += 1
+        raise Overloaded(SHED_STALE)
+
+    def _expire(self, fut: asyncio.Future) -> None:
+        if not fut.done():
+            self._forget(fut)
+            fut.set_exception(Overloaded(SHED_STALE))
+
+    def _forget(self, fut: asyncio.Future) -> None:
+        try:
+            self._waiters.remove(fut)
+        except ValueError:
+            pass
+
+    def stats(self) -> GateStats:
+        return GateStats(
+            inflight=self._inflight,
+            queued=self._queued,
+            max_inflight=self.max_inflight,
+            max_queue=self.max_queue,
+            peak_inflight=self.peak_inflight,
+            peak_queued=self.peak_queued,
+            processed=self.processed,
+            shed_queue_full=self.shed[SHED_QUEUE_FULL],
+            shed_stale=self.shed[SHED_STALE],
+        )
+
+
+async def shed_update(update: Update, reason: str) -> None:
+    """
+    Политика сброса: callback — всплывающее «бот занят», сообщение — короткий ответ, прочее — молча.
+    """
+    try:
+        if update.callback_query is not None:
+            await update.callback_query.answer(translate(DEFAULT_LANG, "system.busy_toast"))
+        elif update.message is not None and reason == SHED_QUEUE_FULL:
+            # ответ на сброшенное сообщение не должен отнимать лимит у полезных отправок
+            with outbound_priority(PRIORITY_LOW):
+                await update.message.answer(translate(DEFAULT_LANG, "system.busy_message"))
+    except Exception as exc:  # noqa: BLE001
+        # callback мог истечь — Telegram отвечает на такие запросы ошибкой
+        log.debug("busy notice for update %s failed: %s", update.update_id, exc)
+
+
+Handler = Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]]
+
+
+class AdmissionMiddleware(BaseMiddleware):
+    def __init__(self, gate: UpdateGate) -> None:
+        self._gate = gate
+
+    async def __call__(self, handler: Handler, event: TelegramObject, data: Dict[str, Any]) -> Any:
+        try:
+            ticket = self._gate.admit()
+        except Overloaded as exc:
+            log.warning("update %s shed: %s", getattr(event, "update_id", None), exc.reason)
+            if isinstance(event, Update):
+                await shed_update(event, exc.reason)
+            return None
+        data[_TICKET_KEY] = ticket
+        try:
+            return await handler(event, data)
+        finally:
+            self._gate.abandon(ticket)
+
+
+class ConcurrencyMiddleware(BaseMiddleware):
+    def __init__(self, gate: UpdateGate, *, callback_ttl: Optional[float] = 10.0) -> None:
+        self._gate = gate
+        self._callback_ttl = callback_ttl
+
+    async def __call__(self, handler: Handler, event: TelegramObject, data: Dict[str, Any]) -> Any:
+        ticket = data.get(_TICKET_KEY)
+        if ticket is None:
+            return await handler(event, data)
+        is_callback = isinstance(event, Update) and event.callback_query is not None
+        try:
+            await self._gate.acquire(ticket, ttl=self._callback_ttl if is_callback else None)
+        except Overloaded as exc:
+            log.info("update %s shed: %s", getattr(event, "update_id", None), exc.reason)
+            await shed_update(event, exc.reason)
+            return None
+        try:
+            return await handler(event, data)
+        finally:
+            self._gate.release(ticket)
+
+
+_gate: UpdateGate | None = None
+
+
+def get_update_gate() -> UpdateGate:
+    global _gate
+    if _gate is None:
+        _gate = UpdateGate(max_inflight=settings.BOT_MAX_INFLIGHT_UPDATES, max_queue=settings.BOT_MAX_QUEUED_UPDATES)
+    return _gate
@@ -0,0 +1,127 @@
+"""
+Последовательная обработка апдейтов одного пользователя при параллельной обработке разных.
+
+У каждого пользователя свой «почтовый ящик» — очередь апдейтов, ожидающих своей очереди.
+Апдейт выполняется, только когда все более ранние апдейты этого пользователя завершены,
+поэтому быстрые фото + подпись или двойной тап по кнопке не гоняются за общим State.
+Ящики разных пользователей независимы: глобальной блокировки нет. Пустой ящик удаляется.
+
+`MailboxMiddleware` подключается outer-middleware к `dp.update` и работает одинаково
+для long polling (handle_as_tasks) и для воркеров шардов вебхука.
+"""
+from __future__ import annotations
+
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, Hashable, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+
+@dataclass(frozen=True)
+class MailboxStats:
+    # пользователей с апдейтом в работе
+    active: int
+    # апдейтов, ждущих завершения предыдущего апдейта того же пользователя
+    waiting: int
+    # самая длинная очередь сейчас и за всё время
+    deepest: int
+    max_depth: int
+    processed: int
+
+
+class UserMailboxes:
+    def __init__(self) -> None:
+        self._boxes: Dict[Hashable, Deque[asyncio.Future]] = {}
+        self.processed = 0
+        self.max_depth = 0
+
+    @asynccontextmanager
+    async def turn(self, key: Hashable) -> AsyncIterator[None]:
+        """
+        Ждёт, пока не завершатся все ранее поставленные апдейты ключа, и держит очередь до выхода из блока.
+        """
+        loop = asyncio.get_running_loop()
+        box = self._boxes.setdefault(key, deque())
+        ticket = loop.create_future()
+        box.append(ticket)
+        self.max_depth = max(self.max_depth, len(box))
+        if len(box) == 1:
+            ticket.set_result(None)
+        try:
+            await ticket
+        except asyncio.CancelledError:
+            self._leave(key, ticket)
+            raise
+        try:
+            yield
+        finally:
+            self._leave(key, ticket)
+            self.processed += 1
+
+    def _leave(self, key: Hashable, ticket: asyncio.Future) -> None:
+        box = self._boxes.get(key)
+        if not box:
+            return
+        was_head = box[0] is ticket
+        try:
+            box.remove(ticket)
+        except ValueError:
+            return
+        if not box:
+            self._boxes.pop(key, None)
+            return
+        if was_head and not box[0].done():
+            box[0].set_result(None)
+
+    def depth(self, key: Hashable) -> int:
+        return len(self._boxes.get(key) or ())
+
+    def stats(self) -> MailboxStats:
+        depths = [len(box) for box in self._boxes.values()]
+        return MailboxStats(
+            active=len(depths),
+            waiting=sum(depths) - len(depths),
+            deepest=max(depths, default=0),
+            max_depth=self.max_depth,
+            processed=self.processed,
+        )
+
+
+def _mailbox_key(data: Dict[str, Any]) -> Optional[Hashable]:
+    user = data.get("event_from_user")
+    if user is not None:
+        return user.id
+    chat = data.get("event_chat")
+    return chat.id if chat is not None else None
+
+
+class MailboxMiddleware(BaseMiddleware):
+    def __init__(self, mailboxes: UserMailboxes) -> None:
+        self._mailboxes = mailboxes
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        # event_from_user/event_chat уже проставил UserContextMiddleware диспетчера
+        key = _mailbox_key(data)
+        if key is None:
+            return await handler(event, data)
+        async with self._mailboxes.turn(key):
+            return await handler(event, data)
+
+
+_mailboxes: UserMailboxes | None = None
+
+
+def get_mailboxes() -> UserMailboxes:
+    global _mailboxes
+    if _mailboxes is None:
+        _mailboxes = UserMailboxes()
+    return _mailboxes
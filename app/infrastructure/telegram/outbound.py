@@ -0,0 +1,304 @@
+"""
+Исходящий лимитер Telegram Bot API.
+
+Telegram ограничивает бота примерно 30 сообщениями в секунду в целом, ~1 сообщением в секунду
+в один чат (короткие всплески допускаются) и 20 сообщениями в минуту в группу. Все отправки и правки
+сообщений проходят через `OutboundLimiter`:
+
+    - в каждом чате свой token bucket (ожидание резервируется, порядок внутри чата сохраняется);
+    - общий token bucket раздаёт слоты по приоритету: готовые видео и подтверждения оплаты
+      (PRIORITY_HIGH) идут раньше ответов на действия (PRIORITY_NORMAL), а те — раньше
+      анимации прогресса (PRIORITY_LOW);
+    - на 429 чат ставится на паузу на retry_after секунд, и запрос автоматически повторяется.
+
+Для aiogram лимитер подключается как request middleware сессии бота (`install_outbound_limiter`),
+поэтому его проходят все вызовы `bot.*`/`message.answer` без изменения хендлеров. Код, который
+ходит в Bot API напрямую через httpx, использует `OutboundLimiter.call` и бросает `RetryAfter`.
+
+Лимитер живёт в памяти процесса: API-процесс (уведомления об оплате) и бот считают бюджет раздельно.
+"""
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterator, List, Optional, TypeVar
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import Response, TelegramType
+
+from app.settings import settings
+
+log = logging.getLogger("telegram.outbound")
+
+T = TypeVar("T")
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+# Методы, которые Telegram считает «сообщениями» для лимитов; остальные (answerCallbackQuery,
+# getFile, deleteMessage, ...) проходят без очереди.
+LIMITED_METHODS: Dict[str, int] = {
+    "SendMessage": PRIORITY_NORMAL,
+    "SendPhoto": PRIORITY_NORMAL,
+    "SendVideo": PRIORITY_HIGH,
+    "SendDocument": PRIORITY_HIGH,
+    "SendAnimation": PRIORITY_HIGH,
+    "SendMediaGroup": PRIORITY_NORMAL,
+    "SendAudio": PRIORITY_NORMAL,
+    "SendVoice": PRIORITY_NORMAL,
+    "SendVideoNote": PRIORITY_NORMAL,
+    "SendSticker": PRIORITY_NORMAL,
+    "CopyMessage": PRIORITY_NORMAL,
+    "ForwardMessage": PRIORITY_NORMAL,
+    "EditMessageText": PRIORITY_NORMAL,
+    "EditMessageCaption": PRIORITY_NORMAL,
+    "EditMessageMedia": PRIORITY_NORMAL,
+    "EditMessageReplyMarkup": PRIORITY_NORMAL,
+    "SendChatAction": PRIORITY_LOW,
+}
+
+_priority: ContextVar[Optional[int]] = ContextVar("outbound_priority", default=None)
+
+
+@contextmanager
+def outbound_priority(priority: int) -> Iterator[None]:
+    """
+    Приоритет для всех отправок внутри блока (в том числе в задачах, созданных внутри него).
+    """
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class RetryAfter(Exception):
+    """
+    429 от Bot API для кода, который ходит в него не через aiogram.
+    """
+
+    def __init__(self, retry_after: float) -> None:
+        super().__init__(f"retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+@dataclass
+class OutboundStats:
+    sent: int
+    retries: int
+    retry_after: int
+    waiting: int
+    waited_s: float
+
+
+@dataclass
+class _Bucket:
+    tokens: float
+    updated: float
+    paused_until: float = 0.0
+
+    def refill(self, now: float, rate: float, burst: float) -> None:
+        self.tokens = min(burst, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+
+    def reserve(self, now: float, rate: float, burst: float) -> float:
+        """
+        Забирает токен (баланс может уйти в минус) и возвращает, сколько ждать до отправки.
+        """
+        self.refill(now, rate, burst)
+        self.tokens -= 1
+        wait = -self.tokens / rate if self.tokens < 0 else 0.0
+        return max(wait, self.paused_until - now)
+
+
+class OutboundLimiter:
+    def __init__(
+        self,
+        *,
+        global_rate: float = 30.0,
+        chat_rate: float = 1.0,
+        chat_burst: float = 3.0,
+        group_rate: float = 20.0 / 60.0,
+        retries: int = 3,
+    ) -> None:
+        self._global_rate = max(0.1, float(global_rate))
+        self._chat_rate = max(0.01, float(chat_rate))
+        self._chat_burst = max(1.0, float(chat_burst))
+        self._group_rate = max(0.01, float(group_rate))
+        self.retries_limit = max(0, int(retries))
+        self._global: _Bucket | None = None
+        self._chats: Dict[Hashable, _Bucket] = {}
+        self._waiters: List[tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._timer: asyncio.TimerHandle | None = None
+        self.sent = 0
+        self.retries = 0
+        self.retry_after = 0
+        self.waited_s = 0.0
+
+    # ---------- бакеты ----------
+
+    def _chat_limits(self, chat_id: Hashable) -> tuple[float, float]:
+        # отрицательные id — группы и каналы: 20 сообщений в минуту
+        if isinstance(chat_id, int) and chat_id < 0:
+            return self._group_rate, 1.0
+        return self._chat_rate, self._chat_burst
+
+    def _chat_bucket(self, chat_id: Hashable, now: float) -> _Bucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= 10000:
+                self._prune(now)
+            _, burst = self._chat_limits(chat_id)
+            bucket = _Bucket(tokens=burst, updated=now)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    def _prune(self, now: float) -> None:
+        # чаты, бакет которых уже снова полон, можно забыть — новый бакет будет таким же
+        for chat_id, bucket in list(self._chats.items()):
+            rate, burst = self._chat_limits(chat_id)
+            if bucket.paused_until <= now and bucket.tokens + (now - bucket.updated) * rate >= burst:
+                self._chats.pop(chat_id, None)
+
+    def _pump(self) -> None:
+        """
+        Раздаёт общие токены ожидающим по приоритету; если токенов нет — перезапускается по таймеру.
+        """
+        self._timer = None
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        if self._global is None:
+            self._global = _Bucket(tokens=self._global_rate, updated=now)
+        self._global.refill(now, self._global_rate, self._global_rate)
+        while self._waiters and now >= self._global.paused_until and self._global.tokens >= 1:
+            _, _, fut = heapq.heappop(self._waiters)
+            if fut.done():
+                continue
+            self._global.tokens -= 1
+            fut.set_result(None)
+        while self._waiters and self._waiters[0][2].done():
+            heapq.heappop(self._waiters)
+        if self._waiters:
+            delay = max(self._global.paused_until - now, (1 - self._global.tokens) / self._global_rate, 0.001)
+            self._timer = loop.call_later(delay, self._pump)
+
+    # ---------- публичный API ----------
+
+    async def acquire(self, chat_id: Hashable | None, priority: int = PRIORITY_NORMAL) -> None:
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        if chat_id is not None:
+            rate, burst = self._chat_limits(chat_id)
+            wait = self._chat_bucket(chat_id, started).reserve(started, rate, burst)
+            if wait > 0:
+                await asyncio.sleep(wait)
+        fut = loop.create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), fut))
+        if self._timer is None:
+            self._pump()
+        await fut
+        self.waited_s += loop.time() - started
+
+    def backoff(self, chat_id: Hashable | None, retry_after: float) -> None:
+        """
+        Telegram ответил 429: чат (или весь бот, если чат неизвестен) молчит retry_after секунд.
+        """
+        self.retry_after += 1
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        until = now + max(0.0, float(retry_after))
+        if chat_id is None:
+            if self._global is None:
+                self._global = _Bucket(tokens=0.0, updated=now)
+            self._global.paused_until = max(self._global.paused_until, until)
+        else:
+            bucket = self._chat_bucket(chat_id, now)
+            bucket.paused_until = max(bucket.paused_until, until)
+        log.warning("telegram 429 for chat=%s, retry after %ss", chat_id, retry_after)
+
+    async def call(
+        self,
+        chat_id: Hashable | None,
+        send: Callable[[], Awaitable[T]],
+        *,
+        priority: int = PRIORITY_NORMAL,
+    ) -> T:
+        """
+        Отправляет с учётом лимитов; на 429 ждёт retry_after и повторяет до `retries` раз.
+        """
+        attempt = 0
+        while True:
+            await self.acquire(chat_id, priority)
+            try:
+                result = await send()
+            except (TelegramRetryAfter, RetryAfter) as exc:
+                self.backoff(chat_id, exc.retry_after)
+                if attempt >= self.retries_limit:
+                    raise
+                attempt += 1
+                self.retries += 1
+                continue
+            self.sent += 1
+            return result
+
+    def stats(self) -> OutboundStats:
+        return OutboundStats(
+            sent=self.sent,
+            retries=self.retries,
+            retry_after=self.retry_after,
+            waiting=sum(1 for _, _, fut in self._waiters if not fut.done()),
+            waited_s=round(self.waited_s, 3),
+        )
+
+
+class OutboundMiddleware(BaseRequestMiddleware):
+    def __init__(self, limiter: OutboundLimiter) -> None:
+        self._limiter = limiter
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        default_priority = LIMITED_METHODS.get(type(method).__name__)
+        if default_priority is None:
+            return await make_request(bot, method)
+        chat_id: Any = getattr(method, "chat_id", None)
+        priority = _priority.get()
+        return await self._limiter.call(
+            chat_id,
+            lambda: make_request(bot, method),
+            priority=default_priority if priority is None else priority,
+        )
+
+
+_limiter: OutboundLimiter | None = None
+
+
+def get_outbound_limiter() -> OutboundLimiter:
+    global _limiter
+    if _limiter is None:
+        _limiter = OutboundLimiter(
+            global_rate=settings.TELEGRAM_GLOBAL_RATE,
+            chat_rate=settings.TELEGRAM_CHAT_RATE,
+            chat_burst=settings.TELEGRAM_CHAT_BURST,
+            group_rate=settings.TELEGRAM_GROUP_RATE_PER_MIN / 60.0,
+            retries=settings.TELEGRAM_SEND_RETRIES,
+        )
+    return _limiter
+
+
+def install_outbound_limiter(bot: Bot) -> Bot:
+    bot.session.middleware(OutboundMiddleware(get_outbound_limiter()))
+    return bot
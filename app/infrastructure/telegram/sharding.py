@@ -0,0 +1,74 @@
+"""
+Распределение пользователей бота по шардам (процессам-воркерам) в режиме вебхука.
+
+Кольцо консистентного хэширования: у каждого шарда `vnodes` точек на кольце, пользователь
+обслуживается шардом первой точки по часовой стрелке от хэша его user_id. Все апдейты
+одного пользователя попадают в один процесс (порядок сохраняется, состояние не делится между
+процессами), а при изменении числа шардов переезжает лишь ~1/N пользователей.
+"""
+from __future__ import annotations
+
+import bisect
+import hashlib
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+
+# Типы апдейтов, в которых инициатор лежит в поле from (или user для poll_answer)
+_USER_UPDATE_TYPES = (
+    "message",
+    "edited_message",
+    "callback_query",
+    "inline_query",
+    "chosen_inline_result",
+    "shipping_query",
+    "pre_checkout_query",
+    "my_chat_member",
+    "chat_member",
+    "chat_join_request",
+    "poll_answer",
+    "message_reaction",
+)
+
+
+def _point(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    def __init__(self, shards: int, *, vnodes: int = 64) -> None:
+        self.shards = max(1, int(shards))
+        points: List[tuple[int, int]] = []
+        for shard in range(self.shards):
+            for replica in range(vnodes):
+                points.append((_point(f"shard-{shard}-{replica}"), shard))
+        points.sort()
+        self._points = [p for p, _ in points]
+        self._owners = [s for _, s in points]
+
+    def shard_for(self, key: int) -> int:
+        if self.shards == 1:
+            return 0
+        idx = bisect.bisect(self._points, _point(str(int(key))))
+        return self._owners[idx % len(self._owners)]
+
+
+@lru_cache(maxsize=8)
+def get_ring(shards: int) -> HashRing:
+    return HashRing(shards)
+
+
+def update_user_id(update: Dict[str, Any]) -> Optional[int]:
+    """
+    ID пользователя-инициатора апдейта (сырой JSON Bot API); None для апдейтов без пользователя.
+    """
+    for kind in _USER_UPDATE_TYPES:
+        body = update.get(kind)
+        if not isinstance(body, dict):
+            continue
+        user = body.get("from") or body.get("user")
+        if isinstance(user, dict) and user.get("id") is not None:
+            return int(user["id"])
+        chat = body.get("chat")
+        if isinstance(chat, dict) and chat.get("id") is not None:
+            return int(chat["id"])
+    return None
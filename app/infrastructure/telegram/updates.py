@@ -0,0 +1,214 @@
+"""
+Вебхук-режим бота: приём апдейтов в API и их обработка шардированными воркерами.
+
+    API (`/webhook/telegram`)  → ingest_update(): апдейт пишется в telegram_updates со своим шардом
+                                 (консистентный хэш user_id) и будится воркер шарда через NOTIFY;
+    бот (`BOT_MODE=webhook`)   → UpdateConsumer(shard): забирает апдейты своего шарда по порядку
+                                 update_id и скармливает их диспетчеру aiogram.
+
+Воркер запускает апдейты в порядке update_id; очередь внутри пользователя держит
+MailboxMiddleware диспетчера (см. mailboxes.py) — так же, как в режиме long polling.
+Выборка только помечает апдейт взятым (taken_at); обработанным (done_at) он отмечается после
+хендлера, а удаляется через TELEGRAM_UPDATES_RETENTION — до тех пор строка отсекает повторную
+доставку того же update_id. Взятые, но не обработанные апдейты упавшего воркера новый процесс
+шарда возвращает в очередь при старте: апдейт может обработаться повторно, но не теряется.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.application.services.message_bus import publish, subscribe, unsubscribe
+from app.infrastructure.db.base import async_session
+from app.infrastructure.db.repositories.update_repo import UpdateRepo
+from app.infrastructure.telegram.sharding import get_ring, update_user_id
+
+log = logging.getLogger("telegram.updates")
+
+TELEGRAM_UPDATES_CHANNEL = "telegram_updates"
+
+UpdateHandler = Callable[[Dict[str, Any]], Awaitable[None]]
+
+# как часто (сек) удалять обработанные апдейты старше retention
+_PURGE_INTERVAL = 60.0
+
+
+async def ingest_update(session: AsyncSession, update: Dict[str, Any], *, shards: int) -> Optional[int]:
+    """
+    Кладёт апдейт в очередь его шарда. Возвращает шард или None, если это повтор уже принятого апдейта.
+    """
+    user_id = update_user_id(update)
+    update_id = int(update["update_id"])
+    # апдейты без пользователя порядка не требуют — раскидываем их по update_id
+    shard = get_ring(shards).shard_for(user_id if user_id is not None else update_id)
+    fresh = await UpdateRepo(session).put(update_id=update_id, shard=shard, user_id=user_id, payload=update)
+    if not fresh:
+        return None
+    await publish(session, TELEGRAM_UPDATES_CHANNEL, {"shard": shard})
+    return shard
+
+
+class UpdateConsumer:
+    """
+    Воркер одного шарда: забирает его апдейты пачками по `batch_size` и запускает их задачами
+    в порядке поступления; в работе одновременно не больше одной пачки.
+    """
+
+    def __init__(
+        self,
+        handler: UpdateHandler,
+        *,
+        shard: int,
+        batch_size: int = 100,
+        poll_interval: float = 1.0,
+        retention: float = 3600.0,
+        session_factory=async_session,
+    ) -> None:
+        self._handler = handler
+        self.shard = int(shard)
+        self._batch_size = max(1, int(batch_size))
+        self._poll_interval = max(0.05, float(poll_interval))
+        self._retention = max(0.0, float(retention))
+        self._session_factory = session_factory
+        # обработанные update_id, ещё не отмеченные в таблице: уходят в базу вместе со следующей выборкой
+        self._finished: list[int] = []
+        self._released = False
+        self._purged_at = 0.0
+        self._wakeup = asyncio.Event()
+        # есть место для новой пачки: в работе меньше batch_size апдейтов
+        self._capacity = asyncio.Event()
+        self._capacity.set()
+        self._inflight: set[asyncio.Task] = set()
+        self._task: asyncio.Task | None = None
+        self._stopping = False
+        self.handled = 0
+        self.failed = 0
+
+    @classmethod
+    def for_dispatcher(cls, dp: Dispatcher, bot: Bot, **kwargs) -> "UpdateConsumer":
+        async def handle(raw: Dict[str, Any]) -> None:
+            update = Update.model_validate(raw, context={"bot": bot})
+            await dp.feed_update(bot, update)
+
+        return cls(handle, **kwargs)
+
+    def _on_notify(self, payload: Dict[str, Any]) -> None:
+        if payload.get("shard") == self.shard:
+            self._wakeup.set()
+
+    def start(self) -> None:
+        subscribe(TELEGRAM_UPDATES_CHANNEL, self._on_notify)
+        self._stopping = False
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self, *, timeout: float = 10.0) -> None:
+        unsubscribe(TELEGRAM_UPDATES_CHANNEL, self._on_notify)
+        if self._task:
+            # не отменяем цикл посреди выборки: взятые, но не запущенные апдейты дождались бы только рестарта
+            self._stopping = True
+            self._wakeup.set()
+            self._capacity.set()
+            try:
+                await asyncio.wait_for(self._task, timeout=timeout)
+            except (asyncio.CancelledError, asyncio.TimeoutError, Exception):
+                pass
+            self._task = None
+        # дожидаемся уже взятых апдейтов и отмечаем их обработанными, иначе после рестарта они повторятся
+        if self._inflight:
+            await asyncio.gather(*self._inflight, return_exceptions=True)
+        try:
+            async with self._session_factory() as s:
+                await self._flush(UpdateRepo(s))
+                await s.commit()
+        except Exception as exc:  # noqa: BLE001
+            log.warning("shard %s: mark updates done failed: %s", self.shard, exc)
+
+    async def _flush(self, repo: UpdateRepo) -> list[int]:
+        finished, self._finished = self._finished, []
+        try:
+            await repo.finish(finished)
+        except BaseException:
+            self._finished = finished + self._finished
+            raise
+        return finished
+
+    async def _take(self) -> list[Dict[str, Any]]:
+        async with self._session_factory() as s:
+            repo = UpdateRepo(s)
+            if not self._released:
+                # апдейты, взятые прошлым процессом шарда и не обработанные до его падения
+                released = await repo.release_taken(shard=self.shard)
+                if released:
+                    log.warning("shard %s: %s unfinished updates returned to the queue", self.shard, released)
+            finished = await self._flush(repo)
+            now = time.monotonic()
+            purge = now - self._purged_at >= _PURGE_INTERVAL
+            try:
+                if purge:
+                    await repo.purge(shard=self.shard, retention_seconds=self._retention)
+                updates = await repo.take(shard=self.shard, limit=self._batch_size)
+                await s.commit()
+            except BaseException:
+                # отметки не записались — отправим их со следующей выборкой
+                self._finished = finished + self._finished
+                raise
+        self._released = True
+        if purge:
+            self._purged_at = now
+        return updates
+
+    async def _handle(self, update: Dict[str, Any]) -> None:
+        try:
+            await self._handler(update)
+            self.handled += 1
+        except Exception:  # noqa: BLE001
+            self.failed += 1
+            log.exception("shard %s: update %s failed", self.shard, update.get("update_id"))
+        finally:
+            # упавший хендлер не повторяем — как и в long polling
+            self._finished.append(int(update["update_id"]))
+
+    def dispatch(self, update: Dict[str, Any]) -> asyncio.Task:
+        # задачи стартуют в порядке создания — очередь пользователя в MailboxMiddleware сохраняет этот порядок
+        task = asyncio.create_task(self._handle(update))
+        self._inflight.add(task)
+        if len(self._inflight) >= self._batch_size:
+            self._capacity.clear()
+        task.add_done_callback(self._done)
+        return task
+
+    def _done(self, task: asyncio.Task) -> None:
+        self._inflight.discard(task)
+        if len(self._inflight) < self._batch_size:
+            self._capacity.set()
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                # не набираем новых апдейтов, пока в работе целая пачка
+                await self._capacity.wait()
+                if self._stopping:
+                    break
+                updates = await self._take()
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:  # noqa: BLE001
+                log.warning("shard %s: fetch updates failed: %s", self.shard, exc)
+                await asyncio.sleep(self._poll_interval)
+                continue
+            for update in updates:
+                self.dispatch(update)
+            if len(updates) >= self._batch_size:
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self._poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
@@ -35,6 +35,28 @@ class Settings:
     BOT_TOKEN: str = os.getenv("BOT_TOKEN", "")
     TELEGRAM_VERIFY_SSL: bool = _env_bool("TELEGRAM_VERIFY_SSL", False)
     TELEGRAM_CA_BUNDLE: str | None = os.getenv("TELEGRAM_CA_BUNDLE") or None
+    # Исходящие лимиты Bot API: сообщений в секунду всего / в один чат (с запасом на всплеск),
+    # в минуту в группу; сколько раз повторять запрос после 429
+    TELEGRAM_GLOBAL_RATE: float = float(os.getenv("TELEGRAM_GLOBAL_RATE", "30"))
+    TELEGRAM_CHAT_RATE: float = float(os.getenv("TELEGRAM_CHAT_RATE", "1"))
+    TELEGRAM_CHAT_BURST: float = float(os.getenv("TELEGRAM_CHAT_BURST", "3"))
+    TELEGRAM_GROUP_RATE_PER_MIN: float = float(os.getenv("TELEGRAM_GROUP_RATE_PER_MIN", "20"))
+    TELEGRAM_SEND_RETRIES: int = int(os.getenv("TELEGRAM_SEND_RETRIES", "3"))
+    # Режим получения апдейтов: "polling" — один процесс с long polling, "webhook" — апдейты принимает API
+    # и раскладывает по BOT_SHARDS воркерам (консистентный хэш user_id); BOT_SHARD — номер шарда процесса
+    BOT_MODE: str = os.getenv("BOT_MODE", "polling").strip().lower()
+    BOT_SHARDS: int = max(1, int(os.getenv("BOT_SHARDS", "1")))
+    BOT_SHARD: int = int(os.getenv("BOT_SHARD", "0"))
+    # Секрет вебхука обязателен: без него бот в режиме webhook не стартует, а API отклоняет апдейты
+    TELEGRAM_WEBHOOK_URL: str = os.getenv("TELEGRAM_WEBHOOK_URL", "")
+    TELEGRAM_WEBHOOK_SECRET: str = os.getenv("TELEGRAM_WEBHOOK_SECRET", "")
+    # Сколько секунд хранить обработанные апдейты вебхука: пока строка есть, повтор update_id отсекается
+    TELEGRAM_UPDATES_RETENTION: float = float(os.getenv("TELEGRAM_UPDATES_RETENTION", "3600"))
+    # Одновременно обрабатываемых апдейтов и сколько ещё может ждать в очереди (сверх — сброс);
+    # callback-запросы старше BOT_CALLBACK_TTL секунд сбрасываются с всплывающим «бот занят»
+    BOT_MAX_INFLIGHT_UPDATES: int = int(os.getenv("BOT_MAX_INFLIGHT_UPDATES", "32"))
+    BOT_MAX_QUEUED_UPDATES: int = int(os.getenv("BOT_MAX_QUEUED_UPDATES", "1000"))
+    BOT_CALLBACK_TTL: float = float(os.getenv("BOT_CALLBACK_TTL", "10"))
 
     # YooKassa
     YK_SHOP_ID: str = os.getenv("YK_SHOP_ID", "")
@@ -49,6 +71,8 @@ class Settings:
     BOT_USERNAME: str = os.getenv("BOT_USERNAME", "")
     REFERRAL_INVITER_BONUS: int = int(os.getenv("REFERRAL_INVITER_BONUS", "200"))
     REFERRAL_INVITEE_BONUS: int = int(os.getenv("REFERRAL_INVITEE_BONUS", "200"))
+    # Как часто сверять счётчики рефералов в users с referral_bonuses, секунды (0 — не сверять)
+    REFERRAL_COUNTERS_CHECK_INTERVAL: float = float(os.getenv("REFERRAL_COUNTERS_CHECK_INTERVAL", "3600"))
     STEOS_API_TOKEN: str = os.getenv("STEOS_API_TOKEN", "")
     STEOS_DEFAULT_VOICE_ID: str = os.getenv("STEOS_DEFAULT_VOICE_ID", "")
     ELEVENLABS_DEFAULT_VOICE_ID: str = os.getenv("ELEVENLABS_DEFAULT_VOICE_ID", "")
@@ -67,6 +91,56 @@ class Settings:
     KLINGAI_ACCESS_KEY: str = os.getenv("KLINGAI_ACCESS_KEY", "")
     KLINGAI_SECRET_KEY: str = os.getenv("KLINGAI_SECRET_KEY", "")
     KLINGAI_BASE_URL: str = os.getenv("KLINGAI_BASE_URL", "https://api-singapore.klingai.com")
+    KLINGAI_MAX_CONNECTIONS: int = int(os.getenv("KLINGAI_MAX_CONNECTIONS", "100"))
+    KLINGAI_MAX_KEEPALIVE: int = int(os.getenv("KLINGAI_MAX_KEEPALIVE", "20"))
+    KLINGAI_KEEPALIVE_EXPIRY: float = float(os.getenv("KLINGAI_KEEPALIVE_EXPIRY", "60"))
+    KLINGAI_HTTP2: bool = _env_bool("KLINGAI_HTTP2", False)  # нужен пакет h2 (httpx[http2])
+    KLINGAI_POLL_CONCURRENCY: int = int(os.getenv("KLINGAI_POLL_CONCURRENCY", "8"))
+    KLINGAI_POLL_SPARSE_INTERVAL: float = float(os.getenv("KLINGAI_POLL_SPARSE_INTERVAL", "15"))
+    KLINGAI_POLL_DENSE_INTERVAL: float = float(os.getenv("KLINGAI_POLL_DENSE_INTERVAL", "2"))
+    KLINGAI_POLL_TIMEOUT: float = float(os.getenv("KLINGAI_POLL_TIMEOUT", "1800"))
+    # Callback о готовности задачи, например {BASE_URL}/webhook/klingai; пусто — только опрос.
+    # Работает только вместе с KLINGAI_CALLBACK_SECRET и лишь будит проверку статуса в KlingAI
+    KLINGAI_CALLBACK_URL: str = os.getenv("KLINGAI_CALLBACK_URL", "")
+    KLINGAI_CALLBACK_SECRET: str = os.getenv("KLINGAI_CALLBACK_SECRET", "")
+    # при включённом callback опрос остаётся редкой страховкой
+    KLINGAI_CALLBACK_FALLBACK_INTERVAL: float = float(os.getenv("KLINGAI_CALLBACK_FALLBACK_INTERVAL", "60"))
+
+    # Очередь генераций (generation_jobs)
+    GENERATION_WORKERS: int = int(os.getenv("GENERATION_WORKERS", "4"))
+    GENERATION_JOB_POLL_INTERVAL: float = float(os.getenv("GENERATION_JOB_POLL_INTERVAL", "2.0"))
+    GENERATION_JOB_MAX_ATTEMPTS: int = int(os.getenv("GENERATION_JOB_MAX_ATTEMPTS", "3"))
+    # Допуск к KlingAI: GENERATION_WORKERS — общий предел одновременных задач,
+    # GENERATION_PER_USER_LIMIT — на одного пользователя, веса сегментов для справедливой очереди
+    GENERATION_PER_USER_LIMIT: int = int(os.getenv("GENERATION_PER_USER_LIMIT", "1"))
+    GENERATION_SEGMENT_WEIGHTS: str = os.getenv("GENERATION_SEGMENT_WEIGHTS", "client:4,qual:2,lead:1")
+    GENERATION_THROTTLE_WINDOW: float = float(os.getenv("GENERATION_THROTTLE_WINDOW", "30"))
+    # Общий бюджет правок сообщений прогресса (в секунду) и пределы интервала анимации одного сообщения
+    PROGRESS_EDITS_PER_SECOND: float = float(os.getenv("PROGRESS_EDITS_PER_SECOND", "10"))
+    PROGRESS_MIN_INTERVAL: float = float(os.getenv("PROGRESS_MIN_INTERVAL", "1.2"))
+    PROGRESS_MAX_INTERVAL: float = float(os.getenv("PROGRESS_MAX_INTERVAL", "10"))
+
+    # Постобработка видео (ffmpeg): 0 — по числу ядер
+    MEDIA_WORKERS: int = int(os.getenv("MEDIA_WORKERS", "0"))
+    MEDIA_TIMEOUT: float = float(os.getenv("MEDIA_TIMEOUT", "300"))
+    # Кэш готовых видео по (фото, промпт, формат, модель): TTL в секундах (0 — выключен) и лимит записей
+    RESULT_CACHE_TTL: int = int(os.getenv("RESULT_CACHE_TTL", str(7 * 24 * 3600)))
+    RESULT_CACHE_MAX_ENTRIES: int = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "10000"))
+    # Чистить кэш результатов (TTL и лимит записей) раз в столько сохранений
+    RESULT_CACHE_EVICT_EVERY: int = int(os.getenv("RESULT_CACHE_EVICT_EVERY", "100"))
+    # Папка для временных роликов; пусто — /dev/shm, если доступен, иначе системный tmp
+    MEDIA_TMP_DIR: str = os.getenv("MEDIA_TMP_DIR", "")
+
+    # Состояния диалогов: "db" — память (LRU + TTL простоя) поверх таблицы bot_states, "memory" — только память
+    STATE_BACKEND: str = os.getenv("STATE_BACKEND", "db").strip().lower()
+    STATE_CACHE_SIZE: int = int(os.getenv("STATE_CACHE_SIZE", "50000"))
+    STATE_CACHE_TTL: float = float(os.getenv("STATE_CACHE_TTL", "3600"))
+    STATE_FLUSH_INTERVAL: float = float(os.getenv("STATE_FLUSH_INTERVAL", "1.0"))
+    # Сколько уже записанных в users пользователей помнить, чтобы команды не ходили в БД за _ensure_user
+    KNOWN_USERS_CACHE_SIZE: int = int(os.getenv("KNOWN_USERS_CACHE_SIZE", "100000"))
+    # Снапшот пользователя (балансы, рефералы) между апдейтами: сбрасывается при записи, TTL — страховка (0 — выключен)
+    SNAPSHOT_CACHE_TTL: float = float(os.getenv("SNAPSHOT_CACHE_TTL", "30"))
+    SNAPSHOT_CACHE_SIZE: int = int(os.getenv("SNAPSHOT_CACHE_SIZE", "50000"))
 
     # API cost tracking (per generation)
     KLINGAI_COST_USD: str = os.getenv("KLINGAI_COST_USD", "0")
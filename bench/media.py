@@ -0,0 +1,79 @@
+"""
+Бенчмарк probe-and-skip на реальных роликах KlingAI.
+
+    python -m bench.media --aspect 9:16 samples/*.mp4    # из корня репозитория
+
+Для каждого файла считает CPU-время ffmpeg (usr+sys дочерних процессов) на полном transcode
+и на пути, который выбрал plan_for, и печатает долю задач без энкодера и сэкономленное CPU.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import resource
+import tempfile
+from collections import Counter
+from typing import List, Tuple
+
+from app.infrastructure.media.processor import (
+    PLAN_PASSTHROUGH,
+    PLAN_TRANSCODE,
+    MediaProcessor,
+    build_fit_command,
+    plan_for,
+)
+
+
+def _children_cpu() -> float:
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+async def _cpu_of(media: MediaProcessor, cmd: List[str]) -> float:
+    before = _children_cpu()
+    result = await media.run(cmd, label=cmd[0])
+    if not result.ok:
+        raise RuntimeError(result.stderr.decode(errors="replace")[-500:])
+    return _children_cpu() - before
+
+
+async def _bench_file(media: MediaProcessor, path: str, aspect: str) -> Tuple[str, float, float]:
+    info = await media.probe(path)
+    plan = plan_for(info, aspect)
+    with tempfile.TemporaryDirectory() as tmp:
+        full = await _cpu_of(media, build_fit_command(PLAN_TRANSCODE, path, os.path.join(tmp, "full.mp4"), aspect))
+        if plan == PLAN_PASSTHROUGH:
+            chosen = 0.0
+        elif plan == PLAN_TRANSCODE:
+            chosen = full
+        else:
+            chosen = await _cpu_of(media, build_fit_command(plan, path, os.path.join(tmp, "plan.mp4"), aspect, info))
+    return plan, full, chosen
+
+
+async def main(paths: List[str], aspect: str) -> None:
+    # по одному процессу, чтобы RUSAGE_CHILDREN относился к конкретной команде
+    media = MediaProcessor(workers=1)
+    plans: Counter = Counter()
+    total_full = total_chosen = 0.0
+    for path in paths:
+        plan, full, chosen = await _bench_file(media, path, aspect)
+        plans[plan] += 1
+        total_full += full
+        total_chosen += chosen
+        print(f"{os.path.basename(path)}: plan={plan} transcode_cpu={full:.2f}s chosen_cpu={chosen:.2f}s")
+
+    n = sum(plans.values()) or 1
+    skipped = 1 - plans.get(PLAN_TRANSCODE, 0) / n
+    saved = 1 - total_chosen / total_full if total_full else 0.0
+    print(f"files={n} plans={dict(plans)}")
+    print(f"encoder skipped: {skipped:.0%}, CPU {total_full:.2f}s -> {total_chosen:.2f}s (saved {saved:.0%})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--aspect", default="9:16", choices=["9:16", "16:9", "1:1"])
+    parser.add_argument("paths", nargs="+")
+    args = parser.parse_args()
+    asyncio.run(main(args.paths, args.aspect))
@@ -0,0 +1,89 @@
+"""
+Бенчмарк обращений к БД на один вызов route().
+
+    python -m bench.snapshot --user-id 123456789 --page account.cabinet --repeat 50    # из корня репозитория
+
+Гоняет route() для существующего пользователя из DATABASE_URL и считает SQL-запросы, которые
+ушли в базу (событие before_cursor_execute движка), и среднее время вызова. Общий кэш
+снапшотов на время замера выключен — считается чтение из БД. Снапшот читает только
+объявленные страницей группы; счётчики рефералов лежат в users, поэтому число запросов
+и время не зависят от того, сколько у пользователя рефералов.
+Страница рендерится в памяти, в Telegram ничего не отправляется.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import time
+from contextlib import contextmanager
+from typing import Iterator, List
+
+from sqlalchemy import event
+
+from app.bot import context as context_module
+from app.bot.context import BotContext, State
+from app.bot.router import route
+from app.bot.snapshot_cache import SnapshotCache
+from app.infrastructure.db.base import engine
+
+
+class _StatementCounter:
+    def __init__(self) -> None:
+        self.count = 0
+        self.statements: List[str] = []
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany) -> None:
+        self.count += 1
+        self.statements.append(" ".join(statement.split())[:120])
+
+
+@contextmanager
+def _counting() -> Iterator[_StatementCounter]:
+    counter = _StatementCounter()
+    event.listen(engine.sync_engine, "before_cursor_execute", counter)
+    try:
+        yield counter
+    finally:
+        event.remove(engine.sync_engine, "before_cursor_execute", counter)
+
+
+@contextmanager
+def _uncached() -> Iterator[None]:
+    shared = context_module.get_snapshot_cache
+    no_cache = SnapshotCache(ttl=0)
+    context_module.get_snapshot_cache = lambda: no_cache
+    try:
+        yield
+    finally:
+        context_module.get_snapshot_cache = shared
+
+
+async def measure(*, user_id: int, page: str, repeat: int) -> tuple[float, float, List[str]]:
+    # прогрев: соединение в пуле и кэш планов не должны попасть в замер
+    await route(BotContext(user_id=user_id, state=State(current_page=page)), "")
+    with _uncached(), _counting() as counter:
+        started = time.perf_counter()
+        for _ in range(repeat):
+            counter.statements.clear()
+            await route(BotContext(user_id=user_id, state=State(current_page=page)), "")
+        elapsed = time.perf_counter() - started
+    return counter.count / repeat, elapsed / repeat * 1000, counter.statements
+
+
+async def main(user_id: int, page: str, repeat: int, verbose: bool) -> None:
+    queries, ms, statements = await measure(user_id=user_id, page=page, repeat=repeat)
+    print(f"{queries:.1f} queries / {ms:.1f} ms per route() on {page}")
+    if verbose:
+        for statement in statements:
+            print(f"    {statement}")
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--user-id", type=int, required=True)
+    parser.add_argument("--page", default="account.cabinet")
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+    asyncio.run(main(args.user_id, args.page, args.repeat, args.verbose))
@@ -0,0 +1,133 @@
+"""
+Бенчмарк памяти состояний диалога.
+
+    python -m bench.state --count 100000    # из корня репозитория
+
+Сравнивает прирост RSS на `count` состояний: прежний State (обычный dataclass с живым
+aiogram Message в animate_last_message) и текущий (__slots__, только chat_id).
+Каждый вариант меряется в отдельном процессе, чтобы аллокации одного не маскировали другой.
+"""
+from __future__ import annotations
+
+import argparse
+import gc
+import os
+import subprocess
+import sys
+from dataclasses import MISSING, field, fields, make_dataclass
+from datetime import datetime, timezone
+from typing import Any, Callable, List
+
+from app.bot.context import State
+
+
+def _rss_bytes() -> int:
+    with open("/proc/self/statm") as f:
+        resident_pages = int(f.read().split()[1])
+    return resident_pages * os.sysconf("SC_PAGE_SIZE")
+
+
+def _legacy_state_cls() -> type:
+    # State до перехода на __slots__: те же поля плюс animate_last_message
+    spec: List[tuple] = []
+    for f in fields(State):
+        if f.name == "animate_chat_id":
+            continue
+        if f.default_factory is not MISSING:  # type: ignore[misc]
+            spec.append((f.name, Any, field(default_factory=f.default_factory)))  # type: ignore[misc]
+        else:
+            spec.append((f.name, Any, field(default=f.default)))
+    spec.append(("animate_last_message", Any, field(default=None)))
+    return make_dataclass("LegacyState", spec)
+
+
+def _photo_message(uid: int, bot: Any) -> Any:
+    from aiogram.types import Message
+
+    message = Message.model_validate(
+        {
+            "message_id": 1000 + uid,
+            "date": datetime.now(timezone.utc),
+            "chat": {"id": uid, "type": "private", "first_name": f"user{uid}", "username": f"user{uid}"},
+            "from": {"id": uid, "is_bot": False, "first_name": f"user{uid}", "username": f"user{uid}", "language_code": "ru"},
+            "caption": "оживи фото",
+            "photo": [
+                {"file_id": f"AgACAgIAAxkBAAI{uid:012d}{size}", "file_unique_id": f"AQAD{uid:08d}{size}", "width": size, "height": size, "file_size": size * 90}
+                for size in (90, 320, 800, 1280)
+            ],
+        }
+    )
+    return message.as_(bot)
+
+
+def _fill(st: Any, uid: int) -> None:
+    st.current_page = "flow.animate"
+    st.lang = "ru"
+    st.animate_photo_file_id = f"AgACAgIAAxkBAAI{uid:012d}1280"
+    st.animate_photo_unique_id = f"AQAD{uid:08d}1280"
+    st.animate_photo_prompt = "оживи фото"
+
+
+def _make_legacy(count: int) -> List[Any]:
+    from aiogram import Bot
+
+    bot = Bot("123456:bench-token")
+    cls = _legacy_state_cls()
+    out = []
+    for uid in range(count):
+        st = cls()
+        _fill(st, uid)
+        st.animate_last_message = _photo_message(uid, bot)
+        out.append(st)
+    return out
+
+
+def _make_slots(count: int) -> List[Any]:
+    out = []
+    for uid in range(count):
+        st = State()
+        _fill(st, uid)
+        st.animate_chat_id = uid
+        out.append(st)
+    return out
+
+
+VARIANTS: dict[str, Callable[[int], List[Any]]] = {"legacy": _make_legacy, "slots": _make_slots}
+
+
+def measure(variant: str, count: int) -> int:
+    gc.collect()
+    before = _rss_bytes()
+    states = VARIANTS[variant](count)
+    gc.collect()
+    grown = _rss_bytes() - before
+    assert len(states) == count
+    return grown
+
+
+def main(count: int) -> None:
+    results = {}
+    for variant in VARIANTS:
+        out = subprocess.run(
+            [sys.executable, "-m", "bench.state", "--count", str(count), "--variant", variant],
+            check=True,
+            capture_output=True,
+            text=True,
+        )
+        results[variant] = int(out.stdout.strip())
+    per = 100_000 / count
+    for variant, grown in results.items():
+        print(f"{variant}: +{grown / 2**20 * per:.1f} MiB RSS per 100k states ({grown / count:.0f} B/state)")
+    if results["slots"]:
+        print(f"legacy / slots: {results['legacy'] / results['slots']:.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--count", type=int, default=100_000)
+    parser.add_argument("--variant", choices=sorted(VARIANTS))
+    args = parser.parse_args()
+    if args.variant:
+        print(measure(args.variant, args.count))
+    else:
+        main(args.count)
@@ -0,0 +1,57 @@
+"""create generation_jobs queue table
+
+Revision ID: j1k2l3m4jobs
+Revises: i9j8k7l6remove
+Create Date: 2026-10-17
+"""
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql as psql
+
+
+revision = "j1k2l3m4jobs"
+down_revision = "i9j8k7l6remove"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "generation_jobs",
+        sa.Column("id", sa.BigInteger(), sa.Identity(always=False), primary_key=True),
+        sa.Column("user_id", sa.BigInteger(), nullable=False),
+        sa.Column("chat_id", sa.BigInteger(), nullable=False),
+        sa.Column("status", sa.Text(), nullable=False, server_default=sa.text("'queued'")),
+        sa.Column(
+            "payload",
+            psql.JSONB(astext_type=sa.Text()),
+            nullable=False,
+            server_default=sa.text("'{}'::jsonb"),
+        ),
+        sa.Column("attempts", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("task_id", sa.Text(), nullable=True),
+        sa.Column("history_id", sa.Integer(), nullable=True),
+        sa.Column("progress_message_id", sa.BigInteger(), nullable=True),
+        sa.Column("error", sa.Text(), nullable=True),
+        sa.Column("created_at", psql.TIMESTAMP(timezone=True), nullable=False, server_default=sa.text("now()")),
+        sa.Column("updated_at", psql.TIMESTAMP(timezone=True), nullable=False, server_default=sa.text("now()")),
+        sa.Column("started_at", psql.TIMESTAMP(timezone=True), nullable=True),
+        sa.Column("finished_at", psql.TIMESTAMP(timezone=True), nullable=True),
+        sa.ForeignKeyConstraint(["user_id"], ["users.telegram_id"], ondelete="CASCADE"),
+    )
+    op.create_index("ix_generation_jobs_user_id", "generation_jobs", ["user_id"], unique=False)
+    # Частичный индекс под выборку очереди: воркеры смотрят только на незавершённые задачи
+    op.create_index(
+        "ix_generation_jobs_pending",
+        "generation_jobs",
+        ["status", "id"],
+        unique=False,
+        postgresql_where=sa.text("status IN ('queued', 'running')"),
+    )
+
+
+def downgrade():
+    op.drop_index("ix_generation_jobs_pending", table_name="generation_jobs")
+    op.drop_index("ix_generation_jobs_user_id", table_name="generation_jobs")
+    op.drop_table("generation_jobs")
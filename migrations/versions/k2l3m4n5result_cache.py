@@ -0,0 +1,35 @@
+"""create generation_cache table for delivered results
+
+Revision ID: k2l3m4n5cache
+Revises: j1k2l3m4jobs
+Create Date: 2026-10-17
+"""
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql as psql
+
+
+revision = "k2l3m4n5cache"
+down_revision = "j1k2l3m4jobs"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "generation_cache",
+        # sha256(file_unique_id | нормализованный промпт | формат | модель)
+        sa.Column("key", sa.Text(), primary_key=True),
+        sa.Column("file_id", sa.Text(), nullable=False),
+        sa.Column("media_type", sa.Text(), nullable=False, server_default=sa.text("'video'")),
+        sa.Column("hits", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("created_at", psql.TIMESTAMP(timezone=True), nullable=False, server_default=sa.text("now()")),
+        sa.Column("last_hit_at", psql.TIMESTAMP(timezone=True), nullable=True),
+    )
+    op.create_index("ix_generation_cache_created_at", "generation_cache", ["created_at"], unique=False)
+
+
+def downgrade():
+    op.drop_index("ix_generation_cache_created_at", table_name="generation_cache")
+    op.drop_table("generation_cache")
@@ -0,0 +1,34 @@
+"""create telegram_assets table for uploaded static media
+
+Revision ID: l3m4n5o6assets
+Revises: k2l3m4n5cache
+Create Date: 2026-10-17
+"""
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql as psql
+
+
+revision = "l3m4n5o6assets"
+down_revision = "k2l3m4n5cache"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "telegram_assets",
+        # sha256 содержимого файла
+        sa.Column("content_hash", sa.Text(), nullable=False),
+        # file_id действителен только для бота, который загрузил файл: храним хэш токена, не сам токен
+        sa.Column("bot_key", sa.Text(), nullable=False),
+        sa.Column("kind", sa.Text(), nullable=False),
+        sa.Column("file_id", sa.Text(), nullable=False),
+        sa.Column("created_at", psql.TIMESTAMP(timezone=True), nullable=False, server_default=sa.text("now()")),
+        sa.PrimaryKeyConstraint("content_hash", "bot_key", "kind"),
+    )
+
+
+def downgrade():
+    op.drop_table("telegram_assets")
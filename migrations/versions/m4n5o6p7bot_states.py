@@ -0,0 +1,32 @@
+"""create bot_states table for persistent per-user FSM state
+
+Revision ID: m4n5o6p7states
+Revises: l3m4n5o6assets
+Create Date: 2026-10-17
+"""
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql as psql
+
+
+revision = "m4n5o6p7states"
+down_revision = "l3m4n5o6assets"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "bot_states",
+        sa.Column("user_id", sa.BigInteger(), primary_key=True),
+        # компактный JSON: только поля, отличные от значений по умолчанию
+        sa.Column("data", sa.Text(), nullable=False),
+        sa.Column("updated_at", psql.TIMESTAMP(timezone=True), nullable=False, server_default=sa.text("now()")),
+    )
+    op.create_index("ix_bot_states_updated_at", "bot_states", ["updated_at"])
+
+
+def downgrade():
+    op.drop_index("ix_bot_states_updated_at", table_name="bot_states")
+    op.drop_table("bot_states")
@@ -0,0 +1,34 @@
+"""create telegram_updates table for sharded webhook ingestion
+
+Revision ID: n5o6p7q8updates
+Revises: m4n5o6p7states
+Create Date: 2026-10-17
+"""
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql as psql
+
+
+revision = "n5o6p7q8updates"
+down_revision = "m4n5o6p7states"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "telegram_updates",
+        # update_id уникален в пределах бота: повторная доставка вебхука не создаёт дубль
+        sa.Column("update_id", sa.BigInteger(), primary_key=True),
+        sa.Column("shard", sa.Integer(), nullable=False),
+        sa.Column("user_id", sa.BigInteger(), nullable=True),
+        sa.Column("payload", sa.Text(), nullable=False),
+        sa.Column("created_at", psql.TIMESTAMP(timezone=True), nullable=False, server_default=sa.text("now()")),
+    )
+    op.create_index("ix_telegram_updates_shard", "telegram_updates", ["shard", "update_id"])
+
+
+def downgrade():
+    op.drop_index("ix_telegram_updates_shard", table_name="telegram_updates")
+    op.drop_table("telegram_updates")
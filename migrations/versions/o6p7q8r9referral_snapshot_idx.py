@@ -0,0 +1,37 @@
+"""covering index on referral_bonuses for the single-query user snapshot
+
+Revision ID: o6p7q8r9refidx
+Revises: n5o6p7q8updates
+Create Date: 2026-10-17
+"""
+
+from alembic import op
+
+
+revision = "o6p7q8r9refidx"
+down_revision = "n5o6p7q8updates"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # (referrer_user_id, id) отдаёт последних рефералов без сортировки, а INCLUDE — COUNT/SUM
+    # по рефералам одним index-only scan. Старый индекс по referrer_user_id — его префикс, он больше не нужен.
+    op.create_index(
+        "ix_referral_bonuses_referrer_id",
+        "referral_bonuses",
+        ["referrer_user_id", "id"],
+        unique=False,
+        postgresql_include=["referred_user_id", "amount"],
+    )
+    op.drop_index("ix_referral_bonuses_referrer", table_name="referral_bonuses")
+
+
+def downgrade():
+    op.create_index(
+        "ix_referral_bonuses_referrer",
+        "referral_bonuses",
+        ["referrer_user_id"],
+        unique=False,
+    )
+    op.drop_index("ix_referral_bonuses_referrer_id", table_name="referral_bonuses")
@@ -0,0 +1,67 @@
+"""denormalized referral counters on users
+
+Revision ID: p7q8r9s0refcnt
+Revises: o6p7q8r9refidx
+Create Date: 2026-10-17
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "p7q8r9s0refcnt"
+down_revision = "o6p7q8r9refidx"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("users", sa.Column("referral_friends", sa.Integer(), nullable=False, server_default="0"))
+    op.add_column("users", sa.Column("referral_earned", sa.BigInteger(), nullable=False, server_default="0"))
+    op.add_column("users", sa.Column("recent_referral_1", sa.BigInteger(), nullable=True))
+    op.add_column("users", sa.Column("recent_referral_2", sa.BigInteger(), nullable=True))
+    op.add_column("users", sa.Column("recent_referral_3", sa.BigInteger(), nullable=True))
+    # «это первый бонус за этого друга?» при каждой записи бонуса; заодно ON DELETE CASCADE по referred_user_id
+    op.create_index(
+        "ix_referral_bonuses_referred",
+        "referral_bonuses",
+        ["referred_user_id", "referrer_user_id"],
+        unique=False,
+    )
+    # бэкфилл: те же значения, что считает UserRepo.check_referral_counters
+    op.execute(
+        """
+        WITH ranked AS (
+            SELECT referrer_user_id, referred_user_id, amount,
+                   ROW_NUMBER() OVER (PARTITION BY referrer_user_id ORDER BY id DESC) AS rn
+              FROM referral_bonuses
+             WHERE referrer_user_id IS NOT NULL
+        ), agg AS (
+            SELECT referrer_user_id,
+                   COUNT(DISTINCT referred_user_id) AS friends,
+                   COALESCE(SUM(amount), 0) AS earned,
+                   MAX(referred_user_id) FILTER (WHERE rn = 1) AS recent_1,
+                   MAX(referred_user_id) FILTER (WHERE rn = 2) AS recent_2,
+                   MAX(referred_user_id) FILTER (WHERE rn = 3) AS recent_3
+              FROM ranked
+             GROUP BY referrer_user_id
+        )
+        UPDATE users u
+           SET referral_friends = agg.friends,
+               referral_earned = agg.earned,
+               recent_referral_1 = agg.recent_1,
+               recent_referral_2 = agg.recent_2,
+               recent_referral_3 = agg.recent_3
+          FROM agg
+         WHERE u.telegram_id = agg.referrer_user_id
+        """
+    )
+
+
+def downgrade():
+    op.drop_index("ix_referral_bonuses_referred", table_name="referral_bonuses")
+    op.drop_column("users", "recent_referral_3")
+    op.drop_column("users", "recent_referral_2")
+    op.drop_column("users", "recent_referral_1")
+    op.drop_column("users", "referral_earned")
+    op.drop_column("users", "referral_friends")
@@ -0,0 +1,25 @@
+"""generation_cache entries belong to the user who paid for them
+
+Revision ID: q8r9s0t1cacheown
+Revises: p7q8r9s0refcnt
+Create Date: 2026-10-17
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "q8r9s0t1cacheown"
+down_revision = "p7q8r9s0refcnt"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # старые ключи не содержат user_id, и владельца у них не восстановить — кэш просто прогреется заново
+    op.execute("DELETE FROM generation_cache")
+    op.add_column("generation_cache", sa.Column("user_id", sa.BigInteger(), nullable=False))
+
+
+def downgrade():
+    op.drop_column("generation_cache", "user_id")
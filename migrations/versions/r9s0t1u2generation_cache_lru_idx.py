@@ -0,0 +1,24 @@
+"""index generation_cache by last use for cutoff-based eviction
+
+Revision ID: r9s0t1u2cachelru
+Revises: q8r9s0t1cacheown
+Create Date: 2026-10-17
+"""
+
+from alembic import op
+
+
+revision = "r9s0t1u2cachelru"
+down_revision = "q8r9s0t1cacheown"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # last_hit_at теперь «последнее использование»: при записи он равен created_at и не бывает NULL
+    op.execute("UPDATE generation_cache SET last_hit_at = created_at WHERE last_hit_at IS NULL")
+    op.create_index("ix_generation_cache_last_hit_at", "generation_cache", ["last_hit_at"], unique=False)
+
+
+def downgrade():
+    op.drop_index("ix_generation_cache_last_hit_at", table_name="generation_cache")
@@ -0,0 +1,38 @@
+"""mark telegram updates taken/done instead of deleting them on fetch
+
+Revision ID: s0t1u2v3updack
+Revises: r9s0t1u2cachelru
+Create Date: 2026-10-17
+"""
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql as psql
+
+
+revision = "s0t1u2v3updack"
+down_revision = "r9s0t1u2cachelru"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("telegram_updates", sa.Column("taken_at", psql.TIMESTAMP(timezone=True), nullable=True))
+    op.add_column("telegram_updates", sa.Column("done_at", psql.TIMESTAMP(timezone=True), nullable=True))
+    # выборка воркера смотрит только на ещё не взятые строки; обработанные лежат до чистки по done_at
+    op.drop_index("ix_telegram_updates_shard", table_name="telegram_updates")
+    op.create_index(
+        "ix_telegram_updates_shard",
+        "telegram_updates",
+        ["shard", "update_id"],
+        postgresql_where=sa.text("taken_at IS NULL"),
+    )
+    op.create_index("ix_telegram_updates_done_at", "telegram_updates", ["shard", "done_at"])
+
+
+def downgrade():
+    op.drop_index("ix_telegram_updates_done_at", table_name="telegram_updates")
+    op.drop_index("ix_telegram_updates_shard", table_name="telegram_updates")
+    op.create_index("ix_telegram_updates_shard", "telegram_updates", ["shard", "update_id"])
+    op.drop_column("telegram_updates", "done_at")
+    op.drop_column("telegram_updates", "taken_at")
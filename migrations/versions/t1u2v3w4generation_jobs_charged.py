@@ -0,0 +1,26 @@
+"""mark generation jobs as charged to make the debit idempotent
+
+Revision ID: t1u2v3w4jobcharged
+Revises: s0t1u2v3updack
+Create Date: 2026-10-17
+"""
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql as psql
+
+
+revision = "t1u2v3w4jobcharged"
+down_revision = "s0t1u2v3updack"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("generation_jobs", sa.Column("charged_at", psql.TIMESTAMP(timezone=True), nullable=True))
+    # завершённые до миграции успешные задачи уже оплачены
+    op.execute("UPDATE generation_jobs SET charged_at = finished_at WHERE status = 'succeeded'")
+
+
+def downgrade():
+    op.drop_column("generation_jobs", "charged_at")
@@ -0,0 +1,168 @@
+import asyncio
+
+import pytest
+from aiogram.types import Update
+
+from app.infrastructure.telegram import admission
+from app.infrastructure.telegram.admission import (
+    SHED_QUEUE_FULL,
+    SHED_STALE,
+    AdmissionMiddleware,
+    ConcurrencyMiddleware,
+    Overloaded,
+    UpdateGate,
+)
+
+
+def _update(update_id: int, *, callback: bool = False) -> Update:
+    user = {"id": 1, "is_bot": False, "first_name": "u"}
+    if callback:
+        return Update.model_validate(
+            {"update_id": update_id, "callback_query": {"id": str(update_id), "from": user, "chat_instance": "c", "data": "x"}}
+        )
+    return Update.model_validate(
+        {
+            "update_id": update_id,
+            "message": {"message_id": update_id, "date": 0, "chat": {"id": 1, "type": "private"}, "from": user, "text": "hi"},
+        }
+    )
+
+
+@pytest.mark.asyncio
+async def test_gate_limits_inflight_and_queue():
+    gate = UpdateGate(max_inflight=2, max_queue=1)
+    release = asyncio.Event()
+    running = 0
+    peak = 0
+
+    async def work() -> None:
+        nonlocal running, peak
+        ticket = gate.admit()
+        await gate.acquire(ticket)
+        running += 1
+        peak = max(peak, running)
+        try:
+            await release.wait()
+        finally:
+            running -= 1
+            gate.release(ticket)
+
+    tasks = [asyncio.create_task(work()) for _ in range(3)]
+    await asyncio.sleep(0.01)
+    stats = gate.stats()
+    assert (stats.inflight, stats.queued) == (2, 1)
+    # два слота заняты, одно место в очереди занято — четвёртый апдейт сбрасывается
+    with pytest.raises(Overloaded) as exc:
+        gate.admit()
+    assert exc.value.reason == SHED_QUEUE_FULL
+
+    release.set()
+    await asyncio.gather(*tasks)
+    stats = gate.stats()
+    assert peak == 2
+    assert (stats.inflight, stats.queued, stats.processed) == (0, 0, 3)
+    assert stats.peak_inflight == 2
+    assert stats.shed_queue_full == 1
+
+
+@pytest.mark.asyncio
+async def test_waiting_callback_goes_stale():
+    gate = UpdateGate(max_inflight=1, max_queue=10)
+    busy = gate.admit()
+    await gate.acquire(busy)
+
+    waiting = gate.admit()
+    with pytest.raises(Overloaded) as exc:
+        await gate.acquire(waiting, ttl=0.05)
+    assert exc.value.reason == SHED_STALE
+
+    gate.release(busy)
+    stats = gate.stats()
+    assert (stats.inflight, stats.queued, stats.shed_stale) == (0, 0, 1)
+    # слот свободен: следующий апдейт стартует без ожидания
+    fresh = gate.admit()
+    await gate.acquire(fresh, ttl=1)
+    assert gate.stats().inflight == 1
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_frees_queue_place():
+    gate = UpdateGate(max_inflight=1, max_queue=1)
+    busy = gate.admit()
+    await gate.acquire(busy)
+    ticket = gate.admit()
+    task = asyncio.create_task(gate.acquire(ticket))
+    await asyncio.sleep(0.01)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    gate.abandon(ticket)
+    gate.release(busy)
+    assert (gate.stats().inflight, gate.stats().queued) == (0, 0)
+
+
+@pytest.mark.asyncio
+async def test_middlewares_shed_with_busy_notice(monkeypatch):
+    gate = UpdateGate(max_inflight=1, max_queue=0)
+    shed: list[tuple[int, str]] = []
+
+    async def fake_shed(update, reason):
+        shed.append((update.update_id, reason))
+
+    monkeypatch.setattr(admission, "shed_update", fake_shed)
+    intake = AdmissionMiddleware(gate)
+    slot = ConcurrencyMiddleware(gate, callback_ttl=0.05)
+    release = asyncio.Event()
+
+    async def handler(event, data):
+        await release.wait()
+        return "ok"
+
+    async def pipeline(update):
+        return await intake(lambda e, d: slot(handler, e, d), update, {})
+
+    first = asyncio.create_task(pipeline(_update(1)))
+    await asyncio.sleep(0.01)
+    # единственный слот занят, очереди нет — сообщение сразу сбрасывается
+    assert await pipeline(_update(2)) is None
+    assert shed == [(2, SHED_QUEUE_FULL)]
+
+    release.set()
+    assert await first == "ok"
+    assert gate.stats().processed == 1
+    assert (gate.stats().inflight, gate.stats().queued) == (0, 0)
+
+
+@pytest.mark.asyncio
+async def test_stale_callback_is_shed_after_waiting(monkeypatch):
+    gate = UpdateGate(max_inflight=1, max_queue=5)
+    shed: list[tuple[int, str]] = []
+
+    async def fake_shed(update, reason):
+        shed.append((update.update_id, reason))
+
+    monkeypatch.setattr(admission, "shed_update", fake_shed)
+    intake = AdmissionMiddleware(gate)
+    slot = ConcurrencyMiddleware(gate, callback_ttl=0.05)
+    release = asyncio.Event()
+    handled: list[int] = []
+
+    async def handler(event, data):
+        if event.update_id == 1:
+            await release.wait()
+        handled.append(event.update_id)
+
+    async def pipeline(update):
+        return await intake(lambda e, d: slot(handler, e, d), update, {})
+
+    first = asyncio.create_task(pipeline(_update(1)))
+    await asyncio.sleep(0.01)
+    message = asyncio.create_task(pipeline(_update(2)))
+    callback = asyncio.create_task(pipeline(_update(3, callback=True)))
+    await asyncio.sleep(0.1)
+    release.set()
+    await asyncio.gather(first, message, callback)
+    # сообщение дождалось слота, а callback за это время устарел
+    assert handled == [1, 2]
+    assert shed == [(3, SHED_STALE)]
+    assert gate.stats().shed_stale == 1
@@ -0,0 +1,74 @@
+import pytest
+import pytest_asyncio
+from aiogram.types import FSInputFile
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from app.application.services import asset_registry
+from app.application.services.asset_registry import AssetRegistry
+
+
+@pytest_asyncio.fixture
+async def db(monkeypatch):
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:", future=True)
+    async with engine.begin() as conn:
+        await conn.execute(
+            text(
+                """
+                CREATE TABLE telegram_assets (
+                    content_hash TEXT NOT NULL,
+                    bot_key TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    file_id TEXT NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (content_hash, bot_key, kind)
+                )
+                """
+            )
+        )
+    monkeypatch.setattr(asset_registry, "async_session", async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession))
+    yield
+    await engine.dispose()
+
+
+@pytest.fixture
+def promo(tmp_path):
+    path = tmp_path / "старт.MP4"
+    path.write_bytes(b"promo-v1" * 1000)
+    return path
+
+
+@pytest.mark.asyncio
+async def test_asset_is_uploaded_once_and_survives_restart(db, promo):
+    registry = AssetRegistry("123:token")
+    file, cached = await registry.input_file(str(promo), "video")
+    assert isinstance(file, FSInputFile) and not cached
+    await registry.remember(str(promo), "video", "FILE_ID_1")
+
+    for _ in range(3):
+        assert await registry.input_file(str(promo), "video") == ("FILE_ID_1", True)
+    assert registry.uploads == 1
+
+    restarted = AssetRegistry("123:token")
+    assert await restarted.input_file(str(promo), "video") == ("FILE_ID_1", True)
+
+
+@pytest.mark.asyncio
+async def test_file_id_is_scoped_to_bot_kind_and_content(db, promo):
+    registry = AssetRegistry("123:token")
+    await registry.remember(str(promo), "video", "FILE_ID_1")
+
+    other_bot = AssetRegistry("456:other")
+    assert (await other_bot.input_file(str(promo), "video"))[1] is False
+    assert (await registry.input_file(str(promo), "document"))[1] is False
+
+    promo.write_bytes(b"promo-v2!" * 1000)
+    assert (await registry.input_file(str(promo), "video"))[1] is False
+
+
+@pytest.mark.asyncio
+async def test_forget_drops_stale_file_id(db, promo):
+    registry = AssetRegistry("123:token")
+    await registry.remember(str(promo), "video", "FILE_ID_1")
+    await registry.forget(str(promo), "video")
+    assert (await AssetRegistry("123:token").input_file(str(promo), "video"))[1] is False
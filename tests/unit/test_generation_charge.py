@@ -0,0 +1,123 @@
+from dataclasses import replace
+from datetime import datetime, timezone
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import event, text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import StaticPool
+
+from app.application.usecases.animate import run_generation as run_module
+from app.application.usecases.animate.run_generation import RunAnimateGeneration
+from app.domain.models.generation_job import GenerationJob
+from app.domain.models.user import Base, User
+from app.infrastructure.db.repositories.user_repo import UserRepo
+from app.infrastructure.queue import job_runner as runner_module
+from app.infrastructure.queue.job_runner import JobRunner, enqueue_generation
+
+
+@pytest_asyncio.fixture
+async def Session(monkeypatch):
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:", future=True, poolclass=StaticPool)
+    # now() очереди — функция Postgres
+    event.listen(
+        engine.sync_engine,
+        "connect",
+        lambda conn, _: conn.create_function("now", 0, lambda: datetime.now(timezone.utc).isoformat()),
+    )
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.execute(
+            text(
+                """
+                CREATE TABLE generation_jobs (
+                    id INTEGER PRIMARY KEY,
+                    user_id BIGINT NOT NULL,
+                    chat_id BIGINT,
+                    status TEXT,
+                    payload TEXT,
+                    progress_message_id BIGINT,
+                    error TEXT,
+                    charged_at TIMESTAMP,
+                    updated_at TIMESTAMP,
+                    finished_at TIMESTAMP
+                )
+                """
+            )
+        )
+        await conn.execute(text("INSERT INTO generation_jobs (id, user_id) VALUES (1, 1)"))
+    Session = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+    async with Session() as s:
+        s.add(User(telegram_id=1, internal_id=10, username="u", balance_tokens=0, animate_balance_tokens=3, friends_count=0))
+        await s.commit()
+    monkeypatch.setattr(run_module, "async_session", Session)
+    monkeypatch.setattr(runner_module, "async_session", Session)
+    yield Session
+    await engine.dispose()
+
+
+def _job(job_id: int = 1) -> GenerationJob:
+    now = datetime.now(timezone.utc)
+    return GenerationJob(
+        id=job_id,
+        user_id=1,
+        chat_id=1,
+        status="running",
+        payload={},
+        attempts=1,
+        task_id="task-1",
+        history_id=None,
+        progress_message_id=None,
+        error=None,
+        created_at=now,
+        updated_at=now,
+        started_at=now,
+        finished_at=None,
+    )
+
+
+async def _balance(Session) -> int:
+    async with Session() as s:
+        return (await UserRepo(s).get(1)).animate_balance_tokens
+
+
+@pytest.mark.asyncio
+async def test_job_is_charged_once_across_reruns(Session):
+    runner = RunAnimateGeneration(bot=None, ticker=object())
+    await runner._charge(_job())
+    # повторный прогон той же задачи после рестарта — задача загружена до отметки или после неё
+    await runner._charge(_job())
+    async with Session() as s:
+        charged_at = (await s.execute(text("SELECT charged_at FROM generation_jobs WHERE id = 1"))).scalar()
+    await runner._charge(replace(_job(), charged_at=charged_at))
+    assert charged_at is not None
+    assert await _balance(Session) == 2
+
+
+@pytest.mark.asyncio
+async def test_failed_charge_is_raised_and_leaves_job_unmarked(Session, monkeypatch):
+    async def broken(self, **kwargs):
+        raise RuntimeError("db down")
+
+    monkeypatch.setattr(UserRepo, "debit_balance", broken)
+    with pytest.raises(RuntimeError):
+        await RunAnimateGeneration(bot=None, ticker=object())._charge(_job())
+    async with Session() as s:
+        assert (await s.execute(text("SELECT charged_at FROM generation_jobs WHERE id = 1"))).scalar() is None
+    assert await _balance(Session) == 3
+
+
+@pytest.mark.asyncio
+async def test_enqueue_reserves_balance_and_failed_job_refunds_once(Session):
+    queued = [
+        await enqueue_generation(user_id=1, chat_id=1, payload={"prompt": f"p{i}"}) for i in range(4)
+    ]
+    # на балансе 3 генерации: четвёртая разная по промпту задача уже не ставится
+    assert queued[:3] == [2, 3, 4] and queued[3] is None
+    assert await _balance(Session) == 0
+
+    runner = JobRunner(lambda job: None)
+    await runner._finish(replace(_job(2), charged_at=datetime.now(timezone.utc)), "failed", "boom")
+    await runner._finish(replace(_job(2), charged_at=datetime.now(timezone.utc)), "failed", "boom")
+    await runner._finish(_job(3), "succeeded")
+    assert await _balance(Session) == 1
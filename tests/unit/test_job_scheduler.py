@@ -0,0 +1,70 @@
+from app.infrastructure.queue.job_scheduler import FairScheduler, QueuedJob, parse_segment_weights
+
+
+def _queue(user_id: int, segment: str, ids) -> list[QueuedJob]:
+    return [QueuedJob(id=i, user_id=user_id, segment=segment) for i in ids]
+
+
+def _drain(scheduler: FairScheduler, queued: list[QueuedJob], picks: int) -> list[QueuedJob]:
+    served = []
+    queued = list(queued)
+    for _ in range(picks):
+        job = scheduler.pick(queued, {}, now=0.0)
+        assert job is not None
+        served.append(job)
+        queued.remove(job)
+    return served
+
+
+def test_global_and_per_user_caps():
+    scheduler = FairScheduler(global_cap=2, per_user_cap=1)
+    queued = _queue(1, "lead", [1, 2]) + _queue(2, "lead", [3])
+
+    assert scheduler.pick(queued, {7: 1, 8: 1}, now=0.0) is None
+    # у пользователя 1 уже идёт задача — следующим запускается пользователь 2
+    assert scheduler.pick(queued, {1: 1}, now=0.0).user_id == 2
+    assert scheduler.pick(_queue(1, "lead", [1, 2]), {1: 1}, now=0.0) is None
+
+
+def test_clients_are_served_more_often_but_leads_do_not_starve():
+    scheduler = FairScheduler(global_cap=100, per_user_cap=100)
+    # лид пришёл раньше клиента
+    queued = _queue(1, "lead", range(1, 11)) + _queue(2, "client", range(11, 21))
+
+    first = _drain(scheduler, queued, 5)
+    assert [j.user_id for j in first].count(2) == 4
+
+    rest = _drain(scheduler, [j for j in queued if j not in first], 10)
+    assert [j.user_id for j in first + rest].count(1) >= 3
+
+
+def test_new_user_does_not_wait_behind_a_long_backlog():
+    scheduler = FairScheduler(global_cap=100, per_user_cap=100)
+    backlog = _queue(1, "lead", range(1, 51))
+    _drain(scheduler, backlog, 10)
+    newcomer = _queue(2, "lead", [100])
+    remaining = backlog[10:] + newcomer
+    assert scheduler.positions(remaining)[100] <= 2
+
+
+def test_positions_match_pick_order():
+    scheduler = FairScheduler(global_cap=100, per_user_cap=100)
+    queued = _queue(1, "lead", [1, 2, 3]) + _queue(2, "client", [4, 5]) + _queue(3, "qual", [6])
+    positions = scheduler.positions(queued)
+    order = _drain(scheduler, queued, len(queued))
+    assert [positions[j.id] for j in order] == list(range(1, len(queued) + 1))
+
+
+def test_throttle_pauses_then_lowers_cap():
+    scheduler = FairScheduler(global_cap=4, per_user_cap=4, throttle_window=30.0, pause=5.0)
+    queued = _queue(1, "lead", [1, 2, 3])
+    scheduler.throttle(running=2, now=100.0)
+
+    assert scheduler.pick(queued, {9: 1}, now=101.0) is None
+    assert scheduler.pick(queued, {9: 1}, now=106.0) is not None
+    assert scheduler.pick(queued, {9: 2}, now=110.0) is None
+    assert scheduler.pick(queued, {9: 2}, now=131.0) is not None
+
+
+def test_parse_segment_weights():
+    assert parse_segment_weights("client:10, lead:0.5, bad, qual:x") == {"client": 10.0, "qual": 2.0, "lead": 0.5}
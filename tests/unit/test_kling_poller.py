@@ -0,0 +1,111 @@
+import asyncio
+
+import pytest
+
+from app.infrastructure.providers.kling_poller import KlingStatusPoller
+from app.infrastructure.providers.klingai import KlingError, KlingGeneration
+
+
+class FakeKling:
+    def __init__(self, ready_after: dict[str, int], failed: set[str] | None = None):
+        self.ready_after = ready_after
+        self.failed = failed or set()
+        self.calls: dict[str, int] = {}
+
+    async def get_status(self, task_id: str) -> KlingGeneration:
+        self.calls[task_id] = self.calls.get(task_id, 0) + 1
+        if task_id in self.failed:
+            return KlingGeneration(id=task_id, state="failed", failure_reason="nsfw")
+        if self.calls[task_id] >= self.ready_after[task_id]:
+            return KlingGeneration(id=task_id, state="succeed", video_url=f"https://cdn/{task_id}.mp4")
+        return KlingGeneration(id=task_id, state="processing")
+
+
+def _poller(fake, **kwargs):
+    params = dict(sparse_interval=0.02, dense_interval=0.005, warmup_interval=0.01, warmup_window=0.02)
+    params.update(kwargs)
+    return KlingStatusPoller(lambda: fake, **params)
+
+
+@pytest.mark.asyncio
+async def test_resolves_many_tasks_through_one_loop():
+    fake = FakeKling({f"t{i}": 1 + i % 3 for i in range(20)})
+    poller = _poller(fake)
+    try:
+        results = await asyncio.gather(*(poller.wait(f"t{i}") for i in range(20)))
+    finally:
+        await poller.stop()
+    assert [r.video_url for r in results] == [f"https://cdn/t{i}.mp4" for i in range(20)]
+    assert poller.stats().completed == 20
+    assert poller.stats().tracked == 0
+
+
+@pytest.mark.asyncio
+async def test_failed_task_raises_and_duplicate_waiters_share_result():
+    fake = FakeKling({"ok": 2, "bad": 1}, failed={"bad"})
+    poller = _poller(fake)
+    try:
+        first, second = await asyncio.gather(poller.wait("ok"), poller.wait("ok"))
+        with pytest.raises(KlingError, match="nsfw"):
+            await poller.wait("bad")
+    finally:
+        await poller.stop()
+    assert first is second
+    assert fake.calls["ok"] == 2
+
+
+@pytest.mark.asyncio
+async def test_poke_checks_the_task_right_away():
+    fake = FakeKling({"cb": 1})
+    poller = _poller(fake, warmup_window=60.0, sparse_interval=60.0)
+    try:
+        waiter = asyncio.create_task(poller.wait("cb"))
+        await asyncio.sleep(0)
+        assert not poller.poke("unknown")
+        assert poller.poke("cb")
+        result = await asyncio.wait_for(waiter, timeout=1)
+    finally:
+        await poller.stop()
+    # результат — из get_status, а не из callback
+    assert result.video_url == "https://cdn/cb.mp4"
+    assert fake.calls == {"cb": 1}
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_stops_polling():
+    fake = FakeKling({"gone": 10**6})
+    poller = _poller(fake)
+    try:
+        first = asyncio.create_task(poller.wait("gone"))
+        second = asyncio.create_task(poller.wait("gone"))
+        await asyncio.sleep(0.03)
+        first.cancel()
+        await asyncio.sleep(0)
+        # второй ожидающий ещё ждёт — задача остаётся под наблюдением
+        assert poller.stats().tracked == 1
+        second.cancel()
+        await asyncio.gather(first, second, return_exceptions=True)
+        assert poller.stats().tracked == 0
+        polls = fake.calls["gone"]
+        await asyncio.sleep(0.05)
+    finally:
+        await poller.stop()
+    assert fake.calls["gone"] == polls
+
+
+def test_cadence_is_sparse_early_and_dense_near_typical_finish():
+    poller = KlingStatusPoller(lambda: None, sparse_interval=15.0, dense_interval=2.0, step=0.1, min_samples=10)
+    # без статистики — редкий опрос до конца первой минуты
+    assert poller._next_delay(0.0) == 15.0
+    assert poller._next_delay(55.0) == 5.0
+    assert poller._next_delay(120.0) == 5.0
+
+    # готовность обычно через 100..138с
+    for value in range(100, 140, 2):
+        poller._record_sample(float(value))
+    assert poller._next_delay(0.0) == 15.0
+    assert poller._next_delay(90.0) == 14.0
+    assert poller._next_delay(100.0) == 6.0
+    assert poller._next_delay(131.0) == 5.0
+    assert poller._next_delay(137.0) == 2.0
+    assert poller._next_delay(500.0) == 15.0
@@ -0,0 +1,155 @@
+import asyncio
+import json
+from dataclasses import replace
+
+import httpx
+import pytest
+import pytest_asyncio
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from app.api.http import app
+from app.api.webhooks import klingai as webhook_module
+from app.application.services import message_bus
+from app.infrastructure.db.base import get_session
+from app.infrastructure.providers import kling_poller as poller_module
+from app.infrastructure.providers import klingai as klingai_module
+from app.infrastructure.providers.kling_poller import KLING_TASK_CHANNEL, KlingStatusPoller, on_task_event
+from app.infrastructure.providers.klingai import KlingClient
+from app.settings import settings as app_settings
+
+CALLBACK = "http://api.test/webhook/klingai"
+
+
+class StandInKling:
+    """
+    Локальная замена KlingAI: принимает create_video, запоминает callback_url, отвечает на запрос
+    статуса и по команде присылает callback о готовности в наше API.
+    """
+
+    def __init__(self, api: httpx.AsyncClient):
+        self.api = api
+        self.callbacks: dict[str, str] = {}
+
+    def handler(self, request: httpx.Request) -> httpx.Response:
+        if request.method == "GET":
+            task_id = request.url.path.rsplit("/", 1)[-1]
+            return httpx.Response(
+                200,
+                json={
+                    "code": 0,
+                    "data": {
+                        "task_id": task_id,
+                        "task_status": "succeed",
+                        "task_result": {"videos": [{"id": "v1", "url": f"https://cdn.test/{task_id}.mp4"}]},
+                    },
+                },
+            )
+        body = json.loads(request.content)
+        task_id = f"task-{len(self.callbacks) + 1}"
+        self.callbacks[task_id] = body.get("callback_url")
+        return httpx.Response(200, json={"code": 0, "data": {"task_id": task_id, "task_status": "submitted"}})
+
+    async def complete(self, task_id: str, *, token: str | None = None) -> httpx.Response:
+        url = self.callbacks[task_id]
+        if token is not None:
+            url = url.split("?", 1)[0] + f"?token={token}"
+        return await self.api.post(
+            url,
+            json={
+                "task_id": task_id,
+                "task_status": "succeed",
+                # ссылка из тела callback не должна никуда попасть
+                "task_result": {"videos": [{"id": "v1", "url": "https://evil.test/video.mp4", "duration": "5"}]},
+            },
+        )
+
+
+@pytest.fixture(autouse=True)
+def override_kling_settings(monkeypatch):
+    override = replace(
+        app_settings,
+        KLINGAI_ACCESS_KEY="ak",
+        KLINGAI_SECRET_KEY="sk",
+        KLINGAI_BASE_URL="https://kling.test",
+        KLINGAI_CALLBACK_URL=CALLBACK,
+        KLINGAI_CALLBACK_SECRET="s3cret",
+    )
+    monkeypatch.setattr(klingai_module, "settings", override)
+    monkeypatch.setattr(webhook_module, "settings", override)
+    yield
+
+
+@pytest_asyncio.fixture
+async def api():
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:", future=True)
+    Session = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+
+    async def _session():
+        async with Session() as s:
+            yield s
+            await s.commit()
+
+    app.dependency_overrides[get_session] = _session
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://api.test") as client:
+        yield client
+    app.dependency_overrides.clear()
+    await engine.dispose()
+
+
+@pytest.fixture
+def kling(api):
+    return StandInKling(api)
+
+
+@pytest_asyncio.fixture
+async def poller(monkeypatch, kling):
+    def _client():
+        return KlingClient(http=httpx.AsyncClient(transport=httpx.MockTransport(kling.handler)))
+
+    instance = KlingStatusPoller(_client, fallback_interval=60.0)
+    monkeypatch.setattr(poller_module, "_poller", instance)
+    message_bus.subscribe(KLING_TASK_CHANNEL, on_task_event)
+    yield instance
+    message_bus.unsubscribe(KLING_TASK_CHANNEL, on_task_event)
+    await instance.stop()
+
+
+@pytest.mark.asyncio
+async def test_callback_wakes_waiting_generation(kling, poller):
+    client = KlingClient(http=httpx.AsyncClient(transport=httpx.MockTransport(kling.handler)))
+    gen = await client.create_video(prompt="smile", image_url="https://tg.test/photo.jpg")
+    assert kling.callbacks[gen.id] == f"{CALLBACK}?token=s3cret"
+
+    waiter = asyncio.create_task(poller.wait(gen.id))
+    await asyncio.sleep(0)
+    resp = await kling.complete(gen.id)
+    assert resp.status_code == 200
+
+    result = await asyncio.wait_for(waiter, timeout=1)
+    # callback только разбудил проверку: ссылка — из ответа get_status
+    assert result.video_url == f"https://cdn.test/{gen.id}.mp4"
+    assert poller.stats().polls == 1
+
+
+@pytest.mark.asyncio
+async def test_callback_with_wrong_token_is_rejected(kling, poller):
+    client = KlingClient(http=httpx.AsyncClient(transport=httpx.MockTransport(kling.handler)))
+    gen = await client.create_video(prompt="wave", image_url="https://tg.test/photo.jpg")
+
+    waiter = asyncio.create_task(poller.wait(gen.id))
+    await asyncio.sleep(0)
+    resp = await kling.complete(gen.id, token="nope")
+    assert resp.status_code == 403
+    assert not waiter.done()
+    waiter.cancel()
+
+
+@pytest.mark.asyncio
+async def test_callback_requires_a_secret(monkeypatch, api):
+    override = replace(webhook_module.settings, KLINGAI_CALLBACK_SECRET="")
+    monkeypatch.setattr(klingai_module, "settings", override)
+    monkeypatch.setattr(webhook_module, "settings", override)
+    # без секрета callback не передаётся в KlingAI, а API его не принимает
+    assert klingai_module.callback_url() is None
+    resp = await api.post("/webhook/klingai", json={"task_id": "t1", "task_status": "succeed"})
+    assert resp.status_code == 403
@@ -0,0 +1,115 @@
+from dataclasses import replace
+
+import httpx
+import pytest
+
+from app.infrastructure.providers import klingai as klingai_module
+from app.infrastructure.providers.klingai import KlingClient, KlingRateLimited, close_shared_http_client, shared_http_client
+from app.settings import settings as app_settings
+
+
+@pytest.fixture(autouse=True)
+def override_kling_settings(monkeypatch):
+    override = replace(
+        app_settings,
+        KLINGAI_ACCESS_KEY="ak",
+        KLINGAI_SECRET_KEY="sk",
+        KLINGAI_BASE_URL="https://kling.test",
+        KLINGAI_MAX_CONNECTIONS=7,
+    )
+    monkeypatch.setattr(klingai_module, "settings", override)
+    monkeypatch.setattr(klingai_module, "_jwt_cache", {})
+    yield
+
+
+@pytest.mark.asyncio
+async def test_clients_share_http_pool():
+    first = KlingClient()
+    second = KlingClient()
+    try:
+        assert first._client is second._client
+        assert first._client is shared_http_client()
+        await first.close()
+        assert not second._client.is_closed
+    finally:
+        await close_shared_http_client()
+    assert KlingClient()._client is not first._client
+    await close_shared_http_client()
+
+
+@pytest.mark.asyncio
+async def test_jwt_minted_once_for_all_clients(monkeypatch):
+    calls = []
+    original = KlingClient._encode_jwt_token
+
+    def _counting(self):
+        calls.append(1)
+        return original(self)
+
+    monkeypatch.setattr(KlingClient, "_encode_jwt_token", _counting)
+    try:
+        headers = {KlingClient()._auth_header() for _ in range(5)}
+    finally:
+        await close_shared_http_client()
+    assert len(headers) == 1
+    assert len(calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_download_streams_to_file(tmp_path):
+    body = b"v" * (300 * 1024)
+    client = KlingClient(http=httpx.AsyncClient(transport=httpx.MockTransport(lambda r: httpx.Response(200, content=body))))
+    path = tmp_path / "kling.mp4"
+    stats = await client.download_to("https://cdn.test/v.mp4", str(path))
+    assert stats.bytes == len(body) and stats.resumes == 0
+    assert path.read_bytes() == body
+
+
+class _BrokenStream(httpx.AsyncByteStream):
+    def __init__(self, data: bytes, cut: int):
+        self.data = data
+        self.cut = cut
+
+    async def __aiter__(self):
+        yield self.data[: self.cut]
+        raise httpx.ReadError("connection reset")
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("supports_range", [True, False])
+async def test_download_resumes_after_network_error(tmp_path, supports_range):
+    body = bytes(range(256)) * 1024
+    ranges = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        header = request.headers.get("range")
+        ranges.append(header)
+        if header is None:
+            return httpx.Response(200, stream=_BrokenStream(body, 100_000))
+        if not supports_range:
+            return httpx.Response(200, content=body)
+        start = int(header.split("=")[1].rstrip("-"))
+        return httpx.Response(206, content=body[start:])
+
+    client = KlingClient(http=httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    path = tmp_path / "kling.mp4"
+    stats = await client.download_to("https://cdn.test/v.mp4", str(path))
+    assert path.read_bytes() == body
+    # докачка начинается с последнего полностью отданного куска, а не с нуля
+    assert ranges[0] is None and len(ranges) == 2
+    assert 0 < int(ranges[1].split("=")[1].rstrip("-")) <= 100_000
+    assert stats.resumes == 1 and stats.bytes == len(body)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "response",
+    [
+        httpx.Response(429, json={"code": 1302, "message": "too many requests"}),
+        httpx.Response(200, json={"code": 1303, "message": "parallel task over resource pack limit"}),
+    ],
+)
+async def test_rate_limit_is_reported_separately(response):
+    client = KlingClient(http=httpx.AsyncClient(transport=httpx.MockTransport(lambda r: response)))
+    with pytest.raises(KlingRateLimited):
+        await client.create_video(prompt="smile", image_url="https://tg.test/photo.jpg")
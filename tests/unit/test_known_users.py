@@ -0,0 +1,75 @@
+import pytest
+import pytest_asyncio
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from app.application.services.message_bus import subscribe, unsubscribe
+from app.bot.known_users import KnownUsers
+from app.infrastructure.db.repositories.user_repo import USER_CHANGED_CHANNEL, UserRepo
+
+
+def test_known_user_is_current_until_fields_change():
+    known = KnownUsers()
+    assert not known.is_current(1, username="alice")
+
+    known.remember(1, username="alice", first_name="Alice", last_name=None)
+    assert known.is_current(1, username="alice")
+    # None — «поле не прислали», как в get_or_create
+    assert known.is_current(1, username="alice", first_name=None, last_name=None)
+    assert known.is_current(1, username="alice", first_name="Alice")
+    assert not known.is_current(1, username="alice_new")
+    assert not known.is_current(1, username="alice", last_name="Smith")
+
+    stats = known.stats()
+    assert (stats.size, stats.hits, stats.misses) == (1, 3, 3)
+
+
+def test_known_users_evicts_least_recent():
+    known = KnownUsers(max_entries=2)
+    known.remember(1, username="a", first_name=None, last_name=None)
+    known.remember(2, username="b", first_name=None, last_name=None)
+    assert known.is_current(1, username="a")
+    known.remember(3, username="c", first_name=None, last_name=None)
+    assert known.is_current(1, username="a")
+    assert not known.is_current(2, username="b")
+    assert known.is_current(3, username="c")
+
+
+@pytest_asyncio.fixture
+async def session():
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:", future=True)
+    async with engine.begin() as conn:
+        await conn.execute(
+            text(
+                "CREATE TABLE users (telegram_id INTEGER PRIMARY KEY, segment TEXT, "
+                "updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)"
+            )
+        )
+        await conn.execute(
+            text(
+                "CREATE TABLE segment_history (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, "
+                "segment TEXT, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)"
+            )
+        )
+    Session = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+    async with Session() as session:
+        yield session
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_segment_change_forgets_known_user(session):
+    await session.execute(text("INSERT INTO users (telegram_id, segment) VALUES (7, 'lead')"))
+    await session.commit()
+
+    known = KnownUsers()
+    known.remember(7, username="bob", first_name=None, last_name=None)
+    subscribe(USER_CHANGED_CHANNEL, known.on_user_changed)
+    try:
+        await UserRepo(session).set_segment(telegram_id=7, segment="ban")
+        await session.commit()
+    finally:
+        unsubscribe(USER_CHANGED_CHANNEL, known.on_user_changed)
+
+    assert not known.is_current(7, username="bob")
+    assert known.stats().invalidations == 1
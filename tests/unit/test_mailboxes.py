@@ -0,0 +1,101 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from app.infrastructure.telegram.mailboxes import MailboxMiddleware, UserMailboxes
+
+
+@pytest.mark.asyncio
+async def test_same_key_runs_in_order_other_keys_in_parallel():
+    boxes = UserMailboxes()
+    log: list[str] = []
+    release = asyncio.Event()
+
+    async def work(key: int, name: str, *, wait: bool = False) -> None:
+        async with boxes.turn(key):
+            if wait:
+                await release.wait()
+            log.append(name)
+
+    tasks = [
+        asyncio.create_task(work(1, "a1", wait=True)),
+        asyncio.create_task(work(1, "a2")),
+        asyncio.create_task(work(1, "a3")),
+        asyncio.create_task(work(2, "b1")),
+    ]
+    await asyncio.sleep(0.01)
+    # пользователь 2 не ждёт зависший апдейт пользователя 1
+    assert log == ["b1"]
+    stats = boxes.stats()
+    assert stats.active == 1
+    assert stats.waiting == 2
+    assert stats.deepest == 3
+    assert boxes.depth(1) == 3
+
+    release.set()
+    await asyncio.gather(*tasks)
+    assert log == ["b1", "a1", "a2", "a3"]
+    stats = boxes.stats()
+    assert (stats.active, stats.waiting, stats.deepest) == (0, 0, 0)
+    assert stats.max_depth == 3
+    assert stats.processed == 4
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_does_not_block_queue():
+    boxes = UserMailboxes()
+    log: list[str] = []
+    release = asyncio.Event()
+
+    async def work(name: str, *, wait: bool = False) -> None:
+        async with boxes.turn(1):
+            if wait:
+                await release.wait()
+            log.append(name)
+
+    first = asyncio.create_task(work("first", wait=True))
+    second = asyncio.create_task(work("second"))
+    third = asyncio.create_task(work("third"))
+    await asyncio.sleep(0.01)
+    second.cancel()
+    await asyncio.sleep(0.01)
+    assert boxes.depth(1) == 2
+
+    release.set()
+    await asyncio.gather(first, third)
+    assert log == ["first", "third"]
+    assert boxes.depth(1) == 0
+
+
+@pytest.mark.asyncio
+async def test_failed_update_releases_mailbox():
+    boxes = UserMailboxes()
+
+    with pytest.raises(RuntimeError):
+        async with boxes.turn(1):
+            raise RuntimeError("boom")
+
+    async with boxes.turn(1):
+        assert boxes.depth(1) == 1
+    assert boxes.stats().processed == 2
+
+
+@pytest.mark.asyncio
+async def test_middleware_keys_by_user_then_chat():
+    boxes = UserMailboxes()
+    middleware = MailboxMiddleware(boxes)
+    seen: list[int] = []
+
+    async def handler(event, data):
+        seen.append(boxes.depth(data["key"]))
+        return data["key"]
+
+    user = SimpleNamespace(id=10)
+    chat = SimpleNamespace(id=-20)
+    assert await middleware(handler, object(), {"event_from_user": user, "event_chat": chat, "key": 10}) == 10
+    assert await middleware(handler, object(), {"event_chat": chat, "key": -20}) == -20
+    # апдейт без пользователя и чата проходит мимо очередей
+    assert await middleware(handler, object(), {"key": 0}) == 0
+    assert seen == [1, 1, 0]
+    assert boxes.stats().processed == 2
@@ -0,0 +1,174 @@
+import asyncio
+import json
+import os
+import struct
+import sys
+from dataclasses import replace
+
+import pytest
+
+from app.infrastructure.media import processor as processor_module
+from app.infrastructure.media.processor import (
+    MediaJobResult,
+    MediaProcessor,
+    build_fit_command,
+    media_workspace,
+    moov_before_mdat,
+    parse_probe,
+    plan_for,
+)
+
+SLEEP = [sys.executable, "-c", "import time; time.sleep(0.2)"]
+
+
+@pytest.mark.asyncio
+async def test_jobs_beyond_limit_wait_in_queue():
+    media = MediaProcessor(workers=2)
+    peak = 0
+
+    async def watch():
+        nonlocal peak
+        while True:
+            peak = max(peak, media.stats().running)
+            await asyncio.sleep(0.01)
+
+    watcher = asyncio.create_task(watch())
+    results = await asyncio.gather(*(media.run(SLEEP, label=f"job{i}") for i in range(4)))
+    watcher.cancel()
+
+    assert all(r.ok for r in results)
+    assert peak == 2
+    assert sum(1 for r in results if r.wait_s >= 0.15) == 2
+    stats = media.stats()
+    assert stats.completed == 4 and stats.running == 0 and stats.waiting == 0
+
+
+@pytest.mark.asyncio
+async def test_event_loop_stays_responsive_while_encoding():
+    media = MediaProcessor(workers=1)
+    ticks = 0
+
+    async def ticker():
+        nonlocal ticks
+        while True:
+            ticks += 1
+            await asyncio.sleep(0.01)
+
+    t = asyncio.create_task(ticker())
+    await media.run(SLEEP)
+    t.cancel()
+    assert ticks >= 10
+
+
+@pytest.mark.asyncio
+async def test_missing_ffmpeg_falls_back_to_source(monkeypatch, tmp_path):
+    media = MediaProcessor(workers=1)
+    monkeypatch.setenv("PATH", "")
+    src = tmp_path / "kling.mp4"
+    src.write_bytes(b"not-a-video")
+    assert await media.fit_for_telegram(str(src), "9:16", str(tmp_path / "out.mp4")) == str(src)
+    # ffprobe и ffmpeg оба не нашлись -> полный transcode, который тоже не удался
+    assert media.stats().failed == 2
+    assert media.stats().plans == {"transcode": 1}
+
+
+def _probe_json(vcodec="h264", width=1080, height=1920, pix_fmt="yuv420p", acodec=None, rotate=None):
+    video = {"codec_type": "video", "codec_name": vcodec, "width": width, "height": height, "pix_fmt": pix_fmt, "sample_aspect_ratio": "1:1"}
+    if rotate is not None:
+        video["tags"] = {"rotate": str(rotate)}
+    streams = [video]
+    if acodec:
+        streams.append({"codec_type": "audio", "codec_name": acodec})
+    return json.dumps({"streams": streams}).encode()
+
+
+def _mp4(*boxes: bytes) -> bytes:
+    return b"".join(struct.pack(">I4s", 8 + 4, kind) + b"\0" * 4 for kind in boxes)
+
+
+def test_moov_position(tmp_path):
+    front = tmp_path / "front.mp4"
+    front.write_bytes(_mp4(b"ftyp", b"moov", b"mdat"))
+    back = tmp_path / "back.mp4"
+    back.write_bytes(_mp4(b"ftyp", b"mdat", b"moov"))
+    assert moov_before_mdat(str(front)) is True
+    assert moov_before_mdat(str(back)) is False
+
+
+@pytest.mark.parametrize(
+    "probe, aspect, plan",
+    [
+        (parse_probe(_probe_json(acodec="aac"), faststart=True), "9:16", "passthrough"),
+        (parse_probe(_probe_json(acodec="aac"), faststart=False), "9:16", "remux"),
+        (parse_probe(_probe_json(), faststart=True), "9:16", "mux_audio"),
+        (parse_probe(_probe_json(acodec="opus"), faststart=True), "9:16", "mux_audio"),
+        (parse_probe(_probe_json(width=1078, height=1918, acodec="aac"), faststart=True), "9:16", "passthrough"),
+        (parse_probe(_probe_json(acodec="aac"), faststart=True), "16:9", "transcode"),
+        (parse_probe(_probe_json(vcodec="hevc"), faststart=True), "9:16", "transcode"),
+        (parse_probe(_probe_json(pix_fmt="yuv444p"), faststart=True), "9:16", "transcode"),
+        (parse_probe(_probe_json(rotate=90), faststart=True), "9:16", "transcode"),
+        (None, "1:1", "transcode"),
+    ],
+)
+def test_plan_picks_cheapest_path(probe, aspect, plan):
+    assert plan_for(probe, aspect) == plan
+
+
+def test_transcode_is_single_encode():
+    cmd = build_fit_command("transcode", "in.mp4", "out.mp4", "16:9")
+    vf = cmd[cmd.index("-vf") + 1]
+    assert "scale=960:540" in vf and "pad=960:540" in vf and "setsar=1" in vf
+    assert any(arg.startswith("anullsrc") for arg in cmd)
+    assert cmd.count("+faststart") == 1
+    assert cmd[cmd.index("-c:v") + 1] == "libx264" and cmd[cmd.index("-c:a") + 1] == "aac"
+
+
+def test_copy_paths_never_touch_the_encoder():
+    probe = parse_probe(_probe_json(), faststart=False)
+    for plan in ("remux", "mux_audio"):
+        cmd = build_fit_command(plan, "in.mp4", "out.mp4", "9:16", probe)
+        assert "libx264" not in cmd
+        assert cmd.count("+faststart") == 1
+
+
+@pytest.mark.asyncio
+async def test_fit_for_telegram_skips_encoder_for_matching_video(monkeypatch, tmp_path):
+    media = MediaProcessor(workers=1)
+    calls = []
+
+    async def fake_run(cmd, *, label="ffmpeg", capture=False):
+        calls.append(list(cmd))
+        if cmd[0] == "ffprobe":
+            return MediaJobResult(label=label, returncode=0, wait_s=0.0, run_s=0.0, stdout=_probe_json(acodec="aac"))
+        with open(cmd[-1], "wb") as f:
+            f.write(b"remuxed")
+        return MediaJobResult(label=label, returncode=0, wait_s=0.0, run_s=0.0)
+
+    monkeypatch.setattr(media, "run", fake_run)
+    ready = tmp_path / "ready.mp4"
+    ready.write_bytes(_mp4(b"ftyp", b"moov", b"mdat"))
+    late = tmp_path / "late.mp4"
+    late.write_bytes(_mp4(b"ftyp", b"mdat", b"moov"))
+    out = tmp_path / "out.mp4"
+    assert await media.fit_for_telegram(str(ready), "9:16", str(out)) == str(ready)
+    assert not out.exists()
+    assert await media.fit_for_telegram(str(late), "9:16", str(out)) == str(out)
+    assert out.read_bytes() == b"remuxed"
+
+    assert [c[0] for c in calls] == ["ffprobe", "ffprobe", "ffmpeg"]
+    assert "libx264" not in calls[-1]
+    stats = media.stats()
+    assert stats.plans == {"passthrough": 1, "remux": 1}
+    assert stats.encoder_skipped == 1.0
+
+
+@pytest.mark.asyncio
+async def test_workspace_is_removed_even_on_error(tmp_path, monkeypatch):
+    monkeypatch.setattr(processor_module, "settings", replace(processor_module.settings, MEDIA_TMP_DIR=str(tmp_path)))
+    with pytest.raises(RuntimeError):
+        async with media_workspace() as workdir:
+            assert workdir.startswith(str(tmp_path))
+            with open(os.path.join(workdir, "kling.mp4"), "wb") as f:
+                f.write(b"x")
+            raise RuntimeError("boom")
+    assert list(tmp_path.iterdir()) == []
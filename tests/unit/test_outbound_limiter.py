@@ -0,0 +1,118 @@
+import asyncio
+
+import pytest
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import AnswerCallbackQuery, SendMessage
+
+from app.infrastructure.telegram.outbound import (
+    PRIORITY_HIGH,
+    PRIORITY_LOW,
+    OutboundLimiter,
+    OutboundMiddleware,
+    RetryAfter,
+    outbound_priority,
+)
+
+
+@pytest.mark.asyncio
+async def test_per_chat_bucket_spaces_sends():
+    limiter = OutboundLimiter(global_rate=1000, chat_rate=10, chat_burst=1)
+    loop = asyncio.get_running_loop()
+    sent: list[float] = []
+
+    async def send():
+        sent.append(loop.time())
+
+    started = loop.time()
+    await asyncio.gather(*(limiter.call(42, send) for _ in range(5)))
+    # первая сразу, остальные по одной в 0.1с
+    assert sent[-1] - started >= 0.35
+    # другой чат не ждёт очереди первого
+    other_started = loop.time()
+    await limiter.call(43, send)
+    assert sent[-1] - other_started < 0.05
+    assert limiter.stats().sent == 6
+
+
+@pytest.mark.asyncio
+async def test_high_priority_overtakes_waiting_low():
+    limiter = OutboundLimiter(global_rate=4, chat_rate=100, chat_burst=10)
+    order: list[str] = []
+
+    def sender(name: str):
+        async def send():
+            order.append(name)
+        return send
+
+    tasks = [asyncio.create_task(limiter.call(i, sender(f"low{i}"), priority=PRIORITY_LOW)) for i in range(8)]
+    await asyncio.sleep(0)
+    tasks.append(asyncio.create_task(limiter.call(100, sender("high"), priority=PRIORITY_HIGH)))
+    await asyncio.gather(*tasks)
+
+    # стартовый запас (4) уходит сразу, следующий слот достаётся высокому приоритету
+    assert order[:4] == ["low0", "low1", "low2", "low3"]
+    assert order[4] == "high"
+
+
+@pytest.mark.asyncio
+async def test_retry_after_pauses_chat_and_retries():
+    limiter = OutboundLimiter(global_rate=1000, chat_rate=1000, chat_burst=10, retries=2)
+    loop = asyncio.get_running_loop()
+    attempts: list[float] = []
+
+    async def send():
+        attempts.append(loop.time())
+        if len(attempts) == 1:
+            raise RetryAfter(0.3)
+        return "ok"
+
+    assert await limiter.call(7, send) == "ok"
+    assert len(attempts) == 2
+    assert attempts[1] - attempts[0] >= 0.29
+    stats = limiter.stats()
+    assert stats.retries == 1 and stats.retry_after == 1
+
+
+@pytest.mark.asyncio
+async def test_retry_after_gives_up_after_limit():
+    limiter = OutboundLimiter(global_rate=1000, chat_rate=1000, chat_burst=10, retries=1)
+    calls = 0
+
+    async def send():
+        nonlocal calls
+        calls += 1
+        raise RetryAfter(0)
+
+    with pytest.raises(RetryAfter):
+        await limiter.call(7, send)
+    assert calls == 2
+
+
+@pytest.mark.asyncio
+async def test_middleware_limits_only_messages_and_uses_context_priority():
+    limiter = OutboundLimiter(global_rate=1000, chat_rate=1000, chat_burst=10)
+    middleware = OutboundMiddleware(limiter)
+    seen: list[str] = []
+    priorities: list[int] = []
+    original_call = limiter.call
+
+    async def spy_call(chat_id, send, *, priority):
+        priorities.append(priority)
+        return await original_call(chat_id, send, priority=priority)
+
+    limiter.call = spy_call  # type: ignore[method-assign]
+
+    async def make_request(bot, method):
+        seen.append(type(method).__name__)
+        if len(seen) == 1:
+            raise TelegramRetryAfter(method=method, message="Too Many Requests", retry_after=0)
+        return True
+
+    await middleware(make_request, None, SendMessage(chat_id=1, text="hi"))
+    with outbound_priority(PRIORITY_LOW):
+        await middleware(make_request, None, SendMessage(chat_id=1, text="dots"))
+    await middleware(make_request, None, AnswerCallbackQuery(callback_query_id="1"))
+
+    assert seen == ["SendMessage", "SendMessage", "SendMessage", "AnswerCallbackQuery"]
+    assert priorities == [1, PRIORITY_LOW]
+    assert limiter.stats().sent == 2
@@ -0,0 +1,94 @@
+import asyncio
+
+import pytest
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import EditMessageText
+
+from app.application.services.progress_ticker import ProgressTicker
+
+STAGES = ["Готовлю видео... ✨", "Выравниваю детали... 💬", "Ещё пару мгновений... ❤️"]
+
+
+class FakeBot:
+    def __init__(self, retry_after: int | None = None):
+        self.edits: list[tuple[float, int, str]] = []
+        self.retry_after = retry_after
+
+    async def edit_message_text(self, text, *, chat_id, message_id, parse_mode=None):
+        loop = asyncio.get_running_loop()
+        if self.retry_after is not None:
+            retry, self.retry_after = self.retry_after, None
+            raise TelegramRetryAfter(method=EditMessageText(text=text), message="Too Many Requests", retry_after=retry)
+        self.edits.append((loop.time(), message_id, text))
+
+
+@pytest.mark.asyncio
+async def test_edits_stay_within_global_budget():
+    bot = FakeBot()
+    ticker = ProgressTicker(bot, edits_per_second=20, min_interval=0.05, max_interval=5, tick=0.01)
+    for i in range(100):
+        ticker.track(i, chat_id=i, message_id=i, stages=STAGES, delays=[60, 60], first_stage_shown=False)
+    await asyncio.sleep(0.5)
+    # при 100 сообщениях интервал одного сообщения растёт до 100 / 20 = 5с
+    assert ticker.stats().interval == 5
+    await ticker.stop()
+
+    # все 100 сообщений ждут правку, но бюджет 20/с на 0.5с плюс стартовый запас в 20 правок
+    assert 20 <= len(bot.edits) <= 20 * 0.5 + 20 + 1
+
+
+@pytest.mark.asyncio
+async def test_interval_grows_with_load():
+    ticker = ProgressTicker(FakeBot(), edits_per_second=10, min_interval=1.2, max_interval=10)
+    ticker.track(1, chat_id=1, message_id=1, stages=STAGES, delays=[40, 40])
+    assert ticker.stats().interval == 1.2
+    for i in range(2, 51):
+        ticker.track(i, chat_id=i, message_id=i, stages=STAGES, delays=[40, 40])
+    assert ticker.stats().interval == 5.0
+    await ticker.stop()
+
+
+@pytest.mark.asyncio
+async def test_stage_change_beats_dot_animation():
+    bot = FakeBot()
+    ticker = ProgressTicker(bot, edits_per_second=5, min_interval=0.01, max_interval=5, tick=0.01)
+    for i in range(20):
+        ticker.track(i, chat_id=i, message_id=i, stages=STAGES, delays=[0.3, 60])
+    await asyncio.sleep(1.5)
+    await ticker.stop()
+
+    stage2 = [(ts, mid) for ts, mid, text in bot.edits if text.startswith("Выравниваю")]
+    # по бюджету 5/с все 20 смен этапа не успеют разом, но идут раньше любых точек
+    assert stage2
+    first_stage2 = min(ts for ts, _ in stage2)
+    dots_after = [ts for ts, _, text in bot.edits if text.startswith("Готовлю") and ts > first_stage2]
+    assert not dots_after
+
+
+@pytest.mark.asyncio
+async def test_retry_after_pauses_all_edits():
+    bot = FakeBot(retry_after=1)
+    ticker = ProgressTicker(bot, edits_per_second=50, min_interval=0.01, max_interval=5, tick=0.01)
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    ticker.push("q", chat_id=1, message_id=1, text="Вы в очереди: 3")
+    await asyncio.sleep(0.05)
+    ticker.push("q", chat_id=1, message_id=1, text="Вы в очереди: 2")
+    await asyncio.sleep(1.3)
+    await ticker.stop()
+
+    assert ticker.stats().retry_after == 1
+    assert [text for _, _, text in bot.edits] == ["Вы в очереди: 2"]
+    assert bot.edits[0][0] - started >= 1.0
+
+
+@pytest.mark.asyncio
+async def test_queue_text_then_first_stage_is_restored():
+    bot = FakeBot()
+    ticker = ProgressTicker(bot, edits_per_second=50, min_interval=10, max_interval=10, tick=0.01)
+    ticker.push(7, chat_id=1, message_id=70, text="Вы в очереди: 1")
+    await asyncio.sleep(0.05)
+    ticker.track(7, chat_id=1, message_id=70, stages=STAGES, delays=[60, 60], first_stage_shown=False)
+    await asyncio.sleep(0.05)
+    await ticker.stop()
+    assert [text for _, _, text in bot.edits] == ["Вы в очереди: 1", STAGES[0]]
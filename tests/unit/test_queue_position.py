@@ -0,0 +1,119 @@
+import json
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import StaticPool
+
+from app.application.services.progress_ticker import ProgressTicker
+from app.application.usecases.animate import run_generation as run_module
+from app.application.usecases.animate.run_generation import RunAnimateGeneration
+from app.domain.models.generation_job import QueuedJob
+from app.domain.models.user import Base
+from app.infrastructure.queue import job_runner as runner_module
+from app.infrastructure.queue.job_runner import JobRunner
+from app.infrastructure.queue.job_scheduler import FairScheduler
+
+
+class FakeBot:
+    async def edit_message_text(self, text, *, chat_id, message_id, parse_mode=None):
+        pass
+
+
+@pytest.mark.asyncio
+async def test_job_failing_before_run_releases_queue_position(monkeypatch):
+    ticker = ProgressTicker(FakeBot())
+    generation = RunAnimateGeneration(FakeBot(), ticker=ticker)
+    await generation.show_queue_position(QueuedJob(id=7, user_id=1, chat_id=1, progress_message_id=5), 3)
+    assert ticker.stats().live == 1
+
+    @asynccontextmanager
+    async def broken_workspace():
+        raise OSError("no space left")
+        yield
+
+    monkeypatch.setattr(run_module, "media_workspace", broken_workspace)
+    with pytest.raises(OSError):
+        await generation(SimpleNamespace(id=7))
+    await ticker.stop()
+    assert ticker.stats().live == 0
+    assert 7 not in generation._queue_shown
+
+
+@pytest_asyncio.fixture
+async def Session(monkeypatch):
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:", future=True, poolclass=StaticPool)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.execute(
+            text(
+                """
+                CREATE TABLE generation_jobs (
+                    id INTEGER PRIMARY KEY,
+                    user_id BIGINT NOT NULL,
+                    chat_id BIGINT NOT NULL,
+                    status TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    progress_message_id BIGINT
+                )
+                """
+            )
+        )
+        for job_id in (1, 2, 3):
+            await conn.execute(
+                text("INSERT INTO generation_jobs VALUES (:id, :id, :id, 'queued', :payload, 10)"),
+                {"id": job_id, "payload": json.dumps({})},
+            )
+    Session = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+    monkeypatch.setattr(runner_module, "async_session", Session)
+    yield Session
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_jobs_that_left_the_queue_are_released(Session):
+    shown: list[int] = []
+    left: list[int] = []
+
+    async def on_position(job, position):
+        shown.append(job.id)
+
+    runner = JobRunner(
+        lambda job: None,
+        scheduler=FairScheduler(global_cap=1),
+        on_queue_position=on_position,
+        on_queue_left=left.append,
+    )
+    await runner._refresh_positions()
+    assert sorted(shown) == [1, 2, 3]
+
+    async with Session() as s:
+        # задачу 1 отменили, задачу 2 забрал воркер этого процесса
+        await s.execute(text("UPDATE generation_jobs SET status = 'failed' WHERE id = 1"))
+        await s.execute(text("UPDATE generation_jobs SET status = 'running' WHERE id = 2"))
+        await s.commit()
+    runner._active.add(2)
+    await runner._refresh_positions()
+    assert left == [1]
+
+
+@pytest.mark.asyncio
+async def test_shard_sees_its_jobs_behind_other_shards_backlog(Session, monkeypatch):
+    monkeypatch.setattr(runner_module, "_QUEUE_WINDOW", 2)
+    shown: list[int] = []
+
+    async def on_position(job, position):
+        shown.append(job.id)
+
+    # задачи 1 и 2 — чужого шарда и занимают всё окно первой страницы
+    runner = JobRunner(
+        lambda job: None,
+        scheduler=FairScheduler(global_cap=1),
+        on_queue_position=on_position,
+        owns=lambda user_id: user_id == 3,
+    )
+    await runner._refresh_positions()
+    assert shown == [3]
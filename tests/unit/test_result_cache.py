@@ -0,0 +1,134 @@
+from dataclasses import replace
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from app.application.services import result_cache
+from app.application.services.result_cache import cache_key
+from app.bot.context import BotContext, State
+from app.bot.pages import animate_photo as page_module
+from app.bot.pages.animate_photo import AnimatePhoto
+from app.domain.models.user import Base, User
+from app.infrastructure.db.repositories.user_repo import UserRepo
+from app.settings import settings as app_settings
+
+
+@pytest_asyncio.fixture
+async def cache(monkeypatch):
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:", future=True)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.execute(
+            text(
+                """
+                CREATE TABLE generation_cache (
+                    key TEXT PRIMARY KEY,
+                    user_id BIGINT NOT NULL,
+                    file_id TEXT NOT NULL,
+                    media_type TEXT NOT NULL DEFAULT 'video',
+                    hits INTEGER NOT NULL DEFAULT 0,
+                    created_at TIMESTAMP NOT NULL,
+                    last_hit_at TIMESTAMP
+                )
+                """
+            )
+        )
+    Session = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+    monkeypatch.setattr(result_cache, "async_session", Session)
+    monkeypatch.setattr(page_module, "async_session", Session)
+    monkeypatch.setattr(result_cache, "settings", replace(app_settings, RESULT_CACHE_TTL=3600, RESULT_CACHE_MAX_ENTRIES=2, RESULT_CACHE_EVICT_EVERY=1))
+    monkeypatch.setattr(result_cache, "_hits", 0)
+    monkeypatch.setattr(result_cache, "_misses", 0)
+    monkeypatch.setattr(result_cache, "_stores", 0)
+    yield Session
+    await engine.dispose()
+
+
+def test_key_ignores_case_and_spacing_but_not_aspect():
+    base = cache_key(user_id=1, photo_unique_id="u1", prompt="Smile  and wave", aspect="9:16", model="kling-v1")
+    assert base == cache_key(user_id=1, photo_unique_id="u1", prompt=" smile and WAVE ", aspect="9:16", model="kling-v1")
+    assert base != cache_key(user_id=1, photo_unique_id="u1", prompt="smile and wave", aspect="16:9", model="kling-v1")
+    assert base != cache_key(user_id=1, photo_unique_id="u1", prompt="smile and wave", aspect="9:16", model="kling-v2")
+    assert base != cache_key(user_id=1, photo_unique_id="u2", prompt="smile and wave", aspect="9:16", model="kling-v1")
+
+
+@pytest.mark.asyncio
+async def test_other_users_never_get_the_result(cache):
+    # пересланное фото сохраняет file_unique_id — чужой запрос с ним кэш не обслуживает
+    req = dict(photo_unique_id="u1", prompt="smile", aspect="9:16", model="kling-v1")
+    await result_cache.remember(user_id=1, **req, file_id="VID1")
+    assert await result_cache.lookup(user_id=2, **req) is None
+    assert (await result_cache.lookup(user_id=1, **req)).file_id == "VID1"
+
+
+@pytest.mark.asyncio
+async def test_rerun_of_same_request_hits_cache(cache):
+    req = dict(user_id=1, photo_unique_id="u1", prompt="smile", aspect="9:16", model="kling-v1")
+    assert await result_cache.lookup(**req) is None
+    await result_cache.remember(**req, file_id="VID1")
+
+    hit = await result_cache.lookup(**{**req, "prompt": "  Smile"})
+    assert hit is not None and hit.file_id == "VID1" and hit.media_type == "video"
+
+    stats = result_cache.get_stats()
+    assert (stats.hits, stats.misses, stats.stores) == (1, 1, 1)
+    assert stats.hit_rate == 0.5
+
+
+@pytest.mark.asyncio
+async def test_expired_entries_miss(cache, monkeypatch):
+    req = dict(user_id=1, photo_unique_id="u1", prompt="smile", aspect="9:16", model="kling-v1")
+    await result_cache.remember(**req, file_id="VID1")
+    async with cache() as s:
+        await s.execute(text("UPDATE generation_cache SET created_at = '2000-01-01 00:00:00'"))
+        await s.commit()
+    assert await result_cache.lookup(**req) is None
+
+
+@pytest.mark.asyncio
+async def test_least_recently_used_entries_are_evicted(cache):
+    reqs = [dict(user_id=1, photo_unique_id=f"u{i}", prompt="p", aspect="9:16", model="kling-v1") for i in range(3)]
+    await result_cache.remember(**reqs[0], file_id="A")
+    await result_cache.remember(**reqs[1], file_id="B")
+    assert await result_cache.lookup(**reqs[0]) is not None  # A теперь свежее B
+    await result_cache.remember(**reqs[2], file_id="C")
+
+    assert await result_cache.lookup(**reqs[1]) is None
+    assert (await result_cache.lookup(**reqs[0])).file_id == "A"
+    assert (await result_cache.lookup(**reqs[2])).file_id == "C"
+
+
+class FakeBot:
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.sent: list[str] = []
+
+    async def send_video(self, chat_id, file_id, **kwargs):
+        if self.fail:
+            raise RuntimeError("wrong file identifier")
+        self.sent.append(file_id)
+
+
+async def _animate_balance(Session) -> int:
+    async with Session() as s:
+        return (await UserRepo(s).get(1)).animate_balance_tokens
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("balance, fail, sent, left", [(1, False, True, 0), (0, False, False, 0), (1, True, False, 1)])
+async def test_cached_result_is_paid_before_it_is_sent(cache, balance, fail, sent, left):
+    async with cache() as s:
+        s.add(User(telegram_id=1, internal_id=10, username="u", balance_tokens=0, animate_balance_tokens=balance, friends_count=0))
+        await s.commit()
+    await result_cache.remember(
+        user_id=1, photo_unique_id="u1", prompt="smile", aspect="9:16", model=page_module.DEFAULT_MODEL, file_id="VID1"
+    )
+    state = State(animate_photo_unique_id="u1", animate_photo_prompt="smile", video_format="9:16")
+    bot = FakeBot(fail=fail)
+
+    assert await AnimatePhoto()._send_cached(BotContext(user_id=1, state=state), bot, 1) is sent
+    # без оплаты видео не уходит; не дошедшее видео возвращает списание
+    assert bot.sent == (["VID1"] if sent else [])
+    assert await _animate_balance(cache) == left
@@ -0,0 +1,113 @@
+import time
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import StaticPool
+
+from app.application.services.message_bus import subscribe, unsubscribe
+from app.bot import context as context_module
+from app.bot.context import BotContext, State
+from app.bot.snapshot_cache import SnapshotCache
+from app.domain.models.user import Base, User
+from app.infrastructure.db.repositories.user_repo import USER_CHANGED_CHANNEL, UserRepo
+
+
+def test_cache_expires_and_invalidates():
+    cache = SnapshotCache(ttl=0.05)
+    cache.put(1, {"balance_tokens": 5}, generation=cache.generation)
+    snap = cache.get(1)
+    assert snap == {"balance_tokens": 5}
+    # страница меняет свою копию, а не общий снапшот
+    snap["balance_tokens"] = 0
+    assert cache.get(1) == {"balance_tokens": 5}
+
+    cache.invalidate(1)
+    assert cache.get(1) is None
+    assert cache.stats().invalidations == 1
+
+    cache.put(2, {"balance_tokens": 1}, generation=cache.generation)
+    time.sleep(0.06)
+    assert cache.get(2) is None
+
+
+def test_load_started_before_invalidation_is_not_cached():
+    cache = SnapshotCache(ttl=30)
+    generation = cache.generation
+    # пока снапшот читался, другой апдейт записал пользователя
+    cache.invalidate(1)
+    cache.put(1, {"balance_tokens": 5}, generation=generation)
+    assert cache.get(1) is None
+
+
+@pytest_asyncio.fixture
+async def engine():
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:", future=True, poolclass=StaticPool)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    yield engine
+    await engine.dispose()
+
+
+@pytest_asyncio.fixture
+async def Session(engine):
+    Session = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+    async with Session() as s:
+        s.add(User(telegram_id=1, internal_id=1, username="u", balance_tokens=0, animate_balance_tokens=3, friends_count=0))
+        await s.commit()
+    return Session
+
+
+@pytest.mark.asyncio
+async def test_user_changes_are_published_only_after_commit(Session):
+    events: list[dict] = []
+    subscribe(USER_CHANGED_CHANNEL, events.append)
+    try:
+        async with Session() as s:
+            await UserRepo(s).set_email(telegram_id=1, email="x@y.z")
+            await UserRepo(s).inc_balance(telegram_id=1, delta=2, bucket="animate")
+            assert events == []
+            await s.commit()
+        assert sorted(e["fields"][0] for e in events) == ["balance", "email"]
+
+        events.clear()
+        async with Session() as s:
+            await UserRepo(s).inc_balance(telegram_id=1, delta=5, bucket="animate")
+            await s.rollback()
+            await s.commit()
+        assert events == []
+    finally:
+        unsubscribe(USER_CHANGED_CHANNEL, events.append)
+
+
+@pytest.mark.asyncio
+async def test_page_renders_reuse_snapshot_until_user_changes(engine, Session, monkeypatch):
+    cache = SnapshotCache(ttl=30)
+    monkeypatch.setattr(context_module, "async_session", Session)
+    monkeypatch.setattr(context_module, "get_snapshot_cache", lambda: cache)
+    subscribe(USER_CHANGED_CHANNEL, cache.on_user_changed)
+    statements: list[str] = []
+    listener = lambda *args: statements.append(args[2])  # noqa: E731
+    event.listen(engine.sync_engine, "before_cursor_execute", listener)
+    try:
+        first = BotContext(user_id=1, state=State())
+        assert (await first.ensure_snapshot())["animate_balance_tokens"] == 3
+        loaded = len(statements)
+        assert loaded > 0
+
+        # следующий апдейт и повторная проверка после handle — без обращений к БД
+        second = BotContext(user_id=1, state=State())
+        await second.ensure_snapshot()
+        await second.ensure_snapshot(refresh=True)
+        assert len(statements) == loaded
+
+        async with Session() as s:
+            await UserRepo(s).inc_balance(telegram_id=1, delta=4, bucket="animate")
+            await s.commit()
+        statements.clear()
+        assert (await second.ensure_snapshot(refresh=True))["animate_balance_tokens"] == 7
+        assert statements
+    finally:
+        event.remove(engine.sync_engine, "before_cursor_execute", listener)
+        unsubscribe(USER_CHANGED_CHANNEL, cache.on_user_changed)
@@ -0,0 +1,103 @@
+import pytest
+import pytest_asyncio
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import StaticPool
+
+from app.bot import context as context_module
+from app.bot.context import BotContext, State, resolve_view
+from app.bot.router import PAGE_INDEX, route
+from app.bot.snapshot_cache import SnapshotCache
+from app.domain.models.user import Base, User
+from app.infrastructure.db.repositories.user_repo import UserRepo
+
+
+@pytest_asyncio.fixture
+async def engine():
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:", future=True, poolclass=StaticPool)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    Session = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+    async with Session() as s:
+        for telegram_id, internal_id in [(1, 10), (2, 20)]:
+            s.add(
+                User(
+                    telegram_id=telegram_id,
+                    internal_id=internal_id,
+                    username=f"u{telegram_id}",
+                    balance_tokens=0,
+                    animate_balance_tokens=4,
+                    avatar_balance_tokens=0,
+                    friends_count=0,
+                )
+            )
+        await s.flush()
+        await UserRepo(s)._log_referral_bonus(
+            ref_id=None, referrer_user_id=1, referred_user_id=2, bonus_type="deposit", amount=50
+        )
+        await s.commit()
+    yield engine
+    await engine.dispose()
+
+
+@pytest.fixture
+def statements(engine, monkeypatch):
+    monkeypatch.setattr(
+        context_module, "async_session", async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+    )
+    monkeypatch.setattr(context_module, "get_snapshot_cache", lambda: SnapshotCache(ttl=0))
+    seen: list[str] = []
+    listener = lambda *args: seen.append(args[2])  # noqa: E731
+    event.listen(engine.sync_engine, "before_cursor_execute", listener)
+    yield seen
+    event.remove(engine.sync_engine, "before_cursor_execute", listener)
+
+
+def _touches_referrals(seen: list[str]) -> bool:
+    return any("JOIN users r1" in statement for statement in seen)
+
+
+@pytest.mark.asyncio
+async def test_pages_load_only_declared_groups(statements):
+    await route(BotContext(user_id=1, state=State(current_page="support")), "")
+    assert statements == []
+
+    await route(BotContext(user_id=1, state=State(current_page="account.topup")), "")
+    assert statements and not _touches_referrals(statements)
+
+    statements.clear()
+    await route(BotContext(user_id=1, state=State(current_page="account.referral")), "")
+    assert _touches_referrals(statements)
+
+
+@pytest.mark.asyncio
+async def test_reply_placeholders_pull_missing_groups(statements):
+    ctx = BotContext(user_id=1, state=State())
+    ctx.snapshot_groups = PAGE_INDEX["account.topup"].snapshot_groups
+    await ctx.ensure_snapshot()
+    assert not _touches_referrals(statements)
+
+    view = ctx.reply("{animate_balance_tokens} / {friends_count} / {unknown}", None)
+    assert view["text"] == "4 / {friends_count} / {unknown}"
+
+    view = await resolve_view(view)
+    assert view["text"] == "4 / 1 / {unknown}"
+    assert "_snapshot_pending" not in view
+    assert _touches_referrals(statements)
+
+    # группа уже в контексте — следующий текст форматируется сразу
+    statements.clear()
+    view = ctx.reply("{friends_count}", None)
+    assert await resolve_view(view) == {"text": "1", "buttons": None}
+    assert statements == []
+
+
+def test_cache_serves_only_covered_groups():
+    cache = SnapshotCache(ttl=30)
+    cache.put(1, {"animate_balance_tokens": 4}, groups={"balances"}, generation=cache.generation)
+    assert cache.get(1, {"balances"}) == {"animate_balance_tokens": 4}
+    assert cache.get(1, {"referrals"}) is None
+    assert cache.get(1) is None
+
+    cache.put(1, {"animate_balance_tokens": 4, "friends_count": 1}, groups={"balances", "referrals"}, generation=cache.generation)
+    assert cache.get(1) == {"animate_balance_tokens": 4, "friends_count": 1}
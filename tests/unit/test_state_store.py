@@ -0,0 +1,169 @@
+import asyncio
+import json
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from app.bot.context import State
+from app.bot.state_store import DbStateBackend, StateStore, dump_state, load_state
+
+
+@pytest_asyncio.fixture
+async def backend():
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:", future=True)
+    async with engine.begin() as conn:
+        await conn.execute(
+            text(
+                """
+                CREATE TABLE bot_states (
+                    user_id BIGINT PRIMARY KEY,
+                    data TEXT NOT NULL,
+                    updated_at TIMESTAMP NOT NULL
+                )
+                """
+            )
+        )
+    Session = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+    yield DbStateBackend(Session)
+    await engine.dispose()
+
+
+def test_serialization_keeps_only_non_defaults():
+    st = State(current_page="flow.animate", animate_photo_prompt="улыбка", pending_payment={"rub_amount": 290})
+    st.animate_chat_id = 42
+    raw = dump_state(st)
+    assert json.loads(raw) == {
+        "current_page": "flow.animate",
+        "animate_photo_prompt": "улыбка",
+        "pending_payment": {"rub_amount": 290},
+        "animate_chat_id": 42,
+    }
+    restored = load_state(raw)
+    assert restored.animate_photo_prompt == "улыбка"
+    assert restored.pending_payment == {"rub_amount": 290}
+    assert dump_state(State()) == "{}"
+
+
+@pytest.mark.asyncio
+async def test_write_behind_survives_restart(backend):
+    store = StateStore(backend)
+    st = await store.get(1)
+    st.animate_photo_file_id = "photo-1"
+    st.video_format = "16:9"
+    await store.get(2)  # только прочитали — писать нечего
+
+    assert await store.flush() == 1
+    assert await store.flush() == 0
+
+    restarted = StateStore(backend)
+    st = await restarted.get(1)
+    assert st.animate_photo_file_id == "photo-1"
+    assert st.video_format == "16:9"
+    assert (await restarted.get(2)) == State()
+
+
+@pytest.mark.asyncio
+async def test_memory_is_bounded_and_evicted_changes_are_kept(backend):
+    store = StateStore(backend, max_entries=2)
+    for uid in (1, 2, 3):
+        st = await store.get(uid)
+        st.current_page = f"page-{uid}"
+
+    stats = store.stats()
+    assert stats.resident == 2 and stats.evictions == 1 and stats.pending == 1
+    # вытесненное, но ещё не записанное состояние читается из очереди записи
+    assert store.peek(1) is None
+    assert (await store.get(1)).current_page == "page-1"
+
+    await store.flush(full=True)
+    assert store.stats().pending == 0
+    assert set(await backend.load_many([1, 2, 3])) == {1, 2, 3}
+
+
+@pytest.mark.asyncio
+async def test_evicted_state_is_readable_while_its_write_is_in_flight(backend):
+    store = StateStore(backend, max_entries=1)
+    (await store.get(1)).current_page = "page-1"
+    await store.get(2)  # вытесняет пользователя 1 в очередь записи
+
+    saving, release = asyncio.Event(), asyncio.Event()
+    save_many = backend.save_many
+
+    async def slow_save(states):
+        saving.set()
+        await release.wait()
+        await save_many(states)
+
+    backend.save_many = slow_save
+    flush = asyncio.create_task(store.flush())
+    await saving.wait()
+    # в БД пользователя 1 ещё нет, но читается записываемая версия, а не пустое состояние
+    assert (await store.get(1)).current_page == "page-1"
+    release.set()
+    assert await flush == 1
+
+
+@pytest.mark.asyncio
+async def test_idle_ttl_reloads_from_durable_tier(backend):
+    store = StateStore(backend, ttl=0)
+    st = await store.get(5)
+    st.email = "a@b.c"
+    again = await store.get(5)
+    assert again is not st
+    assert again.email == "a@b.c"
+    await store.stop()
+    assert json.loads((await backend.load_many([5]))[5]) == {"email": "a@b.c"}
+
+
+@pytest.mark.asyncio
+async def test_memory_only_store_never_writes():
+    store = StateStore(None, max_entries=1)
+    (await store.get(1)).email = "x@y.z"
+    assert await store.flush() == 0
+    await store.get(2)
+    assert (await store.get(1)).email is None
+
+
+@pytest.mark.asyncio
+async def test_pinned_state_is_not_evicted_while_handler_holds_it(backend):
+    store = StateStore(backend, max_entries=1, ttl=0)
+    async with store.pinned(1):
+        st = await store.get(1)
+        await store.get(2)  # LRU вытеснил бы пользователя 1
+        store._expire(float("inf"))
+        st.current_page = "page-1"
+        assert await store.get(1) is st
+    assert store.peek(1) is st
+
+    await store.get(3)  # после выхода из блока вытесняется как обычно
+    assert store.peek(1) is None
+    assert (await store.get(1)).current_page == "page-1"
+
+
+@pytest.mark.asyncio
+async def test_change_made_during_flush_is_written_next_time(backend):
+    store = StateStore(backend)
+    st = await store.get(1)
+    st.current_page = "first"
+
+    saving, release = asyncio.Event(), asyncio.Event()
+    save_many = backend.save_many
+
+    async def slow_save(states):
+        saving.set()
+        await release.wait()
+        await save_many(states)
+
+    backend.save_many = slow_save
+    flush = asyncio.create_task(store.flush())
+    await saving.wait()
+    # обработчик держит объект и меняет его без нового get
+    st.current_page = "second"
+    release.set()
+    assert await flush == 1
+
+    backend.save_many = save_many
+    assert await store.flush() == 1
+    assert json.loads((await backend.load_many([1]))[1]) == {"current_page": "second"}
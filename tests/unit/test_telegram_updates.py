@@ -0,0 +1,175 @@
+import asyncio
+from collections import Counter
+from dataclasses import replace
+
+import httpx
+import pytest
+import pytest_asyncio
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import StaticPool
+
+from app.api.http import app
+from app.api.webhooks import telegram as webhook_module
+from app.infrastructure.db.base import get_session
+from app.infrastructure.db.repositories.update_repo import UpdateRepo
+from app.infrastructure.telegram.mailboxes import UserMailboxes
+from app.infrastructure.telegram.sharding import HashRing, update_user_id
+from app.infrastructure.telegram.updates import UpdateConsumer, ingest_update
+from app.settings import settings as app_settings
+
+
+def _message(update_id: int, user_id: int, text_: str = "hi") -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "u"},
+            "text": text_,
+        },
+    }
+
+
+@pytest_asyncio.fixture
+async def Session():
+    # одна общая in-memory база: воркер и тест открывают сессии параллельно
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:", future=True, poolclass=StaticPool)
+    async with engine.begin() as conn:
+        await conn.execute(
+            text(
+                """
+                CREATE TABLE telegram_updates (
+                    update_id BIGINT PRIMARY KEY,
+                    shard INTEGER NOT NULL,
+                    user_id BIGINT,
+                    payload TEXT NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    taken_at TIMESTAMP,
+                    done_at TIMESTAMP
+                )
+                """
+            )
+        )
+    yield async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+    await engine.dispose()
+
+
+def test_ring_is_balanced_and_resize_moves_few_users():
+    users = range(1, 20001)
+    four = HashRing(4)
+    owners = {uid: four.shard_for(uid) for uid in users}
+    counts = Counter(owners.values())
+    assert set(counts) == {0, 1, 2, 3}
+    assert max(counts.values()) / min(counts.values()) < 1.6
+    assert all(four.shard_for(uid) == owners[uid] for uid in range(1, 200))
+
+    five = HashRing(5)
+    moved = sum(1 for uid in users if five.shard_for(uid) != owners[uid])
+    # при добавлении пятого шарда переезжает около 1/5 пользователей, а не почти все
+    assert moved / len(users) < 0.3
+
+
+def test_update_user_id_covers_messages_callbacks_and_inline():
+    assert update_user_id(_message(1, 42)) == 42
+    assert update_user_id({"update_id": 2, "callback_query": {"id": "x", "from": {"id": 7}}}) == 7
+    assert update_user_id({"update_id": 3, "inline_query": {"id": "q", "from": {"id": 9}, "query": ""}}) == 9
+    assert update_user_id({"update_id": 4, "poll": {"id": "p"}}) is None
+
+
+@pytest.mark.asyncio
+async def test_duplicate_delivery_is_ingested_once(Session):
+    async with Session() as s:
+        assert await ingest_update(s, _message(10, 1), shards=1) == 0
+        assert await ingest_update(s, _message(10, 1), shards=1) is None
+        await s.commit()
+    async with Session() as s:
+        assert (await s.execute(text("SELECT COUNT(*) FROM telegram_updates"))).scalar() == 1
+
+
+@pytest.mark.asyncio
+async def test_consumer_keeps_per_user_order_and_runs_users_in_parallel(Session):
+    async with Session() as s:
+        for update_id, user_id, text_ in [(1, 100, "a1"), (2, 200, "b1"), (3, 100, "a2"), (4, 100, "a3")]:
+            await ingest_update(s, _message(update_id, user_id, text_), shards=1)
+        await s.commit()
+
+    log: list[str] = []
+    done = asyncio.Event()
+    mailboxes = UserMailboxes()
+
+    async def handler(update: dict) -> None:
+        # как MailboxMiddleware диспетчера в боте
+        async with mailboxes.turn(update_user_id(update)):
+            text_ = update["message"]["text"]
+            if text_ == "a1":
+                # медленный первый апдейт пользователя 100 не должен задержать пользователя 200
+                await asyncio.sleep(0.1)
+            log.append(text_)
+        if len(log) == 4:
+            done.set()
+
+    consumer = UpdateConsumer(handler, shard=0, poll_interval=0.05, session_factory=Session)
+    consumer.start()
+    await asyncio.wait_for(done.wait(), timeout=2)
+    await consumer.stop()
+
+    assert log == ["b1", "a1", "a2", "a3"]
+    assert consumer.handled == 4
+    async with Session() as s:
+        assert (await s.execute(text("SELECT COUNT(*) FROM telegram_updates WHERE done_at IS NULL"))).scalar() == 0
+        # обработанный апдейт ещё лежит в таблице и отсекает повторную доставку
+        assert await ingest_update(s, _message(1, 100, "a1"), shards=1) is None
+
+
+@pytest.mark.asyncio
+async def test_updates_taken_by_a_crashed_worker_are_handled_after_restart(Session):
+    async with Session() as s:
+        for update_id in (1, 2):
+            await ingest_update(s, _message(update_id, 100), shards=1)
+        await s.commit()
+    # прошлый процесс шарда взял апдейты и упал, не обработав их
+    async with Session() as s:
+        assert len(await UpdateRepo(s).take(shard=0)) == 2
+        await s.commit()
+
+    seen: list[int] = []
+    done = asyncio.Event()
+
+    async def handler(update: dict) -> None:
+        seen.append(update["update_id"])
+        if len(seen) == 2:
+            done.set()
+
+    consumer = UpdateConsumer(handler, shard=0, poll_interval=0.05, retention=0, session_factory=Session)
+    consumer.start()
+    await asyncio.wait_for(done.wait(), timeout=2)
+    await consumer.stop()
+    assert seen == [1, 2]
+
+    async with Session() as s:
+        assert (await s.execute(text("SELECT COUNT(*) FROM telegram_updates WHERE done_at IS NULL"))).scalar() == 0
+        assert await UpdateRepo(s).purge(shard=0, retention_seconds=0) == 2
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("secret", ["", "s3cret"])
+async def test_webhook_rejects_updates_without_the_secret(monkeypatch, secret):
+    monkeypatch.setattr(webhook_module, "settings", replace(app_settings, TELEGRAM_WEBHOOK_SECRET=secret))
+
+    async def _no_session():
+        yield None
+
+    app.dependency_overrides[get_session] = _no_session
+    try:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://api.test") as client:
+            # без заголовка — в том числе когда секрет не настроен
+            res = await client.post("/webhook/telegram", json=_message(1, 1))
+            assert res.status_code == 403
+            res = await client.post(
+                "/webhook/telegram", json=_message(1, 1), headers={"X-Telegram-Bot-Api-Secret-Token": "wrong"}
+            )
+            assert res.status_code == 403
+    finally:
+        app.dependency_overrides.clear()
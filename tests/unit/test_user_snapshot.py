@@ -0,0 +1,111 @@
+import pytest
+import pytest_asyncio
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from app.domain.models.user import Base, ReferralBonus, User
+from app.infrastructure.db.repositories.user_repo import UserRepo
+
+
+@pytest_asyncio.fixture
+async def engine():
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:", future=True)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    yield engine
+    await engine.dispose()
+
+
+@pytest_asyncio.fixture
+async def session(engine):
+    Session = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+    async with Session() as session:
+        yield session
+
+
+def _user(telegram_id: int, internal_id: int, username: str | None = None, **kw) -> User:
+    fields = dict(balance_tokens=0, animate_balance_tokens=0, avatar_balance_tokens=0, friends_count=0)
+    fields.update(kw)
+    return User(telegram_id=telegram_id, internal_id=internal_id, username=username, **fields)
+
+
+async def _bonus(session, referred: int, amount: int, referrer: int = 1) -> None:
+    await UserRepo(session)._log_referral_bonus(
+        ref_id=None, referrer_user_id=referrer, referred_user_id=referred, bonus_type="deposit", amount=amount
+    )
+
+
+@pytest.mark.asyncio
+async def test_snapshot_collects_balances_and_recent_referrals(engine, session):
+    session.add_all(
+        [
+            _user(1, 10, "inviter", balance_tokens=5, animate_balance_tokens=20, email="a@b.c"),
+            _user(2, 20, "first"),
+            _user(3, 30, None),
+            _user(4, 40, "third"),
+            _user(5, 50, "fourth"),
+        ]
+    )
+    await session.flush()
+    for referred, amount in [(2, 100), (3, 100), (4, 100), (5, 50), (5, 25)]:
+        await _bonus(session, referred, amount)
+    await session.commit()
+
+    statements: list[str] = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine.sync_engine, "before_cursor_execute", count)
+    try:
+        snap = await UserRepo(session).snapshot(telegram_id=1)
+    finally:
+        event.remove(engine.sync_engine, "before_cursor_execute", count)
+
+    # счётчики и последние рефералы лежат в users: один запрос, сколько бы ни было бонусов
+    assert len(statements) == 1
+    assert "referral_bonuses" not in statements[0]
+    assert snap["user_id"] == 1
+    assert snap["internal_id"] == 10
+    assert snap["balance_tokens"] == 25
+    assert snap["animate_balance_tokens"] == 20
+    assert snap["friends_count"] == 4
+    assert snap["invitee_bonus"] == 375
+    assert snap["recent_refs"] == "@fourth\n@fourth\n@third"
+    assert snap["email"] == "a@b.c"
+
+
+@pytest.mark.asyncio
+async def test_snapshot_labels_referrals_without_username(session):
+    session.add_all([_user(1, 10, "inviter", friends_count=7), _user(3, 30, None)])
+    await session.flush()
+    await _bonus(session, 3, 10)
+    await session.commit()
+
+    snap = await UserRepo(session).snapshot(telegram_id=1)
+    assert snap["recent_refs"] == "ID 30"
+    # счётчик в users больше числа строк в referral_bonuses — берём больший
+    assert snap["friends_count"] == 7
+
+
+@pytest.mark.asyncio
+async def test_referral_counters_check_finds_and_fixes_drift(session):
+    session.add_all([_user(1, 10, "inviter"), _user(2, 20, "a"), _user(3, 30, "b")])
+    await session.flush()
+    await _bonus(session, 2, 100)
+    await _bonus(session, 2, 30)
+    await session.commit()
+    repo = UserRepo(session)
+    assert await repo.check_referral_counters() == []
+
+    # бонус, записанный в обход UserRepo, счётчики не видят
+    session.add(ReferralBonus(referrer_user_id=1, referred_user_id=3, bonus_type="deposit", amount=5))
+    await session.commit()
+    assert await repo.check_referral_counters(fix=True) == [1]
+    await session.commit()
+    assert await repo.check_referral_counters() == []
+
+    snap = await repo.snapshot(telegram_id=1)
+    assert snap["friends_count"] == 2
+    assert snap["invitee_bonus"] == 135
+    assert snap["recent_refs"] == "@b\n@a\n@a"
@@ -0,0 +1,83 @@
+import pytest
+import pytest_asyncio
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from app.domain.models.user import Base, User
+from app.infrastructure.db.repositories.user_repo import UserRepo, _upsert_statement
+
+
+@pytest_asyncio.fixture
+async def engine():
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:", future=True)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    yield engine
+    await engine.dispose()
+
+
+@pytest_asyncio.fixture
+async def session(engine):
+    Session = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+    async with Session() as session:
+        session.add(User(telegram_id=1, internal_id=10, username="u", balance_tokens=0, animate_balance_tokens=2, friends_count=0))
+        await session.commit()
+        yield session
+
+
+@pytest.fixture
+def statements(engine):
+    seen: list[str] = []
+    listener = lambda *args: seen.append(" ".join(args[2].split()))  # noqa: E731
+    event.listen(engine.sync_engine, "before_cursor_execute", listener)
+    yield seen
+    event.remove(engine.sync_engine, "before_cursor_execute", listener)
+
+
+@pytest.mark.asyncio
+async def test_inc_balance_is_a_single_update(session, statements):
+    assert await UserRepo(session).inc_balance(telegram_id=1, delta=5, bucket="animate") == 7
+    assert len(statements) == 1
+    assert statements[0].startswith("UPDATE users SET animate_balance_tokens")
+    assert "RETURNING" in statements[0]
+
+
+@pytest.mark.asyncio
+async def test_inc_balance_creates_missing_user(session, statements):
+    assert await UserRepo(session).inc_balance(telegram_id=2, delta=3, bucket="animate") == 3
+    # UPDATE не нашёл строку -> пользователь создаётся -> тот же UPDATE ещё раз
+    assert statements[0].startswith("UPDATE users") and statements[-1].startswith("UPDATE users")
+    assert any(statement.startswith("INSERT INTO users") for statement in statements)
+    assert (await UserRepo(session).get(2)).animate_balance_tokens == 3
+
+
+@pytest.mark.asyncio
+async def test_get_or_create_existing_user_statements(session, statements):
+    repo = UserRepo(session)
+    _, created = await repo.get_or_create(1, username="u", return_created=True)
+    assert created is False
+    assert len(statements) == 1
+
+    statements.clear()
+    user = await repo.get_or_create(1, username="renamed")
+    assert user.username == "renamed"
+    assert len(statements) == 2
+
+
+def _compiled(refreshed: dict) -> str:
+    new_user = dict(refreshed, invited_by=None, referred_id=None, segment="lead")
+    return str(_upsert_statement(1, refreshed, new_user).compile(dialect=postgresql.dialect()))
+
+
+def test_postgres_upsert_is_one_statement():
+    sql = _compiled({"username": "u", "first_name": "F"})
+    assert sql.startswith("INSERT INTO users")
+    assert "ON CONFLICT (telegram_id) DO UPDATE SET username = excluded.username, first_name = excluded.first_name" in sql
+    # без изменений строка не переписывается
+    assert "WHERE users.username IS DISTINCT FROM excluded.username OR users.first_name IS DISTINCT FROM excluded.first_name" in sql
+    assert "xmax = 0 AS inserted" in sql
+    # номер из последовательности — только если пользователя ещё нет
+    assert "coalesce((SELECT users.internal_id" in sql and "nextval(" in sql
+
+    assert "ON CONFLICT (telegram_id) DO NOTHING" in _compiled({})